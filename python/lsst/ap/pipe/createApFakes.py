@@ -19,18 +19,21 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import dataclasses
 import numpy as np
 import pandas as pd
-import uuid
+import pyarrow as pa
 
 import logging
-from astropy.table import Table, vstack
+from astropy.table import Column, MaskedColumn, Table
 
+import lsst.geom as geom
 import lsst.pex.config as pexConfig
-from lsst.pipe.base import PipelineTask, PipelineTaskConfig, PipelineTaskConnections, Struct
+from lsst.pipe.base import NoWorkFound, PipelineTask, PipelineTaskConfig, PipelineTaskConnections, Struct
 import lsst.pipe.base.connectionTypes as connTypes
 from lsst.pipe.tasks.insertFakes import InsertFakesConfig
 from lsst.skymap import BaseSkyMap
+from lsst.sphgeom import ConvexPolygon
 
 from lsst.source.injection import generate_injection_catalog
 
@@ -41,7 +44,109 @@ __all__ = ["CreateRandomApFakesTask",
            "CreateRandomApFakesConnections",
            "CreateVisitDetectorFakesTask",
            "CreateVisitDetectorFakesConfig",
-           "CreateVisitDetectorFakesConnections"]
+           "CreateVisitDetectorFakesConnections",
+           "CreateVisitFakesTask",
+           "CreateVisitFakesConfig",
+           "CreateVisitFakesConnections",
+           "CreateVisitDetectorFakeHostsTask",
+           "CreateVisitDetectorFakeHostsConfig",
+           "CreateVisitDetectorFakeHostsConnections"]
+
+# Injection IDs must fit in 24 bits.
+_INJECTION_ID_SPACE = 1 << 24
+
+# Source catalog columns used to select hosts and place hosted fakes; the
+# calibrated model fluxes are computed separately.
+_HOST_COLUMNS = [
+    "id",
+    "coord_ra",
+    "coord_dec",
+    "slot_Centroid_x",
+    "slot_Centroid_y",
+    "slot_Shape_xx",
+    "slot_Shape_xy",
+    "slot_Shape_yy",
+    "sky_source",
+    "base_ClassificationSizeExtendedness_flag",
+    "base_ClassificationSizeExtendedness_value",
+    "base_ClassificationExtendedness_flag",
+    "base_ClassificationExtendedness_value",
+    "slot_Shape_flag",
+    "slot_Centroid_flag",
+    "base_PixelFlags_flag",
+]
+
+# Columns of the selected hosts kept in a host index, besides the shape
+# parameters computed from the moments.
+_HOST_INDEX_COLUMNS = [
+    "id",
+    "coord_ra",
+    "coord_dec",
+    "slot_Centroid_x",
+    "slot_Centroid_y",
+    "slot_ModelFlux_flux",
+    "slot_ModelFlux_mag",
+]
+
+
+def _remap_ids(ids, old_ids, new_ids):
+    """Map each of ``ids`` from ``old_ids`` to the matching ``new_ids``.
+
+    Parameters
+    ----------
+    ids : `numpy.ndarray` [`int`]
+        IDs to remap.
+    old_ids, new_ids : `numpy.ndarray` [`int`]
+        Parallel arrays defining the mapping. If an ID appears more than once
+        in ``old_ids``, its last occurrence wins.
+
+    Returns
+    -------
+    remapped : `numpy.ndarray` [`numpy.int64`]
+        ``ids`` with every value found in ``old_ids`` replaced; values that
+        are not in ``old_ids`` are returned unchanged.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    old_ids = np.asarray(old_ids, dtype=np.int64)
+    new_ids = np.asarray(new_ids, dtype=np.int64)
+    if len(old_ids) == 0:
+        return ids.copy()
+
+    # A stable sort keeps duplicates of an old ID in their original order,
+    # so the rightmost match is the last occurrence.
+    order = np.argsort(old_ids, kind="stable")
+    sorted_old_ids = old_ids[order]
+    position = np.searchsorted(sorted_old_ids, ids, side="right") - 1
+    found = position >= 0
+    found[found] = sorted_old_ids[position[found]] == ids[found]
+    return np.where(found, new_ids[order[np.maximum(position, 0)]], ids)
+
+
+def _make_detector_region(bbox, wcs, padding=10):
+    """Return the sky region covered by a detector.
+
+    This is the region that `lsst.afw.image.Exposure.getConvexPolygon`
+    returns, without needing the full exposure.
+
+    Parameters
+    ----------
+    bbox : `lsst.geom.Box2I`
+        Pixel bounding box of the detector.
+    wcs : `lsst.afw.geom.SkyWcs`
+        WCS of the detector.
+    padding : `int`, optional
+        Number of pixels to grow the bounding box by, as in
+        `~lsst.afw.image.Exposure.getConvexPolygon`.
+
+    Returns
+    -------
+    region : `lsst.sphgeom.ConvexPolygon`
+        Convex hull of the sky positions of the padded detector corners.
+    """
+    box = geom.Box2D(bbox)
+    box.grow(padding)
+    corners = wcs.pixelToSky(box.getCorners())
+    return ConvexPolygon.convexHull([corner.getVector() for corner in corners])
 
 
 class CreateRandomApFakesConnections(PipelineTaskConnections,
@@ -59,6 +164,24 @@ class CreateRandomApFakesConnections(PipelineTaskConnections,
         storageClass="DataFrame",
         dimensions=("tract", "skymap")
     )
+    patchFakeCats = connTypes.Output(
+        doc="Catalogs of fake sources to draw inputs from, one per patch "
+            "of the tract.",
+        name="fakeSourceCat_patch",
+        storageClass="ArrowTable",
+        dimensions=("tract", "patch", "skymap"),
+        multiple=True,
+    )
+
+    def __init__(self, *, config=None):
+        super().__init__(config=config)
+
+        if config.doGeneratePerPatch:
+            del self.fakeCat
+        else:
+            del self.patchFakeCats
+            if config.doWriteArrow:
+                self.fakeCat = dataclasses.replace(self.fakeCat, storageClass="ArrowTable")
 
 
 @deprecated(
@@ -123,6 +246,21 @@ class CreateRandomApFakesConfig(
         dtype=str,
         default="isTemplateSource"
     )
+    doGeneratePerPatch = pexConfig.Field(
+        doc="Generate and write one catalog per patch of the tract, instead "
+            "of a single catalog for the whole tract. Limits memory use for "
+            "high densities over large tracts.",
+        dtype=bool,
+        default=False,
+    )
+    doWriteArrow = pexConfig.Field(
+        doc="Write the tract catalog as an Arrow table instead of a pandas "
+            "DataFrame. Repeated columns (the per-band magnitudes and the "
+            "dummy shape columns) then share memory instead of being "
+            "copied. Per-patch catalogs are always Arrow tables.",
+        dtype=bool,
+        default=False,
+    )
 
 
 @deprecated(
@@ -144,8 +282,15 @@ class CreateRandomApFakesTask(PipelineTask):
         inputs = butlerQC.get(inputRefs)
         inputs["tractId"] = butlerQC.quantum.dataId["tract"]
 
-        outputs = self.run(**inputs)
-        butlerQC.put(outputs, outputRefs)
+        if self.config.doGeneratePerPatch:
+            patchRefs = {ref.dataId["patch"]: ref for ref in outputRefs.patchFakeCats}
+            # Write each patch as soon as it is generated, so that only one
+            # patch catalog is held in memory at a time.
+            for patchId, patchFakeCat in self.generatePatchCatalogs(patchIds=patchRefs.keys(), **inputs):
+                butlerQC.put(patchFakeCat, patchRefs[patchId])
+        else:
+            outputs = self.run(**inputs)
+            butlerQC.put(outputs, outputRefs)
 
     def run(self, tractId, skyMap):
         """Create a set of uniform random points that covers a tract.
@@ -159,45 +304,152 @@ class CreateRandomApFakesTask(PipelineTask):
 
         Returns
         -------
-        randoms : `pandas.DataFrame`
+        randoms : `pandas.DataFrame` or `pyarrow.Table`
             Catalog of random points covering the given tract. Follows the
             columns and format expected in `lsst.pipe.tasks.InsertFakes`.
+            An Arrow table if ``config.doWriteArrow`` is set.
         """
 
         tract = skyMap.generateTract(tractId)
         tractArea = tract.getOuterSkyPolygon().getBoundingBox().getArea()
         tractArea *= (180 / np.pi) ** 2
-        tractWcs = tract.getWcs()
         vertexList = tract.getVertexList()
         vertexRas = [vertex.getRa().asDegrees() for vertex in vertexList]
         vertexDecs = [vertex.getDec().asDegrees() for vertex in vertexList]
 
-        catalog = generate_injection_catalog(
+        randData = self._makeRandomColumns(
             ra_lim=sorted([np.min(vertexRas), np.max(vertexRas)]),
             dec_lim=sorted([np.min(vertexDecs), np.max(vertexDecs)]),
-            mag_lim=(self.config.magMin, self.config.magMax),
-            density=self.config.fakeDensity,
-            source_type="Star",
-            seed=str(tractId),
-            wcs=tractWcs
+            seed=[tractId],
+            wcs=tract.getWcs(),
         )
 
-        nFakes = len(catalog)
-
         self.log.info(
-            f"Creating {nFakes} star fakes over tractId={tractId} with "
+            f"Creating {len(randData['mag'])} star fakes over tractId={tractId} with "
             f" RA  in ({sorted([np.min(vertexRas), np.max(vertexRas)])} "
             f" Dec in ({sorted([np.min(vertexDecs), np.max(vertexDecs)])}), "
             f"area={tractArea:.4f} deg^2 and "
             f"magnitude range: [{self.config.magMin, self.config.magMax}]")
 
+        if self.config.doWriteArrow:
+            return Struct(fakeCat=self._makeArrowTable(randData))
+        return Struct(fakeCat=pd.DataFrame(data=randData))
+
+    def generatePatchCatalogs(self, tractId, skyMap, patchIds=None):
+        """Create uniform random points over a tract one patch at a time.
+
+        Parameters
+        ----------
+        tractId : `int`
+            Tract id to produce randoms over.
+        skyMap : `lsst.skymap.SkyMap`
+            Skymap to produce randoms over.
+        patchIds : iterable [`int`], optional
+            Sequential indices of the patches to produce randoms over. All
+            patches of the tract if not provided.
+
+        Yields
+        ------
+        patchId : `int`
+            Sequential index of the patch.
+        randoms : `pyarrow.Table`
+            Catalog of random points covering the inner region of the patch,
+            with the same columns as the output of `run`. The magnitude
+            columns of all bands share a single buffer. Inner regions do not
+            overlap, so the catalogs of different patches have no positions
+            in common, and their ``injection_id`` values are taken from
+            disjoint ranges.
+
+        Raises
+        ------
+        RuntimeError
+            Raised if a patch has more fakes than its range of
+            ``injection_id`` values.
+        """
+        tract = skyMap.generateTract(tractId)
+        tractWcs = tract.getWcs()
+        patchIds = None if patchIds is None else set(patchIds)
+        nPatchX, nPatchY = tract.getNumPatches()
+        idStride = _INJECTION_ID_SPACE // (nPatchX * nPatchY)
+
+        for patchInfo in tract:
+            patchId = patchInfo.getSequentialIndex()
+            if patchIds is not None and patchId not in patchIds:
+                continue
+            innerBox = geom.Box2D(patchInfo.getInnerBBox())
+            corners = tractWcs.pixelToSky(innerBox.getCorners())
+            patchRas = [corner.getRa().asDegrees() for corner in corners]
+            patchDecs = [corner.getDec().asDegrees() for corner in corners]
+
+            # The RA/Dec limits enclose the inner region, and overlap those of
+            # the neighbouring patches; only the fakes inside it are kept.
+            randData = self._makeRandomColumns(
+                ra_lim=sorted([np.min(patchRas), np.max(patchRas)]),
+                dec_lim=sorted([np.min(patchDecs), np.max(patchDecs)]),
+                seed=[tractId, patchId],
+                wcs=tractWcs,
+                pixelBox=innerBox,
+            )
+            nFakes = len(randData["mag"])
+            if nFakes > idStride:
+                raise RuntimeError(f"Patch {patchId} of tract {tractId} has {nFakes} fakes, more than the "
+                                   f"{idStride} injection IDs available to each patch.")
+            randData["injection_id"] = patchId*idStride + np.arange(nFakes, dtype=np.int64)
+            self.log.info(f"Creating {len(randData['mag'])} star fakes over tractId={tractId}, "
+                          f"patch={patchId}.")
+            yield patchId, self._makeArrowTable(randData)
+
+    def _makeRandomColumns(self, ra_lim, dec_lim, seed, wcs, pixelBox=None):
+        """Create the columns of a random fakes catalog.
+
+        Parameters
+        ----------
+        ra_lim, dec_lim : `list` [`float`]
+            Sorted RA and Dec limits, in degrees, to produce randoms over.
+        seed : `list` [`int`]
+            Seed for the fake IDs; joined with underscores, it also seeds
+            `lsst.source.injection.generate_injection_catalog`.
+        wcs : `lsst.afw.geom.SkyWcs`
+            WCS passed to `lsst.source.injection.generate_injection_catalog`.
+        pixelBox : `lsst.geom.Box2D`, optional
+            If provided, only keep the fakes whose pixel position through
+            ``wcs`` is in this box, including its minimum edges but not its
+            maximum edges, so that adjacent boxes share no fakes.
+
+        Returns
+        -------
+        randData : `dict` [`str`, `numpy.ndarray`]
+            Columns of the catalog. Columns with identical content are the
+            same array object.
+        """
+        catalog = generate_injection_catalog(
+            ra_lim=ra_lim,
+            dec_lim=dec_lim,
+            mag_lim=(self.config.magMin, self.config.magMax),
+            density=self.config.fakeDensity,
+            source_type="Star",
+            seed="_".join(str(value) for value in seed),
+            wcs=wcs
+        )
+        if pixelBox is not None and len(catalog) > 0:
+            x, y = wcs.skyToPixelArray(np.asarray(catalog["ra"], dtype=float),
+                                       np.asarray(catalog["dec"], dtype=float),
+                                       degrees=True)
+            inside = ((x >= pixelBox.getMinX()) & (x < pixelBox.getMaxX())
+                      & (y >= pixelBox.getMinY()) & (y < pixelBox.getMaxY()))
+            catalog = catalog[inside]
+
+        nFakes = len(catalog)
+        rng = np.random.default_rng(seed)
+
         onesColumn = np.ones(nFakes, dtype="float")
         zerosColumn = np.zeros(nFakes, dtype="float")
+        sourceType = np.asarray(catalog["source_type"], dtype=str)
         # Concatenate the data and add dummy values for the unused variables.
         # Set all data to PSF like objects.
         mags = np.asarray(catalog["mag"], dtype=float)
-        randData = {
-            "fakeId": [uuid.uuid4().int & (1 << 64) - 1 for n in range(nFakes)],
+        return {
+            "fakeId": rng.integers(0, np.iinfo(np.uint64).max, size=nFakes, dtype=np.uint64, endpoint=True),
             self.config.ra_col: np.asarray(catalog["ra"], dtype=float),
             self.config.dec_col: np.asarray(catalog["dec"], dtype=float),
             **self.createVisitCoaddSubdivision(nFakes),
@@ -210,12 +462,35 @@ class CreateRandomApFakesTask(PipelineTask):
             self.config.bulge_axis_ratio_col: onesColumn,
             self.config.disk_pa_col: zerosColumn,
             self.config.bulge_pa_col: onesColumn,
-            self.config.sourceType: np.asarray(catalog["source_type"], dtype=str),
-            "source_type": np.asarray(catalog["source_type"], dtype=str),
+            self.config.sourceType: sourceType,
+            "source_type": sourceType,
             "injection_id": np.asarray(catalog["injection_id"], dtype=np.int64)
         }
 
-        return Struct(fakeCat=pd.DataFrame(data=randData))
+    @staticmethod
+    def _makeArrowTable(randData):
+        """Convert catalog columns to an Arrow table without duplicating
+        repeated columns.
+
+        Parameters
+        ----------
+        randData : `dict` [`str`, `numpy.ndarray`]
+            Columns of the catalog, as returned by `_makeRandomColumns`.
+
+        Returns
+        -------
+        randoms : `pyarrow.Table`
+            The catalog. Columns that are the same array object in
+            ``randData`` share a single Arrow array. Constant columns are not
+            encoded specially in memory; the Parquet writer dictionary- and
+            run-length-encodes them on disk.
+        """
+        arrays = {}
+        for values in randData.values():
+            if id(values) not in arrays:
+                arrays[id(values)] = pa.array(values)
+        return pa.Table.from_arrays([arrays[id(values)] for values in randData.values()],
+                                    names=list(randData.keys()))
 
     def createVisitCoaddSubdivision(self, nFakes):
         """Assign a given fake either a visit image or coadd or both based on
@@ -275,15 +550,43 @@ class CreateVisitDetectorFakesConnections(
                 "detector")):
 
     sourceCat = connTypes.Input(
-        doc="Catalog of sources detected on the calibrated exposure; ",
+        doc="Catalog of sources detected on the calibrated exposure; only "
+            "read if hosted fakes are requested.",
         name="single_visit_star_reprocessed_footprints",
         storageClass="SourceCatalog",
         dimensions=["instrument", "visit", "detector"],
     )
-    visit_image = connTypes.Input(
-        doc="Calibrated exposure to inject synthetic sources into.",
-        name="preliminary_visit_image",
-        storageClass="ExposureF",
+    # Only the lightweight components of the visit image are read; the
+    # pixels are never needed to place the fakes.
+    wcs = connTypes.Input(
+        doc="WCS of the calibrated exposure to inject synthetic sources into.",
+        name="preliminary_visit_image.wcs",
+        storageClass="Wcs",
+        dimensions=["instrument", "visit", "detector"],
+    )
+    bbox = connTypes.Input(
+        doc="Bounding box of the calibrated exposure to inject synthetic sources into.",
+        name="preliminary_visit_image.bbox",
+        storageClass="Box2I",
+        dimensions=["instrument", "visit", "detector"],
+    )
+    photoCalib = connTypes.Input(
+        doc="Photometric calibration of the calibrated exposure to inject synthetic sources into.",
+        name="preliminary_visit_image.photoCalib",
+        storageClass="PhotoCalib",
+        dimensions=["instrument", "visit", "detector"],
+    )
+    summaryStats = connTypes.Input(
+        doc="Summary statistics of the calibrated exposure to inject synthetic sources into.",
+        name="preliminary_visit_image.summaryStats",
+        storageClass="ExposureSummaryStats",
+        dimensions=["instrument", "visit", "detector"],
+    )
+    hostIndex = connTypes.Input(
+        doc="Precomputed hosts for hosted fakes; replaces the source catalog "
+            "if config.doUseHostIndex is set.",
+        name="VisitDetectorFakeHostCat",
+        storageClass="ArrowAstropy",
         dimensions=["instrument", "visit", "detector"],
     )
     outputCat = connTypes.Output(
@@ -293,6 +596,14 @@ class CreateVisitDetectorFakesConnections(
         dimensions=["instrument", "visit", "detector"],
     )
 
+    def __init__(self, *, config=None):
+        super().__init__(config=config)
+
+        if not config.doAddHostedFakes or config.doUseHostIndex:
+            del self.sourceCat
+        if not config.doAddHostedFakes or not config.doUseHostIndex:
+            del self.hostIndex
+
 
 class CreateVisitDetectorFakesConfig(
         PipelineTaskConfig,
@@ -375,6 +686,14 @@ class CreateVisitDetectorFakesConfig(
         default=20,
         min=1,
     )
+    doUseHostIndex = pexConfig.Field(
+        doc="Whether to draw hosted fakes from a host index made by "
+            "CreateVisitDetectorFakeHostsTask, instead of selecting hosts from "
+            "the source catalog. Saves repeating the host selection when "
+            "creating many fakes catalogs for the same visits.",
+        dtype=bool,
+        default=False,
+    )
     doAddModelFakes = pexConfig.Field(
         doc="Whether to add model fakes to the visit detector.",
         dtype=bool,
@@ -407,32 +726,122 @@ class CreateVisitDetectorFakesTask(PipelineTask):
 
     def runQuantum(self, butlerQC, inputRefs, outputRefs):
         inputs = butlerQC.get(inputRefs)
+        inputs.setdefault("sourceCat", None)
+        inputs.setdefault("hostIndex", None)
+        inputs["visitId"] = butlerQC.quantum.dataId["visit"]
+        inputs["detectorId"] = butlerQC.quantum.dataId["detector"]
         outputs = self.run(**inputs)
         butlerQC.put(outputs, outputRefs)
 
-    def _make_unique_injection_ids(self, n_ids, used_ids=None):
-        """Generate collision-free injection IDs within the 24-bit ID space."""
-        used = set() if used_ids is None else {int(value) for value in used_ids}
-        injection_ids = []
+    def _make_unique_injection_ids(self, n_ids, rng, used_ids=None):
+        """Generate collision-free injection IDs within the 24-bit ID space.
 
-        while len(injection_ids) < n_ids:
-            candidate = uuid.uuid4().int & ((1 << 24) - 1)
-            if candidate in used:
-                continue
-            used.add(candidate)
-            injection_ids.append(candidate)
+        Candidates are drawn in batches from ``rng``, so the IDs are
+        reproducible for a given seed (the task seeds ``rng`` from the visit
+        and detector IDs). Collisions with ``used_ids`` or within a batch are
+        rejected with `numpy.isin` and `numpy.unique`, and the shortfall is
+        redrawn until ``n_ids`` IDs have been accepted.
 
-        return np.asarray(injection_ids, dtype=np.int64)
+        Parameters
+        ----------
+        n_ids : `int`
+            Number of new IDs to generate.
+        rng : `numpy.random.Generator`
+            Random number generator to draw the IDs from.
+        used_ids : array-like [`int`], optional
+            IDs that must not be reused.
 
-    def run(self, sourceCat, visit_image):
+        Returns
+        -------
+        injection_ids : `numpy.ndarray` [`numpy.int64`]
+            ``n_ids`` unique IDs, none of which are in ``used_ids``.
+
+        Raises
+        ------
+        ValueError
+            Raised if the ID space cannot hold ``n_ids`` more IDs.
+        """
+        taken = np.unique(np.asarray([] if used_ids is None else used_ids, dtype=np.int64))
+        if n_ids + len(taken) > _INJECTION_ID_SPACE:
+            raise ValueError(f"Cannot allocate {n_ids} injection IDs: only "
+                             f"{_INJECTION_ID_SPACE - len(taken)} unused IDs remain.")
+
+        injection_ids = np.empty(0, dtype=np.int64)
+        while len(injection_ids) < n_ids:
+            n_missing = n_ids - len(injection_ids)
+            # Oversample by the expected collision rate so that a single batch
+            # is almost always enough.
+            free_fraction = 1 - len(taken) / _INJECTION_ID_SPACE
+            n_draw = int(np.ceil(1.05 * n_missing / free_fraction)) + 16
+            candidates = rng.integers(0, _INJECTION_ID_SPACE, size=n_draw, dtype=np.int64)
+            candidates = candidates[~np.isin(candidates, taken)]
+            # Drop repeats within the batch, keeping draw order so that the
+            # result does not depend on the sort order of the IDs.
+            _, first = np.unique(candidates, return_index=True)
+            accepted = candidates[np.sort(first)][:n_missing]
+            injection_ids = np.concatenate([injection_ids, accepted])
+            taken = np.union1d(taken, accepted)
+
+        return injection_ids
+
+    def run(self, sourceCat, wcs, bbox, photoCalib, summaryStats, visitId, detectorId, hostIndex=None):
         """Create a set of visit detector fakes.
 
         Parameters
         ----------
-        sourceCat : `lsst.afw.table.SourceCatalog`
-            Catalog of sources detected on the calibrated exposure.
-        visit_image : `lsst.afw.image.Exposure`
-            Visit image to inject synthetic sources into.
+        sourceCat : `lsst.afw.table.SourceCatalog` or `None`
+            Catalog of sources detected on the calibrated exposure. Only
+            used if ``config.doAddHostedFakes``.
+        wcs : `lsst.afw.geom.SkyWcs`
+            WCS of the visit image to inject synthetic sources into.
+        bbox : `lsst.geom.Box2I`
+            Bounding box of the visit image.
+        photoCalib : `lsst.afw.image.PhotoCalib`
+            Photometric calibration of the visit image.
+        summaryStats : `lsst.afw.image.ExposureSummaryStats`
+            Summary statistics of the visit image.
+        visitId, detectorId : `int`
+            Visit and detector IDs of the visit image.
+        hostIndex : `astropy.table.Table`, optional
+            Precomputed hosts for hosted fakes, as returned by
+            `make_host_index`. If provided, ``sourceCat`` is not used.
+
+        Returns
+        -------
+        outputCat : `astropy.table.Table`
+            Catalog of fake sources to draw inputs from.
+        """
+        return Struct(outputCat=self._make_fakes(
+            sourceCat=sourceCat,
+            visitId=visitId,
+            detId=detectorId,
+            bbox=bbox,
+            wcs=wcs,
+            photoCalib=photoCalib,
+            magLim=summaryStats.magLim,
+            hostIndex=hostIndex,
+        ))
+
+    def _make_fakes(self, sourceCat, visitId, detId, bbox, wcs, photoCalib, magLim, hostIndex=None):
+        """Create the fakes catalog for one detector.
+
+        Parameters
+        ----------
+        sourceCat : `lsst.afw.table.SourceCatalog` or `None`
+            Catalog of sources detected on the calibrated exposure. Only
+            used if ``config.doAddHostedFakes`` and ``hostIndex`` is `None`.
+        visitId, detId : `int`
+            Visit and detector IDs; these seed the random number generator.
+        bbox : `lsst.geom.Box2I`
+            Pixel bounding box of the detector.
+        wcs : `lsst.afw.geom.SkyWcs`
+            WCS of the detector.
+        photoCalib : `lsst.afw.image.PhotoCalib`
+            Photometric calibration of the detector.
+        magLim : `float`
+            Limiting magnitude of the detector.
+        hostIndex : `astropy.table.Table`, optional
+            Precomputed hosts, as returned by `make_host_index`.
 
         Returns
         -------
@@ -440,21 +849,11 @@ class CreateVisitDetectorFakesTask(PipelineTask):
             Catalog of fake sources to draw inputs from.
         """
         # Use the visit+detector ids as the random seed.
-        visitId = visit_image.getInfo().getVisitInfo().id
-        detId = visit_image.detector.getId()
         rng = np.random.default_rng([visitId, detId])
 
-        # set of catalogs to concatenate at the end
-        catalog_set = []
+        # set of column groups to assemble at the end
+        column_set = []
 
-        photoCalib = visit_image.getPhotoCalib()
-        bbox = visit_image.getBBox()
-        xmin, xmax = bbox.getMinX(), bbox.getMaxX()
-        ymin, ymax = bbox.getMinY(), bbox.getMaxY()
-        visit_stats = visit_image.getInfo().getSummaryStats()
-
-        wcs = visit_image.getWcs()
-        magLim = visit_stats.magLim
         max_mag = np.min([magLim+1, self.config.magMax])
 
         if self.config.doAddRandomVisitFakes:
@@ -467,27 +866,11 @@ class CreateVisitDetectorFakesTask(PipelineTask):
                 self.log.info(
                     f"Generating random visit fakes with randomFakeDensity={self.config.randomFakeDensity}.")
                 n_random_fakes = self.get_n_fakes_from_density(
-                    visit_image=visit_image,
+                    region=_make_detector_region(bbox, wcs),
                     density=self.config.randomFakeDensity
                 )
                 self.log.info(f"Calculated n_random_fakes={n_random_fakes}.")
-
-            # draw random x-y coordinates
-            x_ssi = rng.uniform(xmin, xmax, size=n_random_fakes)
-            y_ssi = rng.uniform(ymin, ymax, size=n_random_fakes)
-            mags = rng.uniform(self.config.magMin, max_mag, size=n_random_fakes)
-            ra_ssi, dec_ssi = wcs.pixelToSkyArray(x_ssi, y_ssi, degrees=True)
-
-            random_catalog = Table()
-            random_catalog["x"] = x_ssi
-            random_catalog["y"] = y_ssi
-            random_catalog["mag"] = mags
-            random_catalog["ra"] = ra_ssi
-            random_catalog["dec"] = dec_ssi
-            random_catalog["source_type"] = "Star"
-            random_catalog["isVisitSource"] = True
-            random_catalog["isTemplateSource"] = False
-            catalog_set.append(random_catalog)
+            column_set.append(self._make_random_fakes(rng, n_random_fakes, bbox, wcs, max_mag))
         # Ignore now the possibility of _just_ template fakes
         if self.config.doAddModelFakes:
             # Generate model fakes
@@ -498,151 +881,294 @@ class CreateVisitDetectorFakesTask(PipelineTask):
         if self.config.doAddHostedFakes:
             # Generate hosted fakes
             self.log.info("Generating hosted fakes.")
-            # Select hosts that look like extended sources.
-            hostcatalog = photoCalib.calibrateCatalog(sourceCat).asAstropy()
-            hostcatalog = self.select_hosts(hostcatalog)
-            n_hosts = len(hostcatalog)
+            # Select hosts that look like extended sources, unless that has
+            # already been done for this detector.
+            if hostIndex is None:
+                hostIndex = self.make_host_index(sourceCat, photoCalib)
+            n_hosts = len(hostIndex)
             if n_hosts == 0:
                 self.log.warning("Hosted fake generation requested, but no valid hosts were selected.")
             else:
-                requested_n_fakes = max(
-                    int(self.config.fracHostedFakes * n_hosts), self.config.minHostedFakes
-                )
-                n_fakes = min(requested_n_fakes, n_hosts)
-                if n_fakes < requested_n_fakes:
-                    self.log.warning(
-                        "Reducing hosted fake count from %d to %d because only %d hosts are available.",
-                        requested_n_fakes,
-                        n_fakes,
-                        n_hosts,
-                    )
-
-                idx = rng.choice(n_hosts, size=n_fakes, replace=False)
-                hostcat = hostcatalog[idx]
-
-                x_hosts = hostcat['slot_Centroid_x']
-                y_hosts = hostcat['slot_Centroid_y']
-                mag_hosts = hostcat['slot_ModelFlux_mag']
-                # the units below are pixels and radians
-                pa, a, b = self.get_PA_and_axes(
-                    hostcat['slot_Shape_xx'],
-                    hostcat['slot_Shape_xy'],
-                    hostcat['slot_Shape_yy']
-                )
-                # random radius and angle for the fake around the host
-                theta = rng.uniform(0, 2 * np.pi, size=n_fakes)
-                angle = np.sqrt((a*np.cos(theta))**2 + (b*np.sin(theta))**2)
-                radii = angle * np.sqrt(rng.uniform(0, 6, size=n_fakes))
-
-                # Polar -> Cartesian  wrt the host in the PA coordinate system
-                xs = radii * np.cos(theta)
-                ys = radii * np.sin(theta)
-
-                # Retrieve the right position removing the galaxy orientation PA
-                x_rots = xs * np.cos(pa) - ys * np.sin(pa)
-                y_rots = xs * np.sin(pa) + ys * np.cos(pa)
-
-                x_ssi = x_hosts + x_rots
-                y_ssi = y_hosts + y_rots
-
-                # retrieving the global ra dec position of the injection
-                ra_ssi, dec_ssi = wcs.pixelToSkyArray(x_ssi, y_ssi, degrees=True)
-                delta_ra = (ra_ssi - np.rad2deg(hostcat['coord_ra'])) * 3600.
-                delta_dec = (dec_ssi - np.rad2deg(hostcat['coord_dec'])) * 3600.
-
-                delta_mag = rng.normal(loc=1, scale=1, size=n_fakes)
-                mags = mag_hosts + delta_mag
-
-                #  Create the table of hosted fakes
-                hosted_fakes = Table()
-                hosted_fakes["x"] = x_ssi
-                hosted_fakes["y"] = y_ssi
-                hosted_fakes["mag"] = mags
-                hosted_fakes["ra"] = ra_ssi
-                hosted_fakes["dec"] = dec_ssi
-                hosted_fakes["host_id"] = hostcat['id']
-                hosted_fakes["host_flux"] = hostcat['slot_ModelFlux_flux']
-                hosted_fakes["host_mag"] = hostcat['slot_ModelFlux_mag']
-                hosted_fakes["host_ra"] = np.rad2deg(hostcat['coord_ra'])
-                hosted_fakes["host_dec"] = np.rad2deg(hostcat['coord_dec'])
-                hosted_fakes["delta_ra"] = delta_ra
-                hosted_fakes["delta_dec"] = delta_dec
-                hosted_fakes["delta_mag"] = delta_mag
-                hosted_fakes["host_a"] = a
-                hosted_fakes["host_b"] = b
-                hosted_fakes["host_pa"] = pa
-                hosted_fakes["source_type"] = "Star"
-                hosted_fakes["hosted_fake"] = True
-                hosted_fakes["isVisitSource"] = True
-                hosted_fakes["isTemplateSource"] = False
-
-                catalog_set.append(hosted_fakes)
-
-        if not catalog_set:
+                column_set.append(self._make_hosted_fakes(rng, hostIndex, wcs))
+
+        if not column_set:
             raise RuntimeError(
                 "No fake sources were generated. Enable at least one fakes mode or provide usable hosts."
             )
 
-        catalog = vstack(catalog_set)
-        catalog['injection_id'] = self._make_unique_injection_ids(len(catalog))
+        n_fakes = sum(len(columns["x"]) for columns in column_set)
+        if self.config.doAddVariableFakes:
+            n_variable_fakes = int(n_fakes * self.config.variableFakeFraction)
+        else:
+            n_variable_fakes = 0
+
+        # Every fakes mode is written into one preallocated buffer per column;
+        # the variable fakes are appended as copies of some of those rows.
+        columns, masks = self._allocate_columns(column_set, n_fakes + n_variable_fakes)
+        base = slice(0, n_fakes)
+        variable = slice(n_fakes, n_fakes + n_variable_fakes)
 
+        columns["injection_id"] = np.zeros(n_fakes + n_variable_fakes, dtype=np.int64)
+        columns["injection_id"][base] = self._make_unique_injection_ids(n_fakes, rng)
+
+        columns["isVisitSource"] = np.ones(n_fakes + n_variable_fakes, dtype=bool)
+        columns["isTemplateSource"] = np.zeros(n_fakes + n_variable_fakes, dtype=bool)
         if self.config.doAddRandomTemplateFakes:
-            is_tmplt_fake = rng.random(len(catalog)) < self.config.templateFakeFraction
-            catalog["isTemplateSource"] = is_tmplt_fake
-            catalog["isVisitSource"] = ~is_tmplt_fake
-        else:
-            catalog["isVisitSource"] = True
-            catalog["isTemplateSource"] = False
+            is_tmplt_fake = rng.random(n_fakes) < self.config.templateFakeFraction
+            columns["isTemplateSource"][base] = is_tmplt_fake
+            columns["isVisitSource"][base] = ~is_tmplt_fake
 
         if self.config.doAddVariableFakes:
             # Generate variable fakes by duplicating some fakes and adding the counterpart
             # either science or template with a magnitude offset drawn from a normal
             # distribution with mean and std defined in the config.
             self.log.info("Generating variable fakes.")
-            n_variable_fakes = int(len(catalog) * self.config.variableFakeFraction)
-            idx = rng.choice(len(catalog), size=n_variable_fakes, replace=False)
-            variable_fakes = catalog[idx].copy()
-            variable_fakes["mag_offset"] = rng.normal(
+            idx = rng.choice(n_fakes, size=n_variable_fakes, replace=False)
+            for name in columns:
+                columns[name][variable] = columns[name][idx]
+            for name in masks:
+                masks[name][variable] = masks[name][idx]
+
+            mag_offset = rng.normal(
                 loc=self.config.variableFakeMean,
                 scale=self.config.variableFakeStd,
                 size=n_variable_fakes
             )
-            variable_fakes["mag"] += variable_fakes["mag_offset"]
+            columns["mag"][variable] += mag_offset
             # we flip the source, so for example if it was a visit, we trasnform it into a template
             # with the idea of having duplicate injections, in the same location
-            variable_fakes["isVisitSource"] = ~variable_fakes["isVisitSource"]
-            variable_fakes["isTemplateSource"] = ~variable_fakes["isTemplateSource"]
+            columns["isVisitSource"][variable] = ~columns["isVisitSource"][variable]
+            columns["isTemplateSource"][variable] = ~columns["isTemplateSource"][variable]
 
-            variable_fakes["twin_id"] = variable_fakes["injection_id"]
-            variable_fakes["injection_id"] = self._make_unique_injection_ids(
-                len(variable_fakes),
-                used_ids=catalog["injection_id"],
+            columns["injection_id"][variable] = self._make_unique_injection_ids(
+                n_variable_fakes,
+                rng,
+                used_ids=columns["injection_id"][base],
             )
             # create column of isVariable flag
-            catalog["isVariable"] = np.where(np.isin(np.arange(len(catalog)), idx), True, False)
-            variable_fakes["isVariable"] = True
+            columns["isVariable"] = np.zeros(n_fakes + n_variable_fakes, dtype=bool)
+            columns["isVariable"][idx] = True
+            columns["isVariable"][variable] = True
 
-            catalog = vstack([catalog, variable_fakes])
+            for name, values in (("mag_offset", mag_offset), ("twin_id", columns["injection_id"][idx])):
+                columns[name] = np.zeros(n_fakes + n_variable_fakes, dtype=values.dtype)
+                columns[name][variable] = values
+                masks[name] = np.ones(n_fakes + n_variable_fakes, dtype=bool)
+                masks[name][variable] = False
 
-        if len(catalog) > len(np.unique(catalog["injection_id"])):
+        if len(columns["injection_id"]) > len(np.unique(columns["injection_id"])):
             self.log.warning("Duplicate injection IDs detected after catalog assembly; reassigning them.")
-            old_injection_ids = np.asarray(catalog["injection_id"], dtype=np.int64)
-            new_injection_ids = self._make_unique_injection_ids(len(catalog))
+            old_injection_ids = columns["injection_id"]
+            new_injection_ids = self._make_unique_injection_ids(len(old_injection_ids), rng)
             # re-assign fresh injection ids
-            catalog["injection_id"] = new_injection_ids
-            if "twin_id" in catalog.colnames:
-                id_map = {old_id: new_id for old_id, new_id in zip(old_injection_ids, new_injection_ids)}
-                catalog["twin_id"] = np.asarray(
-                    [id_map.get(int(twin_id), int(twin_id)) for twin_id in catalog["twin_id"]],
-                    dtype=np.int64,
-                )
+            columns["injection_id"] = new_injection_ids
+            if "twin_id" in columns:
+                columns["twin_id"] = _remap_ids(columns["twin_id"], old_injection_ids, new_injection_ids)
+
+        columns["visit"] = np.full(n_fakes + n_variable_fakes, visitId, dtype=np.int64)
+        columns["detector"] = np.full(n_fakes + n_variable_fakes, detId, dtype=np.int64)
+
+        return Table(
+            [MaskedColumn(values, name=name, mask=masks[name], copy=False)
+             if name in masks and masks[name].any() else Column(values, name=name, copy=False)
+             for name, values in columns.items()],
+            copy=False,
+        )
+
+    def _make_random_fakes(self, rng, n_fakes, bbox, wcs, max_mag):
+        """Draw fakes uniformly over a detector.
+
+        Parameters
+        ----------
+        rng : `numpy.random.Generator`
+            Random number generator to draw positions and magnitudes from.
+        n_fakes : `int`
+            Number of fakes to draw.
+        bbox : `lsst.geom.Box2I`
+            Pixel bounding box to draw positions within.
+        wcs : `lsst.afw.geom.SkyWcs`
+            WCS used to compute the sky positions of the fakes.
+        max_mag : `float`
+            Faintest magnitude to draw.
+
+        Returns
+        -------
+        columns : `dict` [`str`, `numpy.ndarray`]
+            Columns of the random fakes.
+        """
+        # draw random x-y coordinates
+        x_ssi = rng.uniform(bbox.getMinX(), bbox.getMaxX(), size=n_fakes)
+        y_ssi = rng.uniform(bbox.getMinY(), bbox.getMaxY(), size=n_fakes)
+        mags = rng.uniform(self.config.magMin, max_mag, size=n_fakes)
+        ra_ssi, dec_ssi = wcs.pixelToSkyArray(x_ssi, y_ssi, degrees=True)
+
+        return {
+            "x": x_ssi,
+            "y": y_ssi,
+            "mag": mags,
+            "ra": ra_ssi,
+            "dec": dec_ssi,
+            "source_type": np.full(n_fakes, "Star"),
+        }
+
+    def _make_hosted_fakes(self, rng, hostIndex, wcs):
+        """Draw fakes around a random subset of host galaxies.
+
+        Parameters
+        ----------
+        rng : `numpy.random.Generator`
+            Random number generator to draw hosts, offsets and magnitudes
+            from.
+        hostIndex : `astropy.table.Table`
+            Hosts to draw from, as returned by `make_host_index`. Must not
+            be empty.
+        wcs : `lsst.afw.geom.SkyWcs`
+            WCS used to compute the sky positions of the fakes.
+
+        Returns
+        -------
+        columns : `dict` [`str`, `numpy.ndarray`]
+            Columns of the hosted fakes.
+        """
+        n_hosts = len(hostIndex)
+        requested_n_fakes = max(
+            int(self.config.fracHostedFakes * n_hosts), self.config.minHostedFakes
+        )
+        n_fakes = min(requested_n_fakes, n_hosts)
+        if n_fakes < requested_n_fakes:
+            self.log.warning(
+                "Reducing hosted fake count from %d to %d because only %d hosts are available.",
+                requested_n_fakes,
+                n_fakes,
+                n_hosts,
+            )
+
+        idx = rng.choice(n_hosts, size=n_fakes, replace=False)
+        x_hosts = np.asarray(hostIndex['slot_Centroid_x'])[idx]
+        y_hosts = np.asarray(hostIndex['slot_Centroid_y'])[idx]
+        mag_hosts = np.asarray(hostIndex['slot_ModelFlux_mag'])[idx]
+        host_ra = np.rad2deg(np.asarray(hostIndex['coord_ra'])[idx])
+        host_dec = np.rad2deg(np.asarray(hostIndex['coord_dec'])[idx])
+        # the units below are pixels and radians
+        pa = np.asarray(hostIndex['pa'])[idx]
+        a = np.asarray(hostIndex['a'])[idx]
+        b = np.asarray(hostIndex['b'])[idx]
+        # random radius and angle for the fake around the host
+        theta = rng.uniform(0, 2 * np.pi, size=n_fakes)
+        angle = np.sqrt((a*np.cos(theta))**2 + (b*np.sin(theta))**2)
+        radii = angle * np.sqrt(rng.uniform(0, 6, size=n_fakes))
+
+        # Polar -> Cartesian  wrt the host in the PA coordinate system
+        xs = radii * np.cos(theta)
+        ys = radii * np.sin(theta)
+
+        # Retrieve the right position removing the galaxy orientation PA
+        x_rots = xs * np.cos(pa) - ys * np.sin(pa)
+        y_rots = xs * np.sin(pa) + ys * np.cos(pa)
+
+        x_ssi = x_hosts + x_rots
+        y_ssi = y_hosts + y_rots
+
+        # retrieving the global ra dec position of the injection
+        ra_ssi, dec_ssi = wcs.pixelToSkyArray(x_ssi, y_ssi, degrees=True)
+
+        delta_mag = rng.normal(loc=1, scale=1, size=n_fakes)
+
+        return {
+            "x": x_ssi,
+            "y": y_ssi,
+            "mag": mag_hosts + delta_mag,
+            "ra": ra_ssi,
+            "dec": dec_ssi,
+            "source_type": np.full(n_fakes, "Star"),
+            "host_id": np.asarray(hostIndex['id'])[idx],
+            "host_flux": np.asarray(hostIndex['slot_ModelFlux_flux'])[idx],
+            "host_mag": mag_hosts,
+            "host_ra": host_ra,
+            "host_dec": host_dec,
+            "delta_ra": (ra_ssi - host_ra) * 3600.,
+            "delta_dec": (dec_ssi - host_dec) * 3600.,
+            "delta_mag": delta_mag,
+            "host_a": a,
+            "host_b": b,
+            "host_pa": pa,
+            "hosted_fake": np.ones(n_fakes, dtype=bool),
+        }
 
-        catalog["visit"] = visitId
-        catalog["detector"] = detId
+    @staticmethod
+    def _allocate_columns(column_set, n_rows):
+        """Copy groups of fakes into preallocated, full-length columns.
 
-        return Struct(outputCat=catalog)
+        Parameters
+        ----------
+        column_set : `list` [`dict` [`str`, `numpy.ndarray`]]
+            Columns of each group of fakes, in the order the groups should
+            appear in the output.
+        n_rows : `int`
+            Length of the output columns; rows past the end of the last group
+            are left for the caller to fill.
 
-    def select_hosts(self, sourceCat):
+        Returns
+        -------
+        columns : `dict` [`str`, `numpy.ndarray`]
+            Output columns, in order of first appearance.
+        masks : `dict` [`str`, `numpy.ndarray` [`bool`]]
+            For each column that is missing from at least one group, which
+            rows have no value.
+        """
+        columns = {}
+        masks = {}
+        offset = 0
+        for group in column_set:
+            n_group = len(group["x"])
+            for name, values in group.items():
+                if name not in columns:
+                    columns[name] = np.zeros(n_rows, dtype=values.dtype)
+                    if offset > 0:
+                        masks[name] = np.ones(n_rows, dtype=bool)
+                columns[name][offset:offset + n_group] = values
+                if name in masks:
+                    masks[name][offset:offset + n_group] = False
+            for name in columns.keys() - group.keys():
+                masks.setdefault(name, np.zeros(n_rows, dtype=bool))[offset:offset + n_group] = True
+            offset += n_group
+        return columns, masks
+
+    @classmethod
+    def make_host_index(cls, sourceCat, photoCalib):
+        """Select the hosts of hosted fakes on a detector and compute their
+        shapes.
+
+        Parameters
+        ----------
+        sourceCat : `lsst.afw.table.SourceCatalog`
+            Catalog of sources detected on the calibrated exposure.
+        photoCalib : `lsst.afw.image.PhotoCalib`
+            Photometric calibration of the exposure.
+
+        Returns
+        -------
+        hostIndex : `astropy.table.Table`
+            The hosts that pass `select_hosts`, with their ``id``, sky
+            position (``coord_ra``, ``coord_dec``; radians), centroid
+            (``slot_Centroid_x``, ``slot_Centroid_y``), calibrated model flux
+            (``slot_ModelFlux_flux``, ``slot_ModelFlux_mag``), and position
+            angle and semi-axes (``pa``, ``a``, ``b``; radians and pixels).
+        """
+        hosts = cls.select_hosts(cls._load_host_candidates(sourceCat, photoCalib))
+        pa, a, b = cls.get_PA_and_axes(
+            np.asarray(hosts['slot_Shape_xx']),
+            np.asarray(hosts['slot_Shape_xy']),
+            np.asarray(hosts['slot_Shape_yy'])
+        )
+        hostIndex = hosts[_HOST_INDEX_COLUMNS]
+        hostIndex["pa"] = pa
+        hostIndex["a"] = a
+        hostIndex["b"] = b
+        return hostIndex
+
+    @staticmethod
+    def select_hosts(sourceCat):
         """
         Selects host sources from a given source catalog based on a series of classification and flux cuts.
         The selection criteria are:
@@ -663,6 +1189,26 @@ class CreateVisitDetectorFakesTask(PipelineTask):
             A deep copy of the subset of the source catalog that passes all selection criteria.
         """
 
+        snrCut = sourceCat['slot_ModelFlux_flux']/sourceCat['slot_ModelFlux_fluxErr'] > 15
+
+        hostCat = sourceCat[CreateVisitDetectorFakesTask._select_host_candidates(sourceCat) & snrCut].copy()
+        return hostCat
+
+    @staticmethod
+    def _select_host_candidates(sourceCat):
+        """Apply the cuts of `select_hosts` that do not depend on the
+        photometric calibration.
+
+        Parameters
+        ----------
+        sourceCat : `lsst.afw.table.SourceCatalog` or `astropy.table.Table`
+            The source catalog containing the columns required for selection.
+
+        Returns
+        -------
+        candidates : `numpy.ndarray` [`bool`]
+            Whether each source passes the cuts.
+        """
         # Avoid calibration stars or psf stars; remove flagged sources sky_sources
         skySourceCut = ~sourceCat['sky_source']
 
@@ -675,13 +1221,47 @@ class CreateVisitDetectorFakesTask(PipelineTask):
         extendednessCut = sourceCat['base_ClassificationSizeExtendedness_value'] > 0.9
         extendednessCut &= sourceCat['base_ClassificationExtendedness_value'] == 1
 
-        snrCut = sourceCat['slot_ModelFlux_flux']/sourceCat['slot_ModelFlux_fluxErr'] > 15
+        return np.asarray(skySourceCut & flagCut & extendednessCut)
 
-        hostCat = sourceCat[
-            skySourceCut & flagCut & extendednessCut & snrCut].copy()
-        return hostCat
+    @classmethod
+    def _load_host_candidates(cls, sourceCat, photoCalib):
+        """Extract and calibrate the possible hosts of hosted fakes.
+
+        Only the columns needed to select hosts and place fakes around them
+        are copied out of ``sourceCat``, and only the model fluxes of the
+        sources that pass the calibration-independent cuts of `select_hosts`
+        are calibrated.
+
+        Parameters
+        ----------
+        sourceCat : `lsst.afw.table.SourceCatalog`
+            Catalog of sources detected on the calibrated exposure.
+        photoCalib : `lsst.afw.image.PhotoCalib`
+            Photometric calibration of the exposure.
+
+        Returns
+        -------
+        candidates : `astropy.table.Table`
+            The candidate hosts, with calibrated ``slot_ModelFlux_flux``,
+            ``slot_ModelFlux_fluxErr`` and ``slot_ModelFlux_mag`` columns.
+            Still needs to be passed through `select_hosts`.
+        """
+        selected = cls._select_host_candidates(sourceCat)
+        candidates = Table({name: np.asarray(sourceCat[name])[selected] for name in _HOST_COLUMNS})
 
-    def get_PA_and_axes(self, Ixx, Ixy, Iyy):
+        if np.any(selected):
+            survivors = sourceCat.subset(selected)
+            flux = photoCalib.instFluxToNanojansky(survivors, "slot_ModelFlux")
+            mag = photoCalib.instFluxToMagnitude(survivors, "slot_ModelFlux")
+        else:
+            flux = mag = np.zeros((0, 2))
+        candidates["slot_ModelFlux_flux"] = flux[:, 0]
+        candidates["slot_ModelFlux_fluxErr"] = flux[:, 1]
+        candidates["slot_ModelFlux_mag"] = mag[:, 0]
+        return candidates
+
+    @staticmethod
+    def get_PA_and_axes(Ixx, Ixy, Iyy):
         '''
         Calculates the orientation and extent of an object based on its second moments.
 
@@ -710,9 +1290,201 @@ class CreateVisitDetectorFakesTask(PipelineTask):
 
         return theta, a, b
 
-    def get_n_fakes_from_density(self, visit_image, density):
-        """Calculate the area of the injection limits in square degrees based on the RA and Dec limits."""
-        image_area = visit_image.getConvexPolygon().getBoundingBox().getArea()
+    def get_n_fakes_from_density(self, region, density):
+        """Calculate the number of fakes for a density over the RA and Dec limits of a region."""
+        image_area = region.getBoundingBox().getArea()
         image_area *= (180 / np.pi) ** 2
         number = np.round(density * image_area).astype(int)
         return number
+
+
+class CreateVisitFakesConnections(
+    PipelineTaskConnections,
+    dimensions=("instrument",
+                "visit")):
+
+    sourceCats = connTypes.Input(
+        doc="Catalogs of sources detected on the calibrated exposures; "
+            "only read if hosted fakes are requested.",
+        name="single_visit_star_reprocessed_footprints",
+        storageClass="SourceCatalog",
+        dimensions=["instrument", "visit", "detector"],
+        multiple=True,
+        deferLoad=True,
+    )
+    visitSummary = connTypes.Input(
+        doc="Per-detector WCS, bounding box, photometric calibration and "
+            "summary statistics of the visit, in place of the visit images.",
+        name="preliminary_visit_summary",
+        storageClass="ExposureCatalog",
+        dimensions=["instrument", "visit"],
+    )
+    outputCats = connTypes.Output(
+        doc="Catalogs of fake sources to draw inputs from, one per detector.",
+        name="VisitDetectorFakeSourceCat",
+        storageClass="ArrowAstropy",
+        dimensions=["instrument", "visit", "detector"],
+        multiple=True,
+    )
+
+    def __init__(self, *, config=None):
+        super().__init__(config=config)
+
+        if not config.doAddHostedFakes:
+            del self.sourceCats
+
+
+class CreateVisitFakesConfig(
+        CreateVisitDetectorFakesConfig,
+        pipelineConnections=CreateVisitFakesConnections
+):
+    """Config for CreateVisitFakesTask."""
+
+    def validate(self):
+        super().validate()
+        if self.doUseHostIndex:
+            raise pexConfig.FieldValidationError(
+                CreateVisitFakesConfig.doUseHostIndex, self,
+                "CreateVisitFakesTask selects hosts from the source catalogs and cannot use a host index."
+            )
+
+
+class CreateVisitFakesTask(CreateVisitDetectorFakesTask):
+    """Create the visit detector fakes of every detector of a visit at once.
+
+    This produces the same catalogs as `CreateVisitDetectorFakesTask`, but
+    runs one quantum per visit and takes the detector geometry and
+    calibration from the visit summary instead of reading each visit image.
+    """
+
+    _DefaultName = "createVisitFakes"
+    ConfigClass = CreateVisitFakesConfig
+
+    def runQuantum(self, butlerQC, inputRefs, outputRefs):
+        inputs = butlerQC.get(inputRefs)
+        inputs["sourceCats"] = {handle.dataId["detector"]: handle
+                                for handle in inputs.get("sourceCats", [])}
+        outputs = self.run(**inputs)
+        for ref in outputRefs.outputCats:
+            detector = ref.dataId["detector"]
+            if detector in outputs.outputCats:
+                butlerQC.put(outputs.outputCats[detector], ref)
+
+    def run(self, visitSummary, sourceCats=None):
+        """Create the visit detector fakes of every detector in a visit.
+
+        Parameters
+        ----------
+        visitSummary : `lsst.afw.table.ExposureCatalog`
+            Visit summary, with one record per detector.
+        sourceCats : `dict` [`int`, `lsst.daf.butler.DeferredDatasetHandle`]
+            Handles to the catalogs of sources detected on each detector,
+            keyed by detector ID. Only read if ``config.doAddHostedFakes``.
+
+        Returns
+        -------
+        result : `lsst.pipe.base.Struct`
+            A `~lsst.pipe.base.Struct` containing the following component:
+
+            - ``outputCats``: catalogs of fake sources, keyed by detector ID
+              (`dict` [`int`, `astropy.table.Table`]).
+        """
+        sourceCats = {} if sourceCats is None else sourceCats
+        outputCats = {}
+        for record in visitSummary:
+            detId = record.getId()
+            wcs = record.getWcs()
+            photoCalib = record.getPhotoCalib()
+            if wcs is None or photoCalib is None:
+                self.log.warning("Detector %d has no WCS or photometric calibration; skipping.", detId)
+                continue
+
+            sourceCat = None
+            if self.config.doAddHostedFakes:
+                if detId not in sourceCats:
+                    self.log.warning("Detector %d has no source catalog; skipping.", detId)
+                    continue
+                sourceCat = sourceCats[detId].get()
+
+            outputCats[detId] = self._make_fakes(
+                sourceCat=sourceCat,
+                visitId=record["visit"],
+                detId=detId,
+                bbox=record.getBBox(),
+                wcs=wcs,
+                photoCalib=photoCalib,
+                magLim=record["magLim"],
+            )
+
+        if not outputCats:
+            raise NoWorkFound("No detector in the visit summary has a usable calibration.")
+        return Struct(outputCats=outputCats)
+
+
+class CreateVisitDetectorFakeHostsConnections(
+    PipelineTaskConnections,
+    dimensions=("instrument",
+                "visit",
+                "detector")):
+
+    sourceCat = connTypes.Input(
+        doc="Catalog of sources detected on the calibrated exposure.",
+        name="single_visit_star_reprocessed_footprints",
+        storageClass="SourceCatalog",
+        dimensions=["instrument", "visit", "detector"],
+    )
+    photoCalib = connTypes.Input(
+        doc="Photometric calibration of the calibrated exposure.",
+        name="preliminary_visit_image.photoCalib",
+        storageClass="PhotoCalib",
+        dimensions=["instrument", "visit", "detector"],
+    )
+    hostIndex = connTypes.Output(
+        doc="Hosts for hosted fakes, with their centroids, model fluxes and "
+            "shapes.",
+        name="VisitDetectorFakeHostCat",
+        storageClass="ArrowAstropy",
+        dimensions=["instrument", "visit", "detector"],
+    )
+
+
+class CreateVisitDetectorFakeHostsConfig(
+        PipelineTaskConfig,
+        pipelineConnections=CreateVisitDetectorFakeHostsConnections
+):
+    """Config for CreateVisitDetectorFakeHostsTask."""
+    pass
+
+
+class CreateVisitDetectorFakeHostsTask(PipelineTask):
+    """Select the hosts of hosted fakes on a visit detector ahead of time.
+
+    The output can be read by `CreateVisitDetectorFakesTask` (with
+    ``doUseHostIndex``), so that repeated fakes runs over the same visits
+    only draw from the precomputed hosts.
+    """
+
+    _DefaultName = "createVisitDetectorFakeHosts"
+    ConfigClass = CreateVisitDetectorFakeHostsConfig
+
+    def run(self, sourceCat, photoCalib):
+        """Select the hosts of hosted fakes.
+
+        Parameters
+        ----------
+        sourceCat : `lsst.afw.table.SourceCatalog`
+            Catalog of sources detected on the calibrated exposure.
+        photoCalib : `lsst.afw.image.PhotoCalib`
+            Photometric calibration of the exposure.
+
+        Returns
+        -------
+        result : `lsst.pipe.base.Struct`
+            A `~lsst.pipe.base.Struct` containing the following component:
+
+            - ``hostIndex``: the selected hosts (`astropy.table.Table`); see
+              `CreateVisitDetectorFakesTask.make_host_index`.
+        """
+        hostIndex = CreateVisitDetectorFakesTask.make_host_index(sourceCat, photoCalib)
+        self.log.info("Selected %d hosts for hosted fakes.", len(hostIndex))
+        return Struct(hostIndex=hostIndex)
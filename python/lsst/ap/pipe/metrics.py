@@ -25,18 +25,109 @@
 
 __all__ = [
     "PipelineTimingMetricTask", "PipelineTimingMetricConfig",
+    "PipelineStageTimingTask", "PipelineStageTimingConfig",
+    "PipelineVisitTimingMetricTask", "PipelineVisitTimingMetricConfig",
+    "PipelineCpuTimeMetricTask", "PipelineCpuTimeMetricConfig",
+    "PipelineCpuEfficiencyMetricTask", "PipelineCpuEfficiencyMetricConfig",
+    "PipelinePeakMemoryMetricTask", "PipelinePeakMemoryMetricConfig",
 ]
 
 import astropy.units as u
+from astropy.table import Table
 from datetime import datetime
+import numpy as np
 
 import lsst.pex.config as pexConfig
-from lsst.pipe.base import Struct, NoWorkFound
+from lsst.pipe.base import Struct, NoWorkFound, PipelineTask, PipelineTaskConfig, PipelineTaskConnections
 import lsst.pipe.base.connectionTypes as connTypes
 from lsst.verify import Measurement, Datum
 from lsst.verify.tasks import AbstractMetadataMetricTask, MetricTask, MetricComputationError
 
 
+class _MetadataKeyIndex:
+    """Precompiled lookup of metadata values by key fragment.
+
+    Fragments are matched as substrings of the full metadata keys, as in
+    `lsst.verify.tasks.AbstractMetadataMetricTask.extractMetadata`, but the
+    matching keys are remembered for each set of top-level names, which is
+    the same for all quanta of a task. Later metadata with the same names
+    are read by looking up the remembered keys directly; the metadata tree
+    is only walked, once rather than once per fragment, if one of those
+    keys is missing, or if a fragment that matched nothing is now a key.
+    Fragments that match more than one key are only detected on a walk.
+
+    Parameters
+    ----------
+    metadataKeys : `dict` [`str`, `str`]
+        Key fragments, keyed by the name under which to return their values.
+    """
+
+    _MAX_LAYOUTS = 16
+
+    def __init__(self, metadataKeys):
+        self._metadataKeys = dict(metadataKeys)
+        self._layouts = {}
+
+    def extract(self, metadata):
+        """Read the values of all key fragments from a metadata object.
+
+        Parameters
+        ----------
+        metadata : `lsst.pipe.base.TaskMetadata`
+            A metadata object.
+
+        Returns
+        -------
+        data : `dict` [`str`, `typing.Any`]
+            The value for each fragment, or `None` if no key matches it.
+
+        Raises
+        ------
+        lsst.verify.tasks.MetricComputationError
+            Raised if a fragment matches more than one key.
+        """
+        layout = frozenset(metadata.keys())
+        keys = self._layouts.get(layout)
+        if keys is not None:
+            try:
+                return self._read(metadata, keys)
+            except KeyError:
+                pass
+        keys = self._resolve(frozenset(metadata.paramNames(topLevelOnly=False)))
+        if len(self._layouts) >= self._MAX_LAYOUTS:
+            self._layouts.clear()
+        self._layouts[layout] = keys
+        return self._read(metadata, keys)
+
+    def _read(self, metadata, keys):
+        """Read the values of resolved keys.
+
+        Raises
+        ------
+        KeyError
+            Raised if a key is missing, or if a fragment that was resolved to
+            no key is a key of ``metadata``.
+        """
+        data = {}
+        for dataName, key in keys.items():
+            if key is None:
+                if self._metadataKeys[dataName] in metadata:
+                    raise KeyError(self._metadataKeys[dataName])
+                data[dataName] = None
+            else:
+                data[dataName] = metadata.getScalar(key)
+        return data
+
+    def _resolve(self, names):
+        keys = {}
+        for dataName, fragment in self._metadataKeys.items():
+            matches = [name for name in names if fragment in name]
+            if len(matches) > 1:
+                raise MetricComputationError(f"Metadata has multiple keys matching {fragment}: {matches}")
+            keys[dataName] = matches[0] if matches else None
+        return keys
+
+
 class PipelineTimingMetricConnections(
         MetricTask.ConfigClass.ConnectionsClass,
         dimensions={"instrument", "visit", "detector"},
@@ -91,6 +182,10 @@ class PipelineTimingMetricTask(AbstractMetadataMetricTask):
     _DefaultName = "pipelineTimingMetric"
     ConfigClass = PipelineTimingMetricConfig
 
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._keyIndex = _MetadataKeyIndex(self.getInputMetadataKeys(self.config))
+
     @classmethod
     def getInputMetadataKeys(cls, config):
         """Get search strings for the metadata.
@@ -144,9 +239,8 @@ class PipelineTimingMetricTask(AbstractMetadataMetricTask):
             Raised if the metric is ill-defined. Typically this means that at
             least one pipeline step was not run.
         """
-        metadataKeys = self.getInputMetadataKeys(self.config)
-        timingsStart = self.extractMetadata(metadataStart, metadataKeys)
-        timingsEnd = self.extractMetadata(metadataEnd, metadataKeys)
+        timingsStart = self._keyIndex.extract(metadataStart)
+        timingsEnd = self._keyIndex.extract(metadataEnd)
 
         if timingsStart["StartTimestamp"] is None:
             raise NoWorkFound(f"Nothing to do: no timing information for {self.config.targetStart} found.")
@@ -165,3 +259,656 @@ class PipelineTimingMetricTask(AbstractMetadataMetricTask):
             meas.extras["start"] = Datum(timingsStart["StartTimestamp"])
             meas.extras["end"] = Datum(timingsEnd["EndTimestamp"])
             return Struct(measurement=meas)
+
+    def runMany(self, metadataPairs):
+        """Compute the pipeline wall-clock time for many quanta.
+
+        The metadata keys are only looked up once for all quanta with the
+        same metadata layout, which makes this much faster than separate
+        tasks when reprocessing many quanta.
+
+        Parameters
+        ----------
+        metadataPairs : iterable [`tuple`]
+            ``(metadataStart, metadataEnd)`` pairs of
+            `lsst.pipe.base.TaskMetadata`, as passed to `run`.
+
+        Returns
+        -------
+        measurements : `list` [`lsst.verify.Measurement` or `None`]
+            The measurement for each pair, or `None` if the metric is
+            ill-defined for it.
+
+        Raises
+        ------
+        lsst.verify.tasks.MetricComputationError
+            Raised if the strings returned by `getInputMetadataKeys` match
+            more than one key in any metadata object, or if a timestamp is
+            invalid.
+        """
+        measurements = []
+        for metadataStart, metadataEnd in metadataPairs:
+            try:
+                measurements.append(self.run(metadataStart, metadataEnd).measurement)
+            except NoWorkFound:
+                measurements.append(None)
+        return measurements
+
+
+class PipelineVisitTimingMetricConnections(
+        PipelineTimingMetricConnections,
+        dimensions={"instrument", "visit"},
+        defaultTemplates={"labelStart": "",
+                          "labelEnd": "",
+                          "package": "ap_pipe",
+                          "metric": "ApPipelineVisitTime"}):
+    metadataStart = connTypes.Input(
+        name="{labelStart}_metadata",
+        doc="The starting task's metadata, for each detector.",
+        storageClass="TaskMetadata",
+        dimensions={"instrument", "exposure", "detector"},
+        multiple=True,
+    )
+    metadataEnd = connTypes.Input(
+        name="{labelEnd}_metadata",
+        doc="The final task's metadata, for each detector.",
+        storageClass="TaskMetadata",
+        dimensions={"instrument", "visit", "detector"},
+        multiple=True,
+    )
+    measurement = connTypes.Output(
+        name="metricvalue_{package}_{metric}",
+        doc="The metric value computed by this task.",
+        storageClass="MetricValue",
+        dimensions={"instrument", "visit"},
+    )
+
+
+class PipelineVisitTimingMetricConfig(PipelineTimingMetricConfig,
+                                      pipelineConnections=PipelineVisitTimingMetricConnections):
+    pass
+
+
+class PipelineVisitTimingMetricTask(PipelineTimingMetricTask):
+    """A Task that computes the wall-clock time for a whole visit, from the
+    first detector starting the pipeline to the last one finishing it,
+    using metadata produced by the `lsst.utils.timer.timeMethod` decorator.
+
+    The measurement extras give the distribution of the per-detector
+    pipeline times and the detector that finished last, to find the
+    stragglers that gate alert latency.
+
+    Parameters
+    ----------
+    args
+    kwargs
+        Constructor parameters are the same as for
+        `lsst.verify.tasks.MetricTask`.
+    """
+
+    _DefaultName = "pipelineVisitTimingMetric"
+    ConfigClass = PipelineVisitTimingMetricConfig
+
+    def runQuantum(self, butlerQC, inputRefs, outputRefs):
+        metadataStart = {ref.dataId["detector"]: butlerQC.get(ref) for ref in inputRefs.metadataStart}
+        metadataEnd = {ref.dataId["detector"]: butlerQC.get(ref) for ref in inputRefs.metadataEnd}
+        outputs = self.run(metadataStart, metadataEnd)
+        if outputs.measurement is not None:
+            butlerQC.put(outputs, outputRefs)
+
+    def run(self, metadataStart, metadataEnd):
+        """Compute the visit wall-clock time from science task metadata.
+
+        Parameters
+        ----------
+        metadataStart : `dict` [`int`, `lsst.pipe.base.TaskMetadata`]
+            The metadata of the first quantum run by the pipeline, keyed by
+            detector.
+        metadataEnd : `dict` [`int`, `lsst.pipe.base.TaskMetadata`]
+            The metadata of the last quantum run by the pipeline, keyed by
+            detector.
+
+        Returns
+        -------
+        result : `lsst.pipe.base.Struct`
+            A `~lsst.pipe.base.Struct` containing the following component:
+
+            - ``measurement``: the time from the earliest detector start to
+              the latest detector end (`lsst.verify.Measurement`). Its
+              extras are the median, 95th percentile and maximum of the
+              per-detector times, the detector that finished last, and
+              the time between the first and last detectors to finish.
+
+        Raises
+        ------
+        lsst.verify.tasks.MetricComputationError
+            Raised if the strings returned by `getInputMetadataKeys` match
+            more than one key in any metadata object, or if a timestamp is
+            invalid.
+        lsst.pipe.base.NoWorkFound
+            Raised if no detector has both start and end timing information.
+        """
+        detectors = []
+        startTimes = []
+        endTimes = []
+        for detector in sorted(metadataStart.keys() & metadataEnd.keys()):
+            timingsStart = self._keyIndex.extract(metadataStart[detector])
+            timingsEnd = self._keyIndex.extract(metadataEnd[detector])
+            if timingsStart["StartTimestamp"] is None or timingsEnd["EndTimestamp"] is None:
+                self.log.debug("No timing information for detector %d.", detector)
+                continue
+            try:
+                startTimes.append(datetime.fromisoformat(timingsStart["StartTimestamp"]))
+                endTimes.append(datetime.fromisoformat(timingsEnd["EndTimestamp"]))
+            except (TypeError, ValueError) as e:
+                raise MetricComputationError(f"Invalid metadata for detector {detector}") from e
+            detectors.append(detector)
+
+        if not detectors:
+            raise NoWorkFound(f"Nothing to do: no timing information for {self.config.targetStart} "
+                              f"and {self.config.targetEnd} found for any detector.")
+
+        latencies = np.array([(end - start).total_seconds() for start, end in zip(startTimes, endTimes)])
+        first = min(startTimes)
+        last = max(endTimes)
+        critical = endTimes.index(last)
+
+        meas = Measurement(self.config.metricName, (last - first).total_seconds() * u.second)
+        meas.notes["estimator"] = "utils.timer.timeMethod"
+        meas.extras["start"] = Datum(first.isoformat())
+        meas.extras["end"] = Datum(last.isoformat())
+        meas.extras["nDetectors"] = Datum(len(detectors), label="Detectors with timing information")
+        meas.extras["medianDetectorTime"] = Datum(np.median(latencies) * u.second)
+        meas.extras["p95DetectorTime"] = Datum(np.percentile(latencies, 95) * u.second)
+        meas.extras["maxDetectorTime"] = Datum(np.max(latencies) * u.second)
+        meas.extras["criticalDetector"] = Datum(int(detectors[critical]), label="Last detector to finish")
+        meas.extras["finishSpread"] = Datum((last - min(endTimes)).total_seconds() * u.second,
+                                            label="Time between the first and last detectors to finish")
+        return Struct(measurement=meas)
+
+
+class _PipelineResourceMetricTask(PipelineTimingMetricTask):
+    """Base class for metrics of the resources used by a pipeline, using
+    metadata produced by the `lsst.utils.timer.timeMethod` decorator.
+
+    Subclasses implement `makeMeasurement`.
+    """
+
+    @classmethod
+    def getInputMetadataKeys(cls, config):
+        """Get search strings for the metadata.
+
+        Parameters
+        ----------
+        config : ``cls.ConfigClass``
+            Configuration for this task.
+
+        Returns
+        -------
+        keys : `dict`
+            A dictionary of keys, optionally prefixed by one or more tasks in
+            the format of `lsst.pipe.base.Task.getFullMetadata()`. In
+            addition to the keys of
+            `PipelineTimingMetricTask.getInputMetadataKeys`:
+
+             ``"StartTaskStartCpuTime"``, ``"StartTaskEndCpuTime"``
+                 The keys for the process CPU time, in seconds, when the
+                 starting target started and ended (`float`).
+             ``"EndTaskStartCpuTime"``, ``"EndTaskEndCpuTime"``
+                 The keys for the process CPU time, in seconds, when the
+                 final target started and ended (`float`).
+             ``"StartTaskMaxResidentSetSize"``
+                 The key for the peak resident set size, in bytes, of the
+                 process when the starting target ended (`int`).
+             ``"EndTaskStartMaxResidentSetSize"``
+                 The key for the peak resident set size, in bytes, of the
+                 process when the final target started (`int`).
+             ``"EndTaskMaxResidentSetSize"``
+                 The key for the peak resident set size, in bytes, of the
+                 process when the final target ended (`int`).
+        """
+        keys = super().getInputMetadataKeys(config)
+        keys.update({
+            "StartTaskStartCpuTime": config.targetStart + "StartCpuTime",
+            "StartTaskEndCpuTime": config.targetStart + "EndCpuTime",
+            "EndTaskStartCpuTime": config.targetEnd + "StartCpuTime",
+            "EndTaskEndCpuTime": config.targetEnd + "EndCpuTime",
+            "StartTaskMaxResidentSetSize": config.targetStart + "EndMaxResidentSetSize",
+            "EndTaskStartMaxResidentSetSize": config.targetEnd + "StartMaxResidentSetSize",
+            "EndTaskMaxResidentSetSize": config.targetEnd + "EndMaxResidentSetSize",
+        })
+        return keys
+
+    def run(self, metadataStart, metadataEnd):
+        """Compute the metric from science task metadata.
+
+        Parameters
+        ----------
+        metadataStart : `lsst.pipe.base.TaskMetadata`
+            A metadata object for the first quantum run by the pipeline.
+        metadataEnd : `lsst.pipe.base.TaskMetadata`
+            A metadata object for the last quantum run by the pipeline.
+
+        Returns
+        -------
+        result : `lsst.pipe.base.Struct`
+            A `~lsst.pipe.base.Struct` containing the following component:
+
+            - ``measurement``: the value of the metric
+              (`lsst.verify.Measurement`)
+
+        Raises
+        ------
+        lsst.verify.tasks.MetricComputationError
+            Raised if the strings returned by `getInputMetadataKeys` match
+            more than one key in either metadata object, or if the metadata
+            values are invalid.
+        lsst.pipe.base.NoWorkFound
+            Raised if the metric is ill-defined. Typically this means that at
+            least one pipeline step was not run.
+        """
+        valuesStart = self._keyIndex.extract(metadataStart)
+        valuesEnd = self._keyIndex.extract(metadataEnd)
+        values = {key: value for key, value in valuesStart.items() if key.startswith("Start")}
+        values.update({key: value for key, value in valuesEnd.items() if key.startswith("End")})
+        return Struct(measurement=self.makeMeasurement(values))
+
+    def makeMeasurement(self, values):
+        """Compute the measurement from the metadata values.
+
+        Parameters
+        ----------
+        values : `dict` [`str`]
+            The values of the keys returned by `getInputMetadataKeys`. Keys
+            starting with ``Start`` are read from the starting task's
+            metadata, and the others from the final task's metadata.
+
+        Returns
+        -------
+        measurement : `lsst.verify.Measurement`
+            The value of the metric.
+        """
+        raise NotImplementedError
+
+    def _getCpuTimes(self, values):
+        """Return the CPU time spent by the whole pipeline, and by each of
+        the starting and final targets.
+
+        CPU times are per-process counters, so they are only compared if
+        both targets are in the same quantum, or if ``config.sameProcess``
+        says that all quanta run in one process, as in Prompt Processing.
+        Even then, counters that went backwards between the targets show
+        that they did not run in the same process.
+
+        Raises
+        ------
+        lsst.pipe.base.NoWorkFound
+            Raised if the CPU times are missing, or are not known to come
+            from the same process.
+        lsst.verify.tasks.MetricComputationError
+            Raised if the metadata values are invalid.
+        """
+        labelStart = self.config.connections.labelStart
+        labelEnd = self.config.connections.labelEnd
+        if labelStart != labelEnd and not self.config.sameProcess:
+            raise NoWorkFound(f"Nothing to do: CPU times of {labelStart} and {labelEnd} are only comparable "
+                              "if they run in the same process; set sameProcess if they do.")
+        for key in ["StartTaskStartCpuTime", "EndTaskEndCpuTime"]:
+            if values[key] is None:
+                raise NoWorkFound(f"Nothing to do: no {key} information found.")
+        # Pairs of counters, each of which never decreases within a process.
+        ordered = [("StartTaskStartCpuTime", "StartTaskEndCpuTime"),
+                   ("EndTaskStartCpuTime", "EndTaskEndCpuTime"),
+                   ("StartTaskStartCpuTime", "EndTaskEndCpuTime"),
+                   ]
+        if self.config.targetStart != self.config.targetEnd:
+            ordered += [("StartTaskEndCpuTime", "EndTaskStartCpuTime"),
+                        ("StartTaskMaxResidentSetSize", "EndTaskStartMaxResidentSetSize"),
+                        ]
+        try:
+            for earlier, later in ordered:
+                if values[earlier] is not None and values[later] is not None \
+                        and float(values[later]) < float(values[earlier]):
+                    raise NoWorkFound(f"Nothing to do: {later} is less than {earlier}, so "
+                                      f"{self.config.targetStart} and {self.config.targetEnd} did not run "
+                                      "in this order in the same process.")
+            total = float(values["EndTaskEndCpuTime"]) - float(values["StartTaskStartCpuTime"])
+            perTask = {}
+            targets = [(self.config.targetStart, "StartTask"), (self.config.targetEnd, "EndTask")]
+            for target, prefix in targets:
+                start = values[prefix + "StartCpuTime"]
+                end = values[prefix + "EndCpuTime"]
+                if start is not None and end is not None:
+                    perTask[target] = float(end) - float(start)
+        except (TypeError, ValueError) as e:
+            raise MetricComputationError("Invalid metadata") from e
+        return total, perTask
+
+    @staticmethod
+    def _addPeakTask(meas, perTask):
+        if perTask:
+            meas.extras["peakTask"] = Datum(max(perTask, key=perTask.get), label="Most expensive target")
+
+
+class PipelineCpuTimeMetricConnections(
+        PipelineTimingMetricConnections,
+        dimensions={"instrument", "visit", "detector"},
+        defaultTemplates={"labelStart": "",
+                          "labelEnd": "",
+                          "package": "ap_pipe",
+                          "metric": "ApPipelineCpuTime"}):
+    pass
+
+
+class _PipelineCpuMetricConfig(PipelineTimingMetricConfig):
+    sameProcess = pexConfig.Field(
+        dtype=bool,
+        doc="Whether the starting and final tasks run in the same process, as in "
+            "Prompt Processing. CPU times of different quanta are only compared "
+            "if this is set.",
+        default=False,
+    )
+
+
+class PipelineCpuTimeMetricConfig(_PipelineCpuMetricConfig,
+                                  pipelineConnections=PipelineCpuTimeMetricConnections):
+    pass
+
+
+class PipelineCpuTimeMetricTask(_PipelineResourceMetricTask):
+    """A Task that computes the CPU time used by an entire pipeline, using
+    metadata produced by the `lsst.utils.timer.timeMethod` decorator.
+
+    The starting and final tasks must run in the same process; unless they
+    are the same task, set ``config.sameProcess`` to say that they do.
+
+    Parameters
+    ----------
+    args
+    kwargs
+        Constructor parameters are the same as for
+        `lsst.verify.tasks.MetricTask`.
+    """
+
+    _DefaultName = "pipelineCpuTimeMetric"
+    ConfigClass = PipelineCpuTimeMetricConfig
+
+    def makeMeasurement(self, values):
+        total, perTask = self._getCpuTimes(values)
+        meas = Measurement(self.config.metricName, total * u.second)
+        meas.notes["estimator"] = "utils.timer.timeMethod"
+        self._addPeakTask(meas, perTask)
+        return meas
+
+
+class PipelineCpuEfficiencyMetricConnections(
+        PipelineTimingMetricConnections,
+        dimensions={"instrument", "visit", "detector"},
+        defaultTemplates={"labelStart": "",
+                          "labelEnd": "",
+                          "package": "ap_pipe",
+                          "metric": "ApPipelineCpuEfficiency"}):
+    pass
+
+
+class PipelineCpuEfficiencyMetricConfig(_PipelineCpuMetricConfig,
+                                        pipelineConnections=PipelineCpuEfficiencyMetricConnections):
+    pass
+
+
+class PipelineCpuEfficiencyMetricTask(_PipelineResourceMetricTask):
+    """A Task that computes the ratio of CPU time to wall-clock time for an
+    entire pipeline, using metadata produced by the
+    `lsst.utils.timer.timeMethod` decorator.
+
+    Values well below one mean that the pipeline mostly waits on I/O or
+    other services; values above one mean that it runs multithreaded code.
+    The starting and final tasks must run in the same process; unless they
+    are the same task, set ``config.sameProcess`` to say that they do.
+
+    Parameters
+    ----------
+    args
+    kwargs
+        Constructor parameters are the same as for
+        `lsst.verify.tasks.MetricTask`.
+    """
+
+    _DefaultName = "pipelineCpuEfficiencyMetric"
+    ConfigClass = PipelineCpuEfficiencyMetricConfig
+
+    def makeMeasurement(self, values):
+        total, perTask = self._getCpuTimes(values)
+        if values["StartTimestamp"] is None or values["EndTimestamp"] is None:
+            raise NoWorkFound("Nothing to do: no timestamp information found.")
+        try:
+            startTime = datetime.fromisoformat(values["StartTimestamp"])
+            endTime = datetime.fromisoformat(values["EndTimestamp"])
+        except (TypeError, ValueError) as e:
+            raise MetricComputationError("Invalid metadata") from e
+        wallTime = (endTime - startTime).total_seconds()
+        if wallTime <= 0:
+            raise NoWorkFound("Nothing to do: the pipeline took no wall-clock time.")
+
+        meas = Measurement(self.config.metricName, total / wallTime * u.dimensionless_unscaled)
+        meas.notes["estimator"] = "utils.timer.timeMethod"
+        meas.extras["cpuTime"] = Datum(total * u.second)
+        meas.extras["wallTime"] = Datum(wallTime * u.second)
+        self._addPeakTask(meas, perTask)
+        return meas
+
+
+class PipelinePeakMemoryMetricConnections(
+        PipelineTimingMetricConnections,
+        dimensions={"instrument", "visit", "detector"},
+        defaultTemplates={"labelStart": "",
+                          "labelEnd": "",
+                          "package": "ap_pipe",
+                          "metric": "ApPipelineMaxRss"}):
+    pass
+
+
+class PipelinePeakMemoryMetricConfig(PipelineTimingMetricConfig,
+                                     pipelineConnections=PipelinePeakMemoryMetricConnections):
+    pass
+
+
+class PipelinePeakMemoryMetricTask(_PipelineResourceMetricTask):
+    """A Task that computes the peak resident set size of the processes
+    running the starting and final tasks of a pipeline, using metadata
+    produced by the `lsst.utils.timer.timeMethod` decorator.
+
+    Parameters
+    ----------
+    args
+    kwargs
+        Constructor parameters are the same as for
+        `lsst.verify.tasks.MetricTask`.
+    """
+
+    _DefaultName = "pipelinePeakMemoryMetric"
+    ConfigClass = PipelinePeakMemoryMetricConfig
+
+    def makeMeasurement(self, values):
+        perTask = {}
+        for target, key in [(self.config.targetStart, "StartTaskMaxResidentSetSize"),
+                            (self.config.targetEnd, "EndTaskMaxResidentSetSize")]:
+            if values[key] is not None:
+                try:
+                    perTask[target] = int(values[key])
+                except (TypeError, ValueError) as e:
+                    raise MetricComputationError("Invalid metadata") from e
+        if not perTask:
+            raise NoWorkFound(f"Nothing to do: no memory information for {self.config.targetStart} "
+                              f"or {self.config.targetEnd} found.")
+
+        meas = Measurement(self.config.metricName, max(perTask.values()) * u.byte)
+        meas.notes["estimator"] = "utils.timer.timeMethod"
+        self._addPeakTask(meas, perTask)
+        return meas
+
+
+class PipelineStageTimingConnections(PipelineTaskConnections,
+                                     dimensions={"instrument", "visit", "detector"}):
+    stageTiming = connTypes.Output(
+        name="ap_pipe_stage_timing",
+        doc="Wall-clock time, CPU time and peak memory of each pipeline stage, "
+            "with the idle time before it.",
+        storageClass="ArrowAstropy",
+        dimensions={"instrument", "visit", "detector"},
+    )
+
+    def __init__(self, *, config=None):
+        super().__init__(config=config)
+        # One metadata input per stage; their number depends on the config.
+        for label in config.stages:
+            dimensions = ({"instrument", "exposure", "detector"} if label in config.exposureStages
+                          else {"instrument", "visit", "detector"})
+            setattr(self, _stageConnectionName(label), connTypes.Input(
+                name=f"{label}_metadata",
+                doc=f"Metadata of the {label} task.",
+                storageClass="TaskMetadata",
+                dimensions=dimensions,
+            ))
+
+
+class PipelineStageTimingConfig(PipelineTaskConfig, pipelineConnections=PipelineStageTimingConnections):
+    stages = pexConfig.ListField(
+        dtype=str,
+        doc="Labels of the tasks to time, in pipeline order.",
+        default=["isr", "calibrateImage", "buildTemplate", "subtractImages",
+                 "detectAndMeasureDiaSource", "computeReliability", "associateApdb"],
+    )
+    exposureStages = pexConfig.ListField(
+        dtype=str,
+        doc="Labels in ``stages`` whose metadata has exposure instead of visit dimensions.",
+        default=["isr"],
+    )
+    method = pexConfig.Field(
+        dtype=str,
+        doc="The method, decorated with `lsst.utils.timer.timeMethod`, to time in each stage.",
+        default="run",
+    )
+
+
+def _stageConnectionName(label):
+    return f"metadata_{label}"
+
+
+class PipelineStageTimingTask(PipelineTask):
+    """A Task that breaks down the time taken by a pipeline into its stages,
+    using metadata produced by the `lsst.utils.timer.timeMethod` decorator.
+
+    For each stage, it reports the wall-clock time, CPU time and peak
+    resident set size of the configured method, and the idle time between
+    the end of the previous stage and its start.
+    """
+
+    _DefaultName = "pipelineStageTiming"
+    ConfigClass = PipelineStageTimingConfig
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._keyIndices = {label: _MetadataKeyIndex(self.getStageMetadataKeys(self.config, label))
+                            for label in self.config.stages}
+
+    def runQuantum(self, butlerQC, inputRefs, outputRefs):
+        inputs = butlerQC.get(inputRefs)
+        metadata = {label: inputs[_stageConnectionName(label)] for label in self.config.stages}
+        outputs = self.run(metadata)
+        butlerQC.put(outputs, outputRefs)
+
+    @classmethod
+    def getStageMetadataKeys(cls, config, label):
+        """Get search strings for the timing metadata of one stage.
+
+        Parameters
+        ----------
+        config : ``cls.ConfigClass``
+            Configuration for this task.
+        label : `str`
+            Label of the stage's task.
+
+        Returns
+        -------
+        keys : `dict` [`str`, `str`]
+            A dictionary of keys, in the format of
+            `lsst.pipe.base.Task.getFullMetadata()`, for the start and end
+            ``Utc``, ``CpuTime`` and ``MaxResidentSetSize`` values.
+        """
+        target = f"{label}.{config.method}"
+        return {f"{point}{value}": f"{target}{point}{value}"
+                for point in ("Start", "End")
+                for value in ("Utc", "CpuTime", "MaxResidentSetSize")}
+
+    def run(self, metadata):
+        """Compute the timing of each pipeline stage.
+
+        Parameters
+        ----------
+        metadata : `dict` [`str`, `lsst.pipe.base.TaskMetadata`]
+            The metadata of each stage, keyed by task label.
+
+        Returns
+        -------
+        result : `lsst.pipe.base.Struct`
+            A `~lsst.pipe.base.Struct` containing the following component:
+
+            - ``stageTiming``: one row per stage in ``config.stages``, with
+              its start and end times, wall-clock and CPU time, peak resident
+              set size, and idle time since the previous stage ended
+              (`astropy.table.Table`). Values are NaN for stages without
+              timing information.
+
+        Raises
+        ------
+        lsst.verify.tasks.MetricComputationError
+            Raised if a timing key matches more than one key in a metadata
+            object, or has an invalid value.
+        lsst.pipe.base.NoWorkFound
+            Raised if none of the stages has timing information.
+        """
+        stages = self.config.stages
+        starts = np.full(len(stages), "", dtype=object)
+        ends = np.full(len(stages), "", dtype=object)
+        wallTimes = np.full(len(stages), np.nan)
+        cpuTimes = np.full(len(stages), np.nan)
+        maxRss = np.full(len(stages), np.nan)
+        idleTimes = np.full(len(stages), np.nan)
+
+        previousEnd = None
+        for i, label in enumerate(stages):
+            values = self._keyIndices[label].extract(metadata[label])
+            if values["StartUtc"] is None or values["EndUtc"] is None:
+                self.log.warning("No timing information for %s.%s found.", label, self.config.method)
+                previousEnd = None
+                continue
+            try:
+                startTime = datetime.fromisoformat(values["StartUtc"])
+                endTime = datetime.fromisoformat(values["EndUtc"])
+            except (TypeError, ValueError) as e:
+                raise MetricComputationError(f"Invalid timing metadata for {label}") from e
+            starts[i] = values["StartUtc"]
+            ends[i] = values["EndUtc"]
+            wallTimes[i] = (endTime - startTime).total_seconds()
+            if values["StartCpuTime"] is not None and values["EndCpuTime"] is not None:
+                cpuTimes[i] = values["EndCpuTime"] - values["StartCpuTime"]
+            if values["EndMaxResidentSetSize"] is not None:
+                maxRss[i] = values["EndMaxResidentSetSize"]
+            if previousEnd is not None:
+                idleTimes[i] = (startTime - previousEnd).total_seconds()
+            previousEnd = endTime
+
+        if np.all(np.isnan(wallTimes)):
+            raise NoWorkFound(f"Nothing to do: no timing information for any of {stages} found.")
+
+        stageTiming = Table({
+            "stage": np.array(stages, dtype=str),
+            "start": starts.astype(str),
+            "end": ends.astype(str),
+            "wallTime": wallTimes * u.s,
+            "cpuTime": cpuTimes * u.s,
+            "maxResidentSetSize": maxRss * u.byte,
+            "idleBefore": idleTimes * u.s,
+        })
+        return Struct(stageTiming=stageTiming)
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+
+"""Prepare and submit the daytime Alert Production pipeline.
+
+By default, the whole night is one quantum graph and one BPS workflow, so
+that ``associateApdb`` runs in visit order over the night, as the
+``associationOrder`` ordering of the clustering config requires; the order
+of association determines the history of each DIAObject. With
+``--partition-by``, the night is instead split by observing block or by
+exposure range, and the quantum graph of each partition is built by its
+own ``pipetask qgraph`` process. The partitions are submitted one after
+another in exposure order, each as soon as its graph and those of all
+earlier partitions are ready, so that processing starts while later graphs
+are still being built. Since each partition is a separate workflow,
+association is only in visit order within a partition, and partitions may
+be associated out of order if they run at the same time; after a failed
+partition, later ones are not submitted. Every partition gets its own
+output run under the daytime output collection, which
+``update_ap_chains.py`` picks up as before.
+
+Unlike the ``submit_ap_daytime.sh`` it replaces, which put itself in the
+background, this script runs in the foreground until every workflow has
+been submitted; run it under ``nohup`` or ``screen`` to log out before then.
+
+Built graphs are kept in a cache, keyed on everything that goes into them:
+the expanded pipeline, the ``pipetask`` options, the exposures of the
+partition, and the runs that the input and skip-existing collections
+resolve to. Each cached graph records the output run it was built for,
+and whether it has been submitted. When a submission is repeated, for
+example after some graphs failed to build or submit, partitions whose key
+has not changed and that were not submitted yet reuse their cached graph,
+and are submitted to the output run it was built for; those already
+submitted are skipped, and only the others are built again. To rerun
+failed quanta of a submitted workflow, use ``bps restart`` instead. Runs
+are assumed not to gain datasets once they are in a chain; use
+``--no-cache`` if that is not the case.
+"""
+
+import argparse
+import datetime
+import hashlib
+import os
+import resource
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+
+from lsst.daf.butler import Butler, CollectionType
+from lsst.pipe.base import Pipeline
+
+CONFIG_VERSION = 1
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "daytime_ap.yaml")
+
+
+def load_config(path):
+    """Read the daytime AP configuration, expanding environment variables
+    in its paths.
+    """
+    with open(path) as stream:
+        config = yaml.safe_load(stream)
+    if config.get("version") != CONFIG_VERSION:
+        raise RuntimeError(f"{path} has version {config.get('version')}, "
+                           f"but this script supports version {CONFIG_VERSION}.")
+    for key in ("pipeline", "bpsConfig", "retainedTypes"):
+        config[key] = os.path.expandvars(config[key])
+    return config
+
+
+def make_data_query(config, day_obs):
+    """Return the data query selecting the whole night."""
+    bad_detectors = ",".join(str(detector) for detector in config["badDetectors"])
+    blocks = ",".join(f"'{block}'" for block in config["blocks"])
+    return (f"instrument='{config['instrument']}'"
+            f" AND skymap='{config['skymap']}'"
+            f" AND detector NOT IN ({bad_detectors})"
+            f" AND day_obs={day_obs}"
+            f" AND exposure.science_program IN ({blocks})")
+
+
+def make_partitions(butler, config, day_obs, partition_by, exposures_per_graph):
+    """Split the night into independent quantum graphs.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.Butler`
+        Butler to look up the exposures of the night in.
+    config : `dict`
+        Daytime AP configuration.
+    day_obs : `str`
+        Night to process, as YYYYMMDD.
+    partition_by : `str`
+        ``"night"``, for one graph of the whole night, ``"block"``, for one
+        graph per observing block, or ``"exposure"``, for one graph per
+        range of consecutive exposures.
+    exposures_per_graph : `int`
+        Number of exposures in each graph when partitioning by exposure.
+
+    Returns
+    -------
+    partitions : `list` [`tuple` [`str`, `str`, `list` [`int`]]]
+        Name, data query and exposure IDs of each partition, in exposure
+        order, leaving out those without exposures.
+    """
+    base_query = make_data_query(config, day_obs)
+    records = butler.query_dimension_records(
+        "exposure",
+        where=f"instrument='{config['instrument']}' AND day_obs={day_obs}",
+        explain=False,
+        limit=None,
+    )
+    records = sorted((record for record in records if record.science_program in config["blocks"]),
+                     key=lambda record: record.id)
+
+    partitions = []
+    if partition_by == "night":
+        if records:
+            partitions.append(("night", base_query, [record.id for record in records]))
+    elif partition_by == "block":
+        for block in config["blocks"]:
+            exposures = [record.id for record in records if record.science_program == block]
+            if exposures:
+                partitions.append((block, f"{base_query} AND exposure.science_program='{block}'", exposures))
+    else:
+        for i in range(0, len(records), exposures_per_graph):
+            chunk = records[i:i + exposures_per_graph]
+            first, last = chunk[0].id, chunk[-1].id
+            partitions.append((f"exposures-{first}-{last}",
+                               f"{base_query} AND exposure >= {first} AND exposure <= {last}",
+                               [record.id for record in chunk]))
+    # Blocks may interleave in time; association must follow the exposures.
+    partitions.sort(key=lambda partition: partition[2][0])
+    return partitions
+
+
+def qgraph_options(config, args, query):
+    """Return the ``pipetask qgraph`` options of one partition, other than
+    its output run and graph file.
+    """
+    return [
+        "-p", config["pipeline"],
+        "-b", config["butlerConfig"],
+        "-i", ",".join(config["inputCollections"]).format(day_obs=args.day_obs),
+        "--output", config["outputCollection"].format(day_obs=args.day_obs),
+        "-d", query,
+        "--skip-existing-in", ",".join(config["skipExistingIn"]).format(day_obs=args.day_obs),
+        "--retained-dataset-types", config["retainedTypes"],
+        "--prune-unanchored-quanta", "getRegionTimeFromVisit:associateApdb",
+        "-c", "parameters:release_id=1",
+        "-c", f"parameters:apdb_config={config['apdbConfig']}",
+        "-c", "associateApdb:doRunForcedMeasurement=False",
+        "--dataset-query-constraint", "off",
+        "--qgraph-datastore-records",
+    ]
+
+
+def make_cache_context(butler, config, args):
+    """Hash the parts of the graph cache keys shared by all partitions.
+
+    Returns
+    -------
+    context : `hashlib.sha256`
+        Hash of the expanded pipeline, the retained dataset types, and the
+        runs that the input and skip-existing collections resolve to; each
+        partition's key is made from a copy of it.
+    """
+    context = hashlib.sha256()
+    # The string form of a pipeline has its imports resolved, so that
+    # changes to the ingredients it is built from are also seen.
+    context.update(str(Pipeline.from_uri(config["pipeline"])).encode())
+    with open(config["retainedTypes"], "rb") as stream:
+        context.update(stream.read())
+    # The output chain is left out: every submission adds runs to it, and
+    # partitions do not take inputs from each other.
+    collections = [collection.format(day_obs=args.day_obs)
+                   for collection in [*config["inputCollections"], *config["skipExistingIn"]]]
+    for collection in collections:
+        runs = butler.collections.query(collection, flatten_chains=True, collection_types=CollectionType.RUN)
+        context.update(f"{collection}: {','.join(runs)}\n".encode())
+    return context
+
+
+def cache_key(context, config, args, query, exposures):
+    """Return the graph cache key of one partition."""
+    key = context.copy()
+    key.update("\0".join(qgraph_options(config, args, query)).encode())
+    key.update(",".join(str(exposure) for exposure in exposures).encode())
+    return key.hexdigest()
+
+
+def read_cache_entry(cache_dir, key):
+    """Return the record of a cached graph.
+
+    Returns
+    -------
+    entry : `dict` or `None`
+        The ``outputRun`` the graph was built for, and whether it has been
+        ``submitted``, or `None` if there is no complete entry for ``key``.
+    """
+    path = os.path.join(cache_dir, f"{key}.yaml")
+    if not os.path.exists(path) or not os.path.exists(os.path.join(cache_dir, f"{key}.qg")):
+        return None
+    with open(path) as stream:
+        return yaml.safe_load(stream)
+
+
+def write_cache_entry(cache_dir, key, output_run, submitted, qgraph=None):
+    """Record a cached graph, copying it into the cache if ``qgraph`` is
+    given.
+
+    Files are written through temporary ones, so that an interrupted write
+    is never taken for a cached graph.
+    """
+    if qgraph is not None:
+        path = os.path.join(cache_dir, f"{key}.qg")
+        shutil.copyfile(qgraph, path + ".partial")
+        os.replace(path + ".partial", path)
+    path = os.path.join(cache_dir, f"{key}.yaml")
+    with open(path + ".partial", "w") as stream:
+        yaml.safe_dump({"outputRun": output_run, "submitted": submitted}, stream)
+    os.replace(path + ".partial", path)
+
+
+def build_graph(config, args, name, query, output_run, qgraph):
+    """Build the quantum graph of one partition with ``pipetask qgraph``.
+
+    Returns
+    -------
+    returncode : `int`
+        Exit status of ``pipetask``.
+    """
+    command = [
+        "pipetask", "qgraph",
+        *qgraph_options(config, args, query),
+        "--output-run", output_run,
+        "-q", qgraph,
+    ]
+    with open(os.path.join(args.log_dir, f"{name}.out"), "a") as log:
+        log.write(f"[{datetime.datetime.now()}] Building quantum graph for {name}\n")
+        log.flush()
+        return subprocess.run(command, stdout=log, stderr=subprocess.STDOUT).returncode
+
+
+def submit_graph(config, args, name, output_run, qgraph):
+    """Submit the quantum graph of one partition with ``bps submit``.
+
+    Returns
+    -------
+    returncode : `int`
+        Exit status of ``bps``.
+    """
+    command = [
+        "bps", "submit", config["bpsConfig"],
+        "--qgraph", qgraph,
+        "--extra-run-quantum-options", "--no-raise-on-partial-outputs",
+        "--input", ",".join(config["inputCollections"]).format(day_obs=args.day_obs),
+        "--output", config["outputCollection"].format(day_obs=args.day_obs),
+        "--output-run", output_run,
+    ]
+    with open(os.path.join(args.log_dir, f"{name}.out"), "a") as log:
+        log.write(f"[{datetime.datetime.now()}] Submitting BPS workflow for {name}\n")
+        log.flush()
+        return subprocess.run(command, stdout=log, stderr=subprocess.STDOUT).returncode
+
+
+def main(args):
+    config = load_config(args.config)
+
+    # Redirect Cassandra logs
+    os.environ["DAX_APDB_MONITOR_CONFIG"] = "logging:lsst.dax.apdb.monitor"
+    # Allow many open files, in this process and the ones it starts
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    limit = 65536 if hard == resource.RLIM_INFINITY else min(65536, hard)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+
+    butler = Butler(config["butlerConfig"])
+    partitions = make_partitions(butler, config, args.day_obs, args.partition_by, args.exposures_per_graph)
+    if not partitions:
+        print(f"No exposures from {', '.join(config['blocks'])} found for day_obs {args.day_obs}.")
+        return
+
+    # Generate explicit output runs so that each pre-built quantum graph
+    # shares its name with the eventual BPS submission.
+    timestamp = datetime.datetime.now(datetime.UTC).strftime("%Y%m%dT%H%M%SZ")
+    output_collection = config["outputCollection"].format(day_obs=args.day_obs)
+    qgraph_dir = os.path.join(os.getcwd(), "qgraphs", args.day_obs, timestamp)
+    os.makedirs(qgraph_dir, exist_ok=True)
+    if args.log_dir is None:
+        args.log_dir = qgraph_dir
+    os.makedirs(args.log_dir, exist_ok=True)
+    context = None
+    if not args.no_cache:
+        if args.cache_dir is None:
+            args.cache_dir = os.path.join(os.getcwd(), "qgraphs", "cache")
+        os.makedirs(args.cache_dir, exist_ok=True)
+        context = make_cache_context(butler, config, args)
+
+    print(f"Submitting {len(partitions)} partitions of day_obs {args.day_obs} "
+          f"(config version {config['version']})")
+    print(f"APDB config: {config['apdbConfig']}")
+    print(f"Quantum graphs and logs written to {qgraph_dir}")
+
+    failed = []
+    skipped = []
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        pending = []
+        cached = []
+        for name, query, exposures in partitions:
+            output_run = f"{output_collection}/{timestamp}"
+            if args.partition_by != "night":
+                output_run += f"/{name}"
+            qgraph = os.path.join(qgraph_dir, f"{name}.qg")
+            key = None
+            if context is not None:
+                key = cache_key(context, config, args, query, exposures)
+                entry = read_cache_entry(args.cache_dir, key)
+                if entry is not None and entry["submitted"]:
+                    print(f"{name} was already submitted to {entry['outputRun']}; skipping it.")
+                    continue
+                if entry is not None:
+                    # A graph is only ever submitted to the run it was
+                    # built for.
+                    shutil.copyfile(os.path.join(args.cache_dir, f"{key}.qg"), qgraph)
+                    cached.append(name)
+                    pending.append((name, entry["outputRun"], qgraph, key, None))
+                    continue
+            future = executor.submit(build_graph, config, args, name, query, output_run, qgraph)
+            pending.append((name, output_run, qgraph, key, future))
+        if cached:
+            print(f"Reusing cached quantum graphs for {', '.join(cached)}")
+
+        # Submissions are made from this thread, one at a time and in
+        # exposure order, while the remaining graphs keep building.
+        for name, output_run, qgraph, key, future in pending:
+            returncode = future.result() if future is not None else 0
+            if returncode != 0:
+                print(f"[{datetime.datetime.now()}] Building the quantum graph for {name} failed.")
+                failed.append(name)
+                continue
+            if key is not None and future is not None:
+                write_cache_entry(args.cache_dir, key, output_run, submitted=False, qgraph=qgraph)
+            if failed:
+                # Submitting later exposures before the failed ones would
+                # associate them out of order.
+                skipped.append(name)
+                continue
+            if submit_graph(config, args, name, output_run, qgraph) != 0:
+                print(f"[{datetime.datetime.now()}] Submitting {name} failed.")
+                failed.append(name)
+                continue
+            if key is not None:
+                write_cache_entry(args.cache_dir, key, output_run, submitted=True)
+            print(f"[{datetime.datetime.now()}] Submitted {name} to {output_run}")
+
+    if failed:
+        message = f"Failed partitions, see their logs in {args.log_dir}: {', '.join(failed)}"
+        if skipped:
+            message += f"\nPartitions not submitted after the failure: {', '.join(skipped)}"
+        raise SystemExit(message)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build and submit the daytime AP quantum graphs of a night, one partition at a time."
+    )
+    parser.add_argument("day_obs", help="Day observation date in YYYYMMDD")
+    parser.add_argument(
+        "--config",
+        "-c",
+        default=DEFAULT_CONFIG,
+        help="Daytime AP configuration (default: daytime_ap.yaml next to this script)",
+    )
+    parser.add_argument(
+        "--partition-by",
+        choices=["night", "block", "exposure"],
+        default="night",
+        help="Build one graph for the whole night, or one per observing block or range of exposures; "
+             "partitions are associated in visit order only within each (default: night)",
+    )
+    parser.add_argument(
+        "--exposures-per-graph",
+        type=int,
+        default=100,
+        help="Number of exposures in each graph with --partition-by exposure (default: 100)",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=4,
+        help="Number of quantum graphs built at the same time (default: 4)",
+    )
+    parser.add_argument(
+        "--log-dir",
+        default=None,
+        help="Directory for the per-partition logs (default: the quantum graph directory)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Directory of the quantum graph cache (default: qgraphs/cache)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Build every quantum graph from scratch, and do not cache them",
+    )
+    args = parser.parse_args()
+    main(args)
@@ -1,97 +0,0 @@
-#!/bin/bash
-set -eu
-
-# An executable script that will prepare and submit the daytime Alert Production pipeline
-
-if [ "$#" -ne 1 ]; then
-    echo "Usage: $0 YYYYMMDD" >&2
-    exit 1
-fi
-
-DAY_OBS="$1"
-
-# Redirect Cassandra logs
-export DAX_APDB_MONITOR_CONFIG="logging:lsst.dax.apdb.monitor"
-
-# Configure the filesystem to allow many open files
-ulimit -n 65536
-
-INSTRUMENT="LSSTCam"
-
-# List of detectors currently excluded from Prompt Processing
-# These include the non-imaging wavefront sensors as well as some that are disabled in fan-out.
-# See https://github.com/lsst-sqre/phalanx/blob/main/applications/next-visit-fan-out/values-usdfprod-prompt-processing.yaml
-BAD_DETECTORS="120 122 0 20 27 65 123 161 168 188 1 19 30 68 158 169 187 \
-189 190 191 192 193 194 195 196 197 198 199 200 201 202 203 204"
-
-# Space-delimited list of observing blocks that generate science images
-# See https://github.com/lsst-sqre/phalanx/blob/main/applications/prompt-keda-lsstcam/values-usdfprod-prompt-processing.yaml#L21-L45
-BLOCKS="BLOCK-365 BLOCK-407 BLOCK-430 BLOCK-432 \
-BLOCK-T698 BLOCK-T703 BLOCK-T704 BLOCK-T706"
-
-OUTPUT_COLLECTION="LSSTCam/runs/daytimeAP/${DAY_OBS}"
-
-LOG_FILE="output-${DAY_OBS}.out"
-
-# Convert lists to SQL IN() form
-BAD_DETECTORS_SQL="($(printf '%s,' $BAD_DETECTORS | sed 's/,$//'))"
-BLOCKS_SQL="($(printf "'%s'," $BLOCKS | sed 's/,$//'))"
-
-# Pipeline and butler config must mirror bps_Daytime.yaml — we replicate them
-# here because we build the quantum graph ourselves before calling BPS.
-PIPELINE_YAML="${AP_PIPE_DIR}/pipelines/LSSTCam/ApPipe.yaml"
-APDB_CONFIG="s3://embargo@rubin-summit-users/apdb_config/cassandra/pp_apdb_lsstcam.yaml"
-BUTLER_CONFIG="embargo"
-INPUT_COLLECTIONS="LSSTCam/defaults,LSSTCam/templates,LSSTCam/runs/prompt-${DAY_OBS}"
-RETAINED_TYPES="${AP_PIPE_DIR}/scripts/LSSTCam/retained_types.yaml"
-
-# Generate an explicit output run so the pre-built quantum graph
-# shares a single name with the eventual BPS submission.
-TIMESTAMP=$(date -u +"%Y%m%dT%H%M%SZ")
-OUTPUT_RUN="${OUTPUT_COLLECTION}/${TIMESTAMP}"
-
-QGRAPH_DIR="$(pwd)/qgraphs/${DAY_OBS}/${TIMESTAMP}"
-mkdir -p "$QGRAPH_DIR"
-QGRAPH="${QGRAPH_DIR}/daytime.qg"
-
-DATA_QUERY="instrument='$INSTRUMENT' \
-    AND skymap='lsst_cells_v2' \
-    AND detector NOT IN $BAD_DETECTORS_SQL \
-    AND day_obs=$DAY_OBS \
-    AND exposure.science_program IN $BLOCKS_SQL"
-
-{
-    set -e
-
-    echo "[$(date)] Step 1/2: building quantum graph"
-    pipetask qgraph \
-        -p "$PIPELINE_YAML" \
-        -b "$BUTLER_CONFIG" \
-        -i "$INPUT_COLLECTIONS" \
-        --output "$OUTPUT_COLLECTION" \
-        --output-run "$OUTPUT_RUN" \
-        -d "$DATA_QUERY" \
-        --skip-existing-in "LSSTCam/runs/prompt-${DAY_OBS}" \
-        --retained-dataset-types "$RETAINED_TYPES" \
-        --prune-unanchored-quanta getRegionTimeFromVisit:associateApdb \
-        -c "parameters:release_id=1" \
-        -c "parameters:apdb_config=${APDB_CONFIG}" \
-        -c "associateApdb:doRunForcedMeasurement=False" \
-        --dataset-query-constraint off \
-        --qgraph-datastore-records \
-        -q "$QGRAPH"
-
-    echo "[$(date)] Step 2/2: submitting BPS workflow"
-    bps submit "${AP_PIPE_DIR}/bps/LSSTCam/bps_Daytime.yaml" \
-        --qgraph "$QGRAPH" \
-        --extra-run-quantum-options "--no-raise-on-partial-outputs" \
-        --input "$INPUT_COLLECTIONS" \
-        --output "$OUTPUT_COLLECTION" \
-        --output-run "$OUTPUT_RUN"
-} > "${LOG_FILE}" 2>&1 &
-disown
-
-echo "Submission started for day_obs ${DAY_OBS}"
-echo "APDB config: ${APDB_CONFIG}"
-echo "Quantum graph: ${QGRAPH}"
-echo "Submission output log written to ${LOG_FILE}"
@@ -5,6 +5,8 @@ import datetime
 
 from lsst.daf.butler import Butler, CollectionType
 
+DAYTIME_PREFIX = "LSSTCam/runs/daytimeAP/"
+
 
 def get_last_night():
     """Return last night's date in YYYYMMDD format UTC."""
@@ -13,32 +15,140 @@ def get_last_night():
     return last_night.strftime("%Y%m%d")
 
 
-def main(args):
-    day_obs = args.day_obs
-    butler = Butler(args.repo, writeable=True)
+def get_nights(start, end):
+    """Return the nights from ``start`` to ``end``, inclusive, in YYYYMMDD
+    format.
+    """
+    first = datetime.datetime.strptime(start, "%Y%m%d")
+    last = datetime.datetime.strptime(end, "%Y%m%d")
+    if first > last:
+        raise ValueError(f"Start of range {start} is after its end {end}.")
+    return [(first + datetime.timedelta(days=i)).strftime("%Y%m%d") for i in range((last - first).days + 1)]
 
-    prompt_chain = f"LSSTCam/runs/prompt-{day_obs}"
-    daytime_chain = f"LSSTCam/runs/daytimeAP-{day_obs}"
 
-    daytime_prefix = f"LSSTCam/runs/daytimeAP/{day_obs}"
-    collections = butler.collections.query(
-        daytime_prefix, flatten_chains=True, collection_types=CollectionType.RUN
-    )
-    runs = [col for col in collections if col.startswith(daytime_prefix)]
+def find_daytime_runs(butler, nights):
+    """Find the Daytime AP runs of each night with a single query.
+
+    Returns
+    -------
+    runs : `dict` [`str`, `list` [`str`]]
+        Runs of each night that has any, in the search order of the
+        night's ``{DAYTIME_PREFIX}{day_obs}`` output chain, so that newer
+        runs come before the ones they supersede.
+    """
+    infos = {info.name: info for info in butler.collections.query_info(f"{DAYTIME_PREFIX}*")}
+
+    def flatten(name):
+        info = infos.get(name)
+        if info is None:
+            # Not a Daytime AP collection.
+            return
+        if info.type == CollectionType.CHAINED:
+            for child in info.children:
+                yield from flatten(child)
+        elif info.type == CollectionType.RUN:
+            yield name
+
+    runs = {}
+    for day_obs in sorted(nights):
+        night_runs = list(dict.fromkeys(flatten(f"{DAYTIME_PREFIX}{day_obs}")))
+        if night_runs:
+            runs[day_obs] = night_runs
+    return runs
+
+
+def plan_updates(butler, runs):
+    """Work out the new definition of every chain to update.
+
+    Returns
+    -------
+    updates : `list` [`tuple`]
+        Name, current children (`None` if the chain does not exist yet), new
+        children, and runs to prepend of each chain whose definition
+        changes. Chains with no runs to prepend (`None`) are redefined.
+    """
+    chains = {info.name: info.children for info in butler.collections.query_info(
+        ["LSSTCam/runs/prompt-*", "LSSTCam/runs/daytimeAP-*"], collection_types=CollectionType.CHAINED
+    )}
+    updates = []
+    for day_obs, night_runs in sorted(runs.items()):
+        prompt_chain = f"LSSTCam/runs/prompt-{day_obs}"
+        daytime_chain = f"LSSTCam/runs/daytimeAP-{day_obs}"
+        if prompt_chain not in chains:
+            print(f"Chain {prompt_chain} does not exist; skipping day_obs {day_obs}.")
+            continue
+        # Prepending a run that is already in a chain moves it to the front.
+        current = chains[prompt_chain]
+        new = night_runs + [col for col in current if col not in night_runs]
+        if list(current) != new:
+            updates.append((prompt_chain, current, new, night_runs))
+        current = chains.get(daytime_chain)
+        if current is None or list(current) != night_runs:
+            updates.append((daytime_chain, current, night_runs, None))
+    return updates
+
+
+def print_diff(name, current, new):
+    """Print the changes to the definition of a chain."""
+    if current is None:
+        print(f"Chain {name} (new):")
+    else:
+        print(f"Chain {name}:")
+    current = [] if current is None else list(current)
+    for col in new:
+        print(f"  {'+' if col not in current else ' '} {col}")
+    for col in current:
+        if col not in new:
+            print(f"  - {col}")
+
+
+def apply_updates(butler, updates, batch_size):
+    """Update chains, committing ``batch_size`` of them per transaction.
 
+    Runs are prepended to the prompt chains rather than redefining them
+    from the definitions read by `plan_updates`, so that children added
+    since then are kept.
+    """
+    for i in range(0, len(updates), batch_size):
+        batch = updates[i:i + batch_size]
+        with butler.transaction():
+            for name, current, new, prepend in batch:
+                if prepend is not None:
+                    butler.collections.prepend_chain(name, prepend)
+                    continue
+                if current is None:
+                    butler.collections.register(name, type=CollectionType.CHAINED)
+                butler.collections.redefine_chain(name, new)
+        for name, *_ in batch:
+            print(f"Chain {name} is defined.")
+
+
+def main(args):
+    if args.start or args.end:
+        try:
+            nights = get_nights(args.start or args.end, args.end or args.start)
+        except ValueError as e:
+            raise SystemExit(str(e))
+    else:
+        nights = [args.day_obs]
+    butler = Butler(args.repo, writeable=not args.dry_run)
+
+    runs = find_daytime_runs(butler, set(nights))
+    for day_obs in nights:
+        if day_obs not in runs:
+            print(
+                f"No runs found matching prefix '{DAYTIME_PREFIX}{day_obs}'"
+            )
     if not runs:
-        print(
-            f"No runs found matching prefix '{daytime_prefix}'"
-        )
         return
 
-    print(f"Prepending runs to chain {prompt_chain}:")
-    for run in runs:
-        print(f"  {run}")
-    butler.collections.prepend_chain(prompt_chain, runs)
-    butler.collections.register(daytime_chain, type=CollectionType.CHAINED)
-    butler.collections.redefine_chain(daytime_chain, runs)
-    print(f"Chain {daytime_chain} is defined.")
+    updates = plan_updates(butler, runs)
+    for name, current, new, _ in updates:
+        print_diff(name, current, new)
+    if not updates:
+        print("All chains are up to date.")
+    elif not args.dry_run:
+        apply_updates(butler, updates, args.batch_size)
 
 
 if __name__ == "__main__":
@@ -51,8 +161,31 @@ if __name__ == "__main__":
         default=get_last_night(),
         help="Day observation date in YYYYMMDD (default: last night UTC)",
     )
+    parser.add_argument(
+        "--start",
+        "-s",
+        default=None,
+        help="First day observation date in YYYYMMDD of a range to update; overrides --day_obs",
+    )
+    parser.add_argument(
+        "--end",
+        "-e",
+        default=None,
+        help="Last day observation date in YYYYMMDD of a range to update; overrides --day_obs",
+    )
     parser.add_argument(
         "--repo", "-r", default="embargo", help="Repo location (default: 'embargo')"
     )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=50,
+        help="Number of chains redefined in each registry transaction (default: 50)",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Print the changes to the chains without making them",
+    )
     args = parser.parse_args()
     main(args)
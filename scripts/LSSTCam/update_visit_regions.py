@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+# This file is part of ap_pipe.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Update the butler regions of visits from their visit summaries.
+
+The regions of visits and of their detectors are first defined from the
+predicted pointing in the nextVisit event. Once ``consolidateVisitSummary``
+has run, this replaces them with the regions of the calibrated images, like
+``butler update-dimension-regions``, but with the visits split into ranges
+that are processed by several worker processes. Each worker commits its
+records in batches whose size adapts to how long the registry takes to
+write them.
+
+With ``--incremental``, the visit summaries that have been applied are
+recorded in a state file, and later calls only process the new ones; with
+``--watch``, the collection is polled until no new visit summaries have
+appeared for a while, so that regions are updated as visits finish rather
+than after the whole workflow. This needs the visit summaries to be
+registered as they are written; with a quantum-backed butler they are only
+registered by the finalJob, and the daytime submissions rely on their
+separate per-partition runs for earlier updates instead.
+
+The logging options of the ``butler`` command (``--log-level``,
+``--long-log``, ``--log-file``, ``--log-tty``/``--no-log-tty`` and
+``--log-label``) are accepted, so that the script can take a BPS job's
+``{finalPreCmdOpts}`` like the ``butler`` commands it replaces.
+"""
+
+import argparse
+import logging
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from lsst.daf.butler import Butler
+from lsst.daf.butler.cli.cliLog import CliLog
+from lsst.sphgeom import ConvexPolygon, LonLat, UnitVector3d
+
+_log = logging.getLogger("lsst.ap.pipe.update_visit_regions")
+
+# The writeable butler of a worker process, created by _init_worker.
+_worker_butler = None
+
+
+class AdaptiveBatchSize:
+    """Batch size that tracks a target duration per registry transaction.
+
+    Parameters
+    ----------
+    initial : `int`
+        Initial number of records per batch.
+    target : `float`
+        Target duration of a transaction, in seconds.
+    minimum, maximum : `int`
+        Bounds on the number of records per batch.
+    """
+
+    def __init__(self, initial, target, minimum=100, maximum=20000):
+        self.size = initial
+        self.target = target
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def update(self, n_records, duration):
+        """Adjust the batch size after a transaction of ``n_records`` took
+        ``duration`` seconds.
+        """
+        if n_records == 0 or duration <= 0.0:
+            return
+        # Scale towards the rate just measured, but by at most a factor of
+        # two per batch, so that one slow transaction does not collapse it.
+        scale = min(2.0, max(0.5, self.target / duration))
+        self.size = int(min(self.maximum, max(self.minimum, n_records * scale)))
+
+
+def _make_region(ra_corners, dec_corners):
+    return ConvexPolygon([UnitVector3d(LonLat.fromDegrees(ra, dec))
+                          for ra, dec in zip(ra_corners, dec_corners)])
+
+
+def compute_regions(instrument, visit, summary):
+    """Compute the regions of a visit and its detectors.
+
+    Parameters
+    ----------
+    instrument : `str`
+        Name of the instrument.
+    visit : `int`
+        ID of the visit.
+    summary : `lsst.afw.table.ExposureCatalog`
+        Visit summary, with one row per detector.
+
+    Returns
+    -------
+    visit_region : `lsst.sphgeom.ConvexPolygon` or `None`
+        Region covering all the detectors, or `None` if none of them have
+        valid corners.
+    detector_records : `list` [`dict`]
+        ``visit_detector_region`` records of the detectors with valid
+        corners.
+    """
+    detector_records = []
+    vertices = []
+    for row in summary:
+        ra_corners, dec_corners = row["raCorners"], row["decCorners"]
+        if not all(math.isfinite(value) for value in [*ra_corners, *dec_corners]):
+            continue
+        detector_records.append({
+            "instrument": instrument,
+            "visit": visit,
+            "detector": row["id"],
+            "region": _make_region(ra_corners, dec_corners),
+        })
+        vertices.extend(zip(ra_corners, dec_corners))
+    if not vertices:
+        return None, []
+    return _make_region(*zip(*vertices)), detector_records
+
+
+def _init_worker(butler_config):
+    """Create the writeable butler shared by all shards of a worker process.
+
+    Parameters
+    ----------
+    butler_config : `str`
+        Location of the butler repository.
+    """
+    global _worker_butler
+    _worker_butler = Butler(butler_config, writeable=True)
+
+
+def update_shard(instrument, refs, batch_size, target_seconds):
+    """Update the regions of a range of visits.
+
+    This is run in a worker process, with the butler created by
+    `_init_worker`.
+
+    Parameters
+    ----------
+    instrument : `str`
+        Name of the instrument.
+    refs : `list` [`lsst.daf.butler.DatasetRef`]
+        Visit summaries of the visits to update.
+    batch_size : `int`
+        Initial number of records per transaction.
+    target_seconds : `float`
+        Target duration of each transaction.
+
+    Returns
+    -------
+    n_visits : `int`
+        Number of visits updated.
+    """
+    butler = _worker_butler
+    visits = sorted(ref.dataId["visit"] for ref in refs)
+    visit_records = {record.id: record for record in butler.query_dimension_records(
+        "visit",
+        instrument=instrument,
+        where=f"visit >= {visits[0]} AND visit <= {visits[-1]}",
+        explain=False,
+        limit=None,
+    )}
+    batch = AdaptiveBatchSize(batch_size, target_seconds)
+
+    pending_visits = []
+    pending_detectors = []
+    n_visits = 0
+
+    def flush():
+        start = time.monotonic()
+        with butler.transaction():
+            butler.registry.insertDimensionData("visit", *pending_visits, replace=True)
+            butler.registry.insertDimensionData("visit_detector_region", *pending_detectors, replace=True)
+        batch.update(len(pending_visits) + len(pending_detectors), time.monotonic() - start)
+        pending_visits.clear()
+        pending_detectors.clear()
+
+    for ref in sorted(refs, key=lambda ref: ref.dataId["visit"]):
+        visit = ref.dataId["visit"]
+        if visit not in visit_records:
+            continue
+        region, detector_records = compute_regions(instrument, visit, butler.get(ref))
+        if region is None:
+            continue
+        visit_record = visit_records[visit].toDict()
+        visit_record["region"] = region
+        pending_visits.append(visit_record)
+        pending_detectors.extend(detector_records)
+        n_visits += 1
+        if len(pending_visits) + len(pending_detectors) >= batch.size:
+            flush()
+    if pending_visits:
+        flush()
+    return n_visits
+
+
+def make_shards(refs, visits_per_shard):
+    """Split visit summaries into ranges of consecutive visits."""
+    refs = sorted(refs, key=lambda ref: ref.dataId["visit"])
+    return [refs[i:i + visits_per_shard] for i in range(0, len(refs), visits_per_shard)]
+
+
+def load_state(path):
+    """Return the IDs of the visit summaries already applied."""
+    if path is None or not os.path.exists(path):
+        return set()
+    with open(path) as stream:
+        return {line.strip() for line in stream if line.strip()}
+
+
+def update_regions(butler, executor, args, done, state):
+    """Update the regions of all visits whose summaries are not in ``done``.
+
+    The shards of visits are processed by ``executor``, whose workers must
+    have been initialized by `_init_worker`.
+
+    Returns
+    -------
+    n_visits : `int`
+        Number of visits updated.
+    """
+    refs = [ref for ref in butler.query_datasets(
+        args.dataset_type,
+        collections=args.collection,
+        instrument=args.instrument,
+        where=args.where or "",
+        explain=False,
+        limit=None,
+    ) if str(ref.id) not in done]
+    if not refs:
+        return 0
+
+    shards = make_shards(refs, args.visits_per_shard)
+    _log.info("Updating the regions of %d visits in %d shards.", len(refs), len(shards))
+    n_visits = 0
+    futures = {executor.submit(update_shard, args.instrument, shard,
+                               args.batch_size, args.target_seconds): shard
+               for shard in shards}
+    for future in as_completed(futures):
+        shard = futures[future]
+        n_visits += future.result()
+        ids = [str(ref.id) for ref in shard]
+        done.update(ids)
+        if state is not None:
+            state.write("".join(f"{id}\n" for id in ids))
+            state.flush()
+    return n_visits
+
+
+def _parse_log_levels(values):
+    """Convert ``--log-level`` values of the form ``[component=]LEVEL`` into
+    the levels taken by `~lsst.daf.butler.cli.cliLog.CliLog`.
+    """
+    levels = []
+    for value in values:
+        component, _, level = value.rpartition("=")
+        levels.append((component or None, level.upper()))
+    return levels
+
+
+def main(args):
+    CliLog.initLog(longlog=args.long_log, log_tty=args.log_tty, log_file=tuple(args.log_file),
+                   log_label=dict(label.split("=", 1) for label in args.log_label))
+    CliLog.setLogLevels(_parse_log_levels(args.log_level))
+    butler = Butler(args.butler_config)
+    done = load_state(args.state) if args.incremental else set()
+    state = open(args.state, "a") if args.incremental else None
+    # Each worker keeps one registry connection for all of its shards.
+    executor = ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker,
+                                   initargs=(args.butler_config,))
+    try:
+        n_visits = update_regions(butler, executor, args, done, state)
+        if args.watch:
+            idle_since = time.monotonic()
+            while time.monotonic() - idle_since < args.idle_timeout:
+                time.sleep(args.watch)
+                # Pick up the visit summaries registered since the last poll.
+                butler.registry.refresh()
+                n_new = update_regions(butler, executor, args, done, state)
+                if n_new:
+                    n_visits += n_new
+                    idle_since = time.monotonic()
+    finally:
+        executor.shutdown()
+        if state is not None:
+            state.close()
+    _log.info("Updated the regions of %d visits in %s.", n_visits, args.collection)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Update the regions of visits and detectors from their visit summaries, in parallel."
+    )
+    parser.add_argument("butler_config", help="Location of the butler repository")
+    parser.add_argument("instrument", help="Name of the instrument")
+    parser.add_argument("collection", help="Collection to search for visit summaries")
+    parser.add_argument(
+        "--dataset-type",
+        default="preliminary_visit_summary",
+        help="Dataset type of the visit summaries (default: preliminary_visit_summary)",
+    )
+    parser.add_argument(
+        "--where",
+        default=None,
+        help="Data query restricting the visits to update",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=8,
+        help="Number of worker processes, each with its own registry connection (default: 8)",
+    )
+    parser.add_argument(
+        "--visits-per-shard",
+        type=int,
+        default=50,
+        help="Number of consecutive visits handled by a worker at a time (default: 50)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=2000,
+        help="Initial number of records written per transaction (default: 2000)",
+    )
+    parser.add_argument(
+        "--target-seconds",
+        type=float,
+        default=5.0,
+        help="Transaction duration that the batch size is adjusted towards (default: 5)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Skip the visit summaries listed in --state, and add the ones applied to it",
+    )
+    parser.add_argument(
+        "--state",
+        default=None,
+        help="State file of --incremental; required with it",
+    )
+    parser.add_argument(
+        "--watch",
+        type=float,
+        default=None,
+        help="Keep polling the collection for new visit summaries every this many seconds",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=1800.0,
+        help="With --watch, stop after this many seconds without new visit summaries (default: 1800)",
+    )
+    log_options = parser.add_argument_group("logging options, as for the butler command")
+    log_options.add_argument("--log-level", "-l", action="append", default=[],
+                             help="Logging level, or component=level; may be repeated")
+    log_options.add_argument("--long-log", action="store_true", help="Use the long log format")
+    log_options.add_argument("--log-file", action="append", default=[],
+                             help="File to also write the log to; may be repeated")
+    log_options.add_argument("--log-tty", action=argparse.BooleanOptionalAction, default=True,
+                             help="Log to the terminal (default: yes)")
+    log_options.add_argument("--log-label", action="append", default=[],
+                             help="Label of the form key=value added to log records; may be repeated")
+    args = parser.parse_args()
+    if args.incremental and args.state is None:
+        parser.error("--incremental requires --state.")
+    if any("=" not in label for label in args.log_label):
+        parser.error("--log-label values must be of the form key=value.")
+    main(args)
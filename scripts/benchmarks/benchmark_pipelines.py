@@ -0,0 +1,324 @@
+# This file is part of ap_pipe.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import contextlib
+import datetime
+import json
+import logging
+import os
+import platform
+import re
+import statistics
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, RawTextHelpFormatter
+
+import lsst.daf.butler.tests as butlerTests
+from lsst.daf.butler import Butler
+from lsst.pipe.base import Pipeline
+from lsst.pipe.base.all_dimensions_quantum_graph_builder import AllDimensionsQuantumGraphBuilder
+from lsst.resources import ResourcePath
+
+# Overall inputs that the pipelines cannot define themselves. These must
+# match INITIAL_DATASET_TYPES in tests/test_pipelines.py, which checks it.
+_INITIAL_DATASET_TYPES = [("ps1_pv3_3pi_20170110", {"htm7"}, "SimpleCatalog"),
+                          ("gaia_dr2_20200414", {"htm7"}, "SimpleCatalog"),
+                          ("gaia_dr3_20230707", {"htm7"}, "SimpleCatalog"),
+                          ]
+
+
+def build_argparser():
+    parser = ArgumentParser(
+        description="""Benchmark loading and graph-building of the AP pipelines.
+
+        For each pipeline variant, this times parsing the pipeline file with
+        its imports, building its pipeline graph (including evaluating its
+        contracts), and resolving that graph and registering its dataset
+        types against a synthetic butler registry. With
+        a butler repository and a data query, it also times building a
+        quantum graph. The timings are appended to a JSON history, and any
+        stage that is slower than its recent history by more than a
+        threshold is reported as a regression.
+        """,
+        formatter_class=RawTextHelpFormatter,
+        epilog="More information is available at https://pipelines.lsst.io.",
+        add_help=True,
+    )
+    parser.add_argument(
+        "-p",
+        "--pipelines",
+        type=str,
+        help="Regular expression matched against the pipeline paths relative\n"
+             "to the pipelines directory.",
+        default=r"^[^_][^/]*/ApPipe[^/]*\.yaml$",
+        metavar="REGEX",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        help="Number of times each stage is timed; the fastest is kept.",
+        default=3,
+        metavar="N",
+    )
+    parser.add_argument(
+        "-H",
+        "--history",
+        type=str,
+        help="JSON history file to compare with and append to. Only the runs\n"
+             "made on this host are compared with.",
+        default="pipeline_benchmarks.json",
+        metavar="PATH",
+    )
+    parser.add_argument(
+        "--baseline-runs",
+        type=int,
+        help="Number of recent runs whose median is the baseline of each stage.",
+        default=5,
+        metavar="N",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        help="Fractional slowdown over the baseline that counts as a regression.",
+        default=0.25,
+        metavar="F",
+    )
+    parser.add_argument(
+        "--min-delta",
+        type=float,
+        help="Smallest slowdown, in seconds, that counts as a regression.",
+        default=0.05,
+        metavar="S",
+    )
+    parser.add_argument(
+        "-b",
+        "--butler-config",
+        type=str,
+        help="Butler repository to build quantum graphs against; without\n"
+             "one, that stage is skipped.",
+        default=None,
+        metavar="TEXT",
+    )
+    parser.add_argument(
+        "-i",
+        "--input-collections",
+        type=str,
+        help="Comma-separated input collections for quantum graph building.",
+        default=None,
+        metavar="COLL",
+    )
+    parser.add_argument(
+        "-d",
+        "--dataquery",
+        type=str,
+        help="Data query for quantum graph building.",
+        default="",
+        metavar="TEXT",
+    )
+    parser.add_argument(
+        "--no-save",
+        action="store_true",
+        help="Compare with the history without adding this run to it.",
+    )
+    parser.add_argument(
+        "--fail-on-regression",
+        action="store_true",
+        help="Exit with an error status if any stage regressed.",
+    )
+    return parser
+
+
+def _best_time(function, repeat, setup=None):
+    """Return the result of the last call of ``function``, and the shortest
+    time it took over ``repeat`` calls.
+
+    If ``setup`` is given, it is called, untimed, before each call of
+    ``function`` with a `contextlib.ExitStack` that is closed after it, and
+    returns the arguments of ``function``.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        with contextlib.ExitStack() as stack:
+            args = setup(stack) if setup is not None else ()
+            start = time.perf_counter()
+            result = function(*args)
+            best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def _load(uri):
+    pipeline = Pipeline.from_uri(uri)
+    # apdb_config has no default and must be set before to_graph().
+    pipeline.addConfigOverride("parameters", "apdb_config", "some/file/path.yaml")
+    return pipeline
+
+
+def _make_synthetic_repo(stack):
+    """Make an empty butler repository with the overall inputs of the
+    pipelines, removed when ``stack`` is closed.
+    """
+    root = stack.enter_context(tempfile.TemporaryDirectory())
+    butler = butlerTests.makeTestRepo(root)
+    stack.callback(butler.close)
+    for name, dimensions, storageClass in _INITIAL_DATASET_TYPES:
+        butlerTests.addDatasetType(butler, name, dimensions, storageClass)
+    return butler
+
+
+def _resolve(graph, butler):
+    graph.resolve(butler.registry)
+    graph.register_dataset_types(butler)
+
+
+def benchmark(uri, args, butler=None):
+    """Time the stages of loading and graph-building one pipeline.
+
+    Parameters
+    ----------
+    uri : `lsst.resources.ResourcePath`
+        The pipeline file.
+    args : `argparse.Namespace`
+        Command-line arguments.
+    butler : `lsst.daf.butler.Butler`, optional
+        Butler to build quantum graphs with.
+
+    Returns
+    -------
+    timings : `dict` [`str`, `float`]
+        Time taken by each stage, in seconds.
+    """
+    timings = {}
+    pipeline, timings["load"] = _best_time(lambda: _load(uri), args.repeat)
+    _, timings["toGraph"] = _best_time(pipeline.to_graph, args.repeat)
+    # Each repetition resolves a new graph in a new repository, made outside
+    # the timed call.
+    _, timings["resolve"] = _best_time(_resolve, args.repeat,
+                                       setup=lambda stack: (pipeline.to_graph(), _make_synthetic_repo(stack)))
+    if butler is not None:
+        def build():
+            builder = AllDimensionsQuantumGraphBuilder(
+                pipeline.to_graph(),
+                butler,
+                where=args.dataquery,
+                input_collections=butler.collections.defaults,
+                output_run="u/benchmark/unused",
+            )
+            return builder.build(attach_datastore_records=False)
+        # Quantum graph generation is slow enough that one call is
+        # representative.
+        _, timings["qgraph"] = _best_time(build, 1)
+    return timings
+
+
+def find_regressions(history, results, args, host=None):
+    """Compare new timings with the recent history.
+
+    Parameters
+    ----------
+    history : `list` [`dict`]
+        Previous runs, oldest first.
+    results : `dict` [`str`, `dict` [`str`, `float`]]
+        New timings of each stage of each pipeline.
+    args : `argparse.Namespace`
+        Command-line arguments.
+    host : `str`, optional
+        Host whose runs are compared with, since timings from other
+        machines are not comparable; defaults to this one.
+
+    Returns
+    -------
+    regressions : `list` [`tuple` [`str`, `str`, `float`, `float`]]
+        Pipeline, stage, baseline and new time of each regression.
+    """
+    host = platform.node() if host is None else host
+    history = [run for run in history if run.get("host") == host]
+    regressions = []
+    for variant, timings in results.items():
+        for stage, seconds in timings.items():
+            previous = [run["results"][variant][stage] for run in history
+                        if stage in run["results"].get(variant, {})][-args.baseline_runs:]
+            if not previous:
+                continue
+            baseline = statistics.median(previous)
+            if seconds > baseline * (1.0 + args.threshold) and seconds - baseline > args.min_delta:
+                regressions.append((variant, stage, baseline, seconds))
+    return regressions
+
+
+def main():
+    """Use this as the main entry point when calling from the command line."""
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+
+    args = build_argparser().parse_args()
+    root = ResourcePath("eups://ap_pipe/pipelines/", forceDirectory=True)
+    pattern = re.compile(args.pipelines)
+    files = sorted(
+        (file for file in ResourcePath.findFileResources([root], file_filter=r".*\.yaml$")
+         if pattern.search(file.relative_to(root))),
+        key=lambda file: file.relative_to(root),
+    )
+    if not files:
+        raise SystemExit(f"No pipelines match {args.pipelines!r}.")
+
+    butler = None
+    if args.butler_config:
+        collections = args.input_collections.split(",") if args.input_collections else None
+        butler = Butler(args.butler_config, collections=collections)
+
+    results = {}
+    for file in files:
+        variant = file.relative_to(root)
+        try:
+            results[variant] = benchmark(file, args, butler)
+        except Exception as e:
+            logger.warning("Could not benchmark %s: %s", variant, e)
+            continue
+        logger.info("%s: %s", variant,
+                    ", ".join(f"{stage} {seconds:.3f} s" for stage, seconds in results[variant].items()))
+
+    history = []
+    if os.path.exists(args.history):
+        with open(args.history) as stream:
+            history = json.load(stream)["runs"]
+    regressions = find_regressions(history, results, args)
+    for variant, stage, baseline, seconds in regressions:
+        logger.warning("%s: %s took %.3f s, against a baseline of %.3f s.", variant, stage, seconds, baseline)
+
+    if not args.no_save:
+        history.append({
+            "timestamp": datetime.datetime.now(datetime.UTC).isoformat(timespec="seconds"),
+            "host": platform.node(),
+            "results": results,
+        })
+        with open(args.history, "w") as stream:
+            json.dump({"runs": history}, stream, indent=1)
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+# This file is part of ap_pipe.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import sys
+from argparse import ArgumentParser, RawTextHelpFormatter
+
+import yaml
+
+from lsst.daf.butler import DimensionUniverse
+from lsst.pipe.base import Pipeline
+
+
+def build_argparser():
+    parser = ArgumentParser(
+        description="""Generate a bps clustering config for a pipeline.
+
+        Tasks are visited in pipeline order, and each one joins the cluster
+        of one of its producers if both have the same dimensions and either
+        the task is cheap or the cluster's run time stays under a target.
+        Keeping consumers with their producers means that their inputs are
+        read back from the same job, and fewer jobs have to be scheduled.
+        """,
+        formatter_class=RawTextHelpFormatter,
+        epilog="More information is available at https://pipelines.lsst.io.",
+        add_help=True,
+    )
+    parser.add_argument(
+        "-p",
+        "--pipeline",
+        type=str,
+        help="Pipeline to cluster, optionally with a #subset.",
+        required=True,
+        metavar="URI",
+    )
+    parser.add_argument(
+        "-c",
+        "--config",
+        type=str,
+        action="append",
+        help="Config override for the pipeline, as label:key=value; may be\n"
+             "repeated. parameters:apdb_config defaults to a placeholder, as\n"
+             "the AP pipelines cannot be built without one.",
+        default=[],
+        metavar="TEXT",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        help="Per-task profile written by recommend_bps_resources.py --profile;\n"
+             "without one, all tasks take --default-runtime.",
+        default=None,
+        metavar="PATH",
+    )
+    parser.add_argument(
+        "--default-runtime",
+        type=float,
+        help="Run time, in seconds, of tasks missing from the profile.",
+        default=30.0,
+        metavar="S",
+    )
+    parser.add_argument(
+        "--cheap-runtime",
+        type=float,
+        help="Tasks running faster than this, in seconds, always join a\n"
+             "producer's cluster when they can.",
+        default=30.0,
+        metavar="S",
+    )
+    parser.add_argument(
+        "--target-runtime",
+        type=float,
+        help="Run time, in seconds, that clusters should not grow beyond by\n"
+             "adding expensive tasks.",
+        default=600.0,
+        metavar="S",
+    )
+    parser.add_argument(
+        "--equal-dimensions",
+        type=str,
+        help="Comma-separated dimension pairs that cluster together, as in\n"
+             "the bps equalDimensions option.",
+        default="visit:exposure",
+        metavar="TEXT",
+    )
+    parser.add_argument(
+        "-x",
+        "--exclude",
+        type=str,
+        help="Comma-separated task labels to leave out of all clusters, for\n"
+             "example those used in a bps ordering.",
+        default="",
+        metavar="TEXT",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        help="Output clustering config; defaults to standard output.",
+        default=None,
+        metavar="PATH",
+    )
+    return parser
+
+
+class _Cluster:
+    """A group of tasks that bps runs in one job per data ID.
+    """
+
+    def __init__(self, index, label, dimensions, runtime, excluded=False):
+        self.index = index
+        self.excluded = excluded
+        self.labels = [label]
+        self.dimensions = dimensions
+        self.equalDimensions = set()
+        self.runtime = runtime
+        self.upstream = set()
+
+
+def _cluster_dimensions(taskNode, equalDimensions):
+    """Return the dimensions of a task as bps clustering dimensions, and
+    the equalDimensions pairs used to get them.
+    """
+    names = [name for name in taskNode.dimensions.required if name != "instrument"]
+    used = set()
+    for i, name in enumerate(names):
+        if name in equalDimensions:
+            names[i] = equalDimensions[name]
+            used.add(f"{equalDimensions[name]}:{name}")
+    return tuple(names), used
+
+
+def make_clusters(graph, runtimes, args):
+    """Group the tasks of a pipeline graph into clusters.
+
+    Parameters
+    ----------
+    graph : `lsst.pipe.base.pipeline_graph.PipelineGraph`
+        Resolved pipeline graph.
+    runtimes : `dict` [`str`, `float`]
+        Typical run time of each task, in seconds.
+    args : `argparse.Namespace`
+        Command-line arguments.
+
+    Returns
+    -------
+    clusters : `list` [`_Cluster`]
+        The clusters, in pipeline order.
+    """
+    equalDimensions = {}
+    for pair in filter(None, args.equal_dimensions.split(",")):
+        kept, replaced = pair.strip().split(":")
+        equalDimensions[replaced] = kept
+    exclude = {label.strip() for label in args.exclude.split(",") if label.strip()}
+
+    clusterOf = {}
+    clusters = []
+
+    def dependsOn(cluster, other):
+        # Whether ``cluster`` consumes, directly or not, from ``other``.
+        stack = [cluster]
+        seen = set()
+        while stack:
+            current = stack.pop()
+            if current is other:
+                return True
+            if current not in seen:
+                seen.add(current)
+                stack.extend(current.upstream)
+        return False
+
+    graph.sort()
+    for label, taskNode in graph.tasks.items():
+        runtime = runtimes.get(label, args.default_runtime)
+        dimensions, used = _cluster_dimensions(taskNode, equalDimensions)
+        producers = [producer.label for producer in map(graph.producer_of, graph.inputs_of(label))
+                     if producer is not None]
+        producerClusters = sorted({clusterOf[producer] for producer in producers if producer in clusterOf},
+                                  key=lambda cluster: cluster.index)
+
+        candidates = []
+        if label not in exclude and dimensions:
+            for cluster in producerClusters:
+                if cluster.excluded or cluster.dimensions != dimensions:
+                    continue
+                if runtime > args.cheap_runtime and cluster.runtime + runtime > args.target_runtime:
+                    continue
+                # Joining must not make the cluster depend on itself through
+                # another cluster.
+                if any(dependsOn(other, cluster) for other in producerClusters if other is not cluster):
+                    continue
+                shared = sum(1 for producer in producers if clusterOf.get(producer) is cluster)
+                candidates.append((-shared, cluster.runtime, cluster.index, cluster))
+
+        if candidates:
+            # Prefer the producer that the task reads the most from, then
+            # the shortest cluster.
+            cluster = min(candidates, key=lambda candidate: candidate[:3])[-1]
+            cluster.labels.append(label)
+            cluster.runtime += runtime
+        else:
+            cluster = _Cluster(len(clusters), label, dimensions, runtime, excluded=label in exclude)
+            clusters.append(cluster)
+        cluster.equalDimensions |= used
+        cluster.upstream.update(other for other in producerClusters if other is not cluster)
+        clusterOf[label] = cluster
+    return clusters
+
+
+def main():
+    """Use this as the main entry point when calling from the command line."""
+    args = build_argparser().parse_args()
+
+    pipeline = Pipeline.from_uri(args.pipeline)
+    # apdb_config has no default and must be set before to_graph(); its
+    # value does not affect the clustering.
+    pipeline.addConfigOverride("parameters", "apdb_config", "some/file/path.yaml")
+    for override in args.config:
+        label, _, assignment = override.partition(":")
+        key, _, value = assignment.partition("=")
+        if not label or not key or not _:
+            raise SystemExit(f"Config override {override!r} is not of the form label:key=value.")
+        pipeline.addConfigOverride(label, key, value)
+    graph = pipeline.to_graph()
+    graph.resolve(dimensions=DimensionUniverse())
+
+    runtimes = {}
+    if args.profile:
+        with open(args.profile) as stream:
+            profile = yaml.safe_load(stream)
+        runtimes = {label: task["runtimeMedian"] for label, task in profile["tasks"].items()}
+
+    clusters = make_clusters(graph, runtimes, args)
+
+    config = {}
+    for cluster in clusters:
+        # Single tasks already get one job per quantum.
+        if cluster.excluded or len(cluster.labels) < 2:
+            continue
+        entry = {"pipetasks": ",".join(cluster.labels), "dimensions": ",".join(cluster.dimensions)}
+        if cluster.equalDimensions:
+            entry["equalDimensions"] = ",".join(sorted(cluster.equalDimensions))
+        config[cluster.labels[0]] = entry
+
+    header = (f"# bps clustering config generated by make_clustering_config.py for\n"
+              f"# {args.pipeline}.\n"
+              f"#\n"
+              f"# Use it by adding it to the includeConfigs of your submit YAML.\n\n")
+    text = header + yaml.safe_dump(
+        {"clusterAlgorithm": "lsst.ctrl.bps.quantum_clustering_funcs.dimension_clustering",
+         "cluster": config},
+        sort_keys=False, width=1000,
+    )
+    if args.output:
+        with open(args.output, "w") as stream:
+            stream.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+if __name__ == "__main__":
+    main()
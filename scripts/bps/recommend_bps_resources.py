@@ -0,0 +1,329 @@
+# This file is part of ap_pipe.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import logging
+import math
+import random
+import re
+import sys
+import threading
+from argparse import ArgumentParser, RawTextHelpFormatter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import yaml
+
+from lsst.daf.butler import Butler
+
+_thread_state = threading.local()
+
+
+def build_argparser():
+    parser = ArgumentParser(
+        description="""Recommend bps requestMemory and requestWalltime values
+        for each task of a pipeline, from the metadata of a completed run.
+
+        The peak resident set size and the run time of each quantum are read
+        from the ``quantum`` section of the task metadata, and the requests
+        are sized to a quantile of their distribution plus some headroom.
+        The result is a bps config with a ``pipetask`` section, and
+        optionally a ``cluster`` section, to include in a submit YAML.
+        """,
+        formatter_class=RawTextHelpFormatter,
+        epilog="More information is available at https://pipelines.lsst.io.",
+        add_help=True,
+    )
+    parser.add_argument(
+        "-b",
+        "--butler-config",
+        type=str,
+        help="Location of the butler/registry config file.",
+        required=True,
+        metavar="TEXT",
+    )
+    parser.add_argument(
+        "-i",
+        "--input-collections",
+        type=str,
+        help="Comma-separated collections containing the metadata of the completed run.",
+        required=True,
+        metavar="COLL",
+    )
+    parser.add_argument(
+        "-d",
+        "--dataquery",
+        type=str,
+        help="Data query to select the quanta to use.",
+        required=False,
+        metavar="TEXT",
+    )
+    parser.add_argument(
+        "-l",
+        "--labels",
+        type=str,
+        help="Comma-separated task labels; defaults to every task with\n"
+             "metadata in the input collections.",
+        default=None,
+        metavar="TEXT",
+    )
+    parser.add_argument(
+        "-c",
+        "--clustering",
+        type=str,
+        help="bps clustering config whose clusters should also be sized.",
+        default=None,
+        metavar="PATH",
+    )
+    parser.add_argument(
+        "-q",
+        "--quantile",
+        type=float,
+        help="Quantile of the per-quantum memory and run time to size requests to.",
+        default=0.95,
+        metavar="Q",
+    )
+    parser.add_argument(
+        "--memory-headroom",
+        type=float,
+        help="Fractional headroom added to the memory quantile.",
+        default=0.2,
+        metavar="F",
+    )
+    parser.add_argument(
+        "--walltime-headroom",
+        type=float,
+        help="Fractional headroom added to the run time quantile.",
+        default=1.0,
+        metavar="F",
+    )
+    parser.add_argument(
+        "--min-memory",
+        type=int,
+        help="Smallest memory request, in MB (the bps default is 2048).",
+        default=2048,
+        metavar="MB",
+    )
+    parser.add_argument(
+        "--memory-step",
+        type=int,
+        help="Memory requests are rounded up to a multiple of this, in MB.",
+        default=512,
+        metavar="MB",
+    )
+    parser.add_argument(
+        "--min-walltime",
+        type=int,
+        help="Smallest walltime request, in seconds.",
+        default=600,
+        metavar="S",
+    )
+    parser.add_argument(
+        "-n",
+        "--max-quanta",
+        type=int,
+        help="Maximum number of quanta sampled per task.",
+        default=500,
+        metavar="N",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Number of threads reading metadata.",
+        default=8,
+        metavar="N",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        help="Output bps config file; defaults to standard output.",
+        default=None,
+        metavar="PATH",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        help="Also write the measured per-task memory and run time\n"
+             "distributions to this YAML file.",
+        default=None,
+        metavar="PATH",
+    )
+    return parser
+
+
+def _get_thread_butler(butler_config):
+    """Return a butler owned by the calling thread.
+    """
+    butler = getattr(_thread_state, "butler", None)
+    if butler is None:
+        butler = _thread_state.butler = Butler(butler_config)
+    return butler
+
+
+def read_quantum_resources(metadata):
+    """Read the peak memory and run time of one quantum from its metadata.
+
+    Parameters
+    ----------
+    metadata : `lsst.pipe.base.TaskMetadata`
+        Full metadata of the quantum, as written by the executor.
+
+    Returns
+    -------
+    resources : `tuple` [`float`, `float`] or `None`
+        The peak resident set size, in MB, and the time from the start of
+        the quantum's preparation to its end, in seconds; `None` if the
+        metadata does not have them.
+    """
+    if "quantum" not in metadata:
+        return None
+    quantum = metadata["quantum"]
+    try:
+        maxRss = quantum.getScalar("endMaxResidentSetSize")
+        start = datetime.fromisoformat(quantum.getScalar("prepUtc"))
+        end = datetime.fromisoformat(quantum.getScalar("endUtc"))
+    except (KeyError, TypeError, ValueError):
+        return None
+    return maxRss / 2**20, (end - start).total_seconds()
+
+
+def summarize(resources, quantile):
+    """Summarize the resources used by the quanta of one task.
+
+    Parameters
+    ----------
+    resources : `list` [`tuple` [`float`, `float`]]
+        Peak memory, in MB, and run time, in seconds, of each quantum.
+    quantile : `float`
+        Quantile to report.
+
+    Returns
+    -------
+    profile : `dict`
+        Number of quanta, quantile and maximum of the memory, and median,
+        quantile and maximum of the run time.
+    """
+    memory, runtime = (np.array(values) for values in zip(*resources))
+    return {
+        "quanta": len(resources),
+        "memoryQuantile": float(np.quantile(memory, quantile)),
+        "memoryMax": float(memory.max()),
+        "runtimeMedian": float(np.median(runtime)),
+        "runtimeQuantile": float(np.quantile(runtime, quantile)),
+        "runtimeMax": float(runtime.max()),
+    }
+
+
+def recommend(profile, args):
+    """Turn a task profile into bps resource requests.
+    """
+    memory = profile["memoryQuantile"] * (1.0 + args.memory_headroom)
+    memory = max(args.min_memory, math.ceil(memory / args.memory_step) * args.memory_step)
+    # Round the walltime up to whole minutes.
+    walltime = profile["runtimeQuantile"] * (1.0 + args.walltime_headroom)
+    walltime = max(args.min_walltime, 60 * math.ceil(walltime / 60))
+    return {"requestMemory": int(memory), "requestWalltime": int(walltime)}
+
+
+def recommend_clusters(clustering, requests):
+    """Size the clusters of a bps clustering config.
+
+    A cluster runs its quanta one after the other in a single job, so it
+    needs the largest memory request of its tasks and the sum of their
+    walltimes.
+    """
+    clusters = {}
+    for name, cluster in clustering.get("cluster", {}).items():
+        labels = [label.strip() for label in cluster.get("pipetasks", "").split(",")]
+        members = [requests[label] for label in labels if label in requests]
+        if not members:
+            continue
+        clusters[name] = {
+            "requestMemory": max(member["requestMemory"] for member in members),
+            "requestWalltime": sum(member["requestWalltime"] for member in members),
+        }
+    return clusters
+
+
+def main():
+    """Use this as the main entry point when calling from the command line."""
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+
+    args = build_argparser().parse_args()
+    butler = Butler(args.butler_config)
+    collections = [c.strip() for c in args.input_collections.split(",")]
+
+    if args.labels:
+        labels = [label.strip() for label in args.labels.split(",")]
+    else:
+        datasetTypes = butler.registry.queryDatasetTypes(re.compile(r".+_metadata"))
+        labels = sorted(datasetType.name.removesuffix("_metadata") for datasetType in datasetTypes)
+
+    rng = random.Random(0)
+    profiles = {}
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        for label in labels:
+            query_kwargs = dict(datasetType=f"{label}_metadata", collections=collections, findFirst=True)
+            if args.dataquery:
+                query_kwargs["where"] = args.dataquery
+            refs = list(butler.registry.queryDatasets(**query_kwargs))
+            if len(refs) > args.max_quanta:
+                refs = rng.sample(refs, args.max_quanta)
+            resources = [resource for resource in executor.map(
+                lambda ref: read_quantum_resources(_get_thread_butler(args.butler_config).get(ref)), refs
+            ) if resource is not None]
+            if not resources:
+                logger.warning("No quantum resource information found for %s.", label)
+                continue
+            profiles[label] = summarize(resources, args.quantile)
+            logger.info("%s: %d quanta, %.0f MB and %.0f s at quantile %g.", label, len(resources),
+                        profiles[label]["memoryQuantile"], profiles[label]["runtimeQuantile"], args.quantile)
+
+    requests = {label: recommend(profile, args) for label, profile in profiles.items()}
+    config = {"pipetask": requests}
+    if args.clustering:
+        with open(args.clustering) as stream:
+            clusters = recommend_clusters(yaml.safe_load(stream), requests)
+        if clusters:
+            config["cluster"] = clusters
+
+    header = (f"# Resource requests recommended by recommend_bps_resources.py from\n"
+              f"# {', '.join(collections)}, at quantile {args.quantile} with "
+              f"{args.memory_headroom:.0%} memory and {args.walltime_headroom:.0%} walltime headroom.\n")
+    text = header + yaml.safe_dump(config, sort_keys=False)
+    if args.output:
+        with open(args.output, "w") as stream:
+            stream.write(text)
+    else:
+        sys.stdout.write(text)
+
+    if args.profile:
+        with open(args.profile, "w") as stream:
+            yaml.safe_dump({"quantile": args.quantile, "tasks": profiles}, stream, sort_keys=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# This file is part of ap_pipe.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Micro-benchmark of the injection ID allocator used by
+`lsst.ap.pipe.createApFakes.CreateVisitDetectorFakesTask`.
+
+Compares the batched NumPy allocator against the previous per-ID
+``uuid.uuid4`` loop, for the same number of IDs and the same set of
+already-used IDs.
+"""
+
+import timeit
+import uuid
+from argparse import ArgumentParser
+
+import numpy as np
+
+from lsst.ap.pipe.createApFakes import CreateVisitDetectorFakesTask
+
+
+def legacy_make_unique_injection_ids(n_ids, used_ids=None):
+    """The per-ID allocator that `CreateVisitDetectorFakesTask` used to run.
+    """
+    used = set() if used_ids is None else {int(value) for value in used_ids}
+    injection_ids = []
+
+    while len(injection_ids) < n_ids:
+        candidate = uuid.uuid4().int & ((1 << 24) - 1)
+        if candidate in used:
+            continue
+        used.add(candidate)
+        injection_ids.append(candidate)
+
+    return np.asarray(injection_ids, dtype=np.int64)
+
+
+def build_argparser():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-n",
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1_000, 10_000, 100_000],
+        help="Numbers of IDs to allocate.",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=5,
+        help="Number of timing repetitions; the best one is reported.",
+    )
+    return parser
+
+
+def main():
+    args = build_argparser().parse_args()
+    task = CreateVisitDetectorFakesTask()
+
+    print(f"{'n_ids':>10} {'legacy [s]':>12} {'batched [s]':>12} {'speedup':>8}")
+    for n_ids in args.sizes:
+        # Mimic the variable-fakes call, which must avoid the IDs already
+        # handed out to the base catalog.
+        used_ids = task._make_unique_injection_ids(n_ids, np.random.default_rng(0))
+        legacy = min(timeit.repeat(
+            lambda: legacy_make_unique_injection_ids(n_ids, used_ids=used_ids),
+            number=1, repeat=args.repeat))
+        batched = min(timeit.repeat(
+            lambda: task._make_unique_injection_ids(n_ids, np.random.default_rng(1), used_ids=used_ids),
+            number=1, repeat=args.repeat))
+        print(f"{n_ids:>10d} {legacy:>12.4f} {batched:>12.4f} {legacy / batched:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
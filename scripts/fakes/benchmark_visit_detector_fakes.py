@@ -0,0 +1,138 @@
+# This file is part of ap_pipe.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Benchmark the wall-clock time and peak Python memory of
+`lsst.ap.pipe.createApFakes.CreateVisitDetectorFakesTask.run` on a dense,
+LSSTCam-sized detector.
+
+Run it from two checkouts of ap_pipe to compare implementations. Older
+versions of the task take the full ``visit_image`` instead of its
+components; the script passes whichever its ``run`` accepts, so the same
+script works on both sides of the comparison.
+
+No reference timings are recorded here: they depend on the machine and
+its load, and should be measured side by side on the machine of interest.
+"""
+
+import inspect
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+from lsst.afw.cameraGeom.testUtils import DetectorWrapper
+from lsst.afw.geom import makeCdMatrix, makeSkyWcs
+import lsst.afw.image as afwImage
+import lsst.afw.table as afwTable
+import lsst.geom as geom
+
+from lsst.ap.pipe.createApFakes import CreateVisitDetectorFakesTask
+
+
+def make_visit_image(width=4072, height=4000, visitId=2025061500123, detectorId=94):
+    """Make a blank exposure with the metadata of an LSSTCam science detector.
+    """
+    bbox = geom.Box2I(geom.Point2I(0, 0), geom.Extent2I(width, height))
+    exposure = afwImage.ExposureF(bbox)
+    exposure.setWcs(makeSkyWcs(crpix=geom.Point2D(width / 2, height / 2),
+                               crval=geom.SpherePoint(10.0, -1.0, geom.degrees),
+                               cdMatrix=makeCdMatrix(scale=0.2 * geom.arcseconds)))
+    exposure.setPhotoCalib(afwImage.PhotoCalib(1.0))
+    exposure.setDetector(DetectorWrapper(bbox=bbox, id=detectorId).detector)
+    exposure.info.setVisitInfo(afwImage.VisitInfo(id=visitId))
+    summaryStats = afwImage.ExposureSummaryStats()
+    summaryStats.magLim = 25.0
+    exposure.info.setSummaryStats(summaryStats)
+    return exposure
+
+
+def make_run_inputs(task, visit_image):
+    """Return the keyword arguments of ``task.run``, other than the source
+    catalog, for either the full exposure or its components.
+    """
+    if "visit_image" in inspect.signature(task.run).parameters:
+        return dict(visit_image=visit_image)
+    return dict(
+        wcs=visit_image.getWcs(),
+        bbox=visit_image.getBBox(),
+        photoCalib=visit_image.getPhotoCalib(),
+        summaryStats=visit_image.info.getSummaryStats(),
+        visitId=visit_image.info.getVisitInfo().id,
+        detectorId=visit_image.detector.getId(),
+    )
+
+
+def build_argparser():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-n",
+        "--n-random-fakes",
+        type=int,
+        default=50_000,
+        help="Number of random fakes per detector.",
+    )
+    parser.add_argument(
+        "--variable-fraction",
+        type=float,
+        default=0.1,
+        help="Fraction of fakes that get a variable twin.",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=5,
+        help="Number of timing repetitions; the best one is reported.",
+    )
+    return parser
+
+
+def main():
+    args = build_argparser().parse_args()
+
+    config = CreateVisitDetectorFakesTask.ConfigClass()
+    config.nRandomFakes = args.n_random_fakes
+    config.doAddRandomTemplateFakes = True
+    config.doAddVariableFakes = args.variable_fraction > 0
+    config.variableFakeFraction = args.variable_fraction
+    task = CreateVisitDetectorFakesTask(config=config)
+
+    visit_image = make_visit_image()
+    sourceCat = afwTable.SourceCatalog(afwTable.SourceTable.makeMinimalSchema())
+    inputs = make_run_inputs(task, visit_image)
+
+    times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        result = task.run(sourceCat, **inputs)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    task.run(sourceCat, **inputs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"rows: {len(result.outputCat)}")
+    print(f"best time: {min(times):.4f} s")
+    print(f"peak traced memory: {peak / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -20,13 +20,55 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+import json
 import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
 from argparse import ArgumentParser, RawTextHelpFormatter
+from collections import Counter, defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
+import numpy as np
 from astropy.table import vstack
 
-from lsst.daf.butler import Butler
-from lsst.source.injection import utils
+from lsst.daf.butler import Butler, DatasetType, MissingCollectionError, MissingDatasetTypeError
+from lsst.sphgeom import Angle, HtmPixelization, LonLat, UnitVector3d
+
+# Minimum number of seconds between two progress reports.
+_PROGRESS_INTERVAL = 30.0
+
+# Dataset type and HTM level of the sharded catalogs, as read by
+# lsst.source.injection.
+_OUTPUT_DATASET_TYPE = "injection_catalog"
+_HTM_LEVEL = 7
+
+# Padding added around input regions when deciding which trixels an input
+# may contribute to, so that fakes right on a detector edge are accounted
+# for.
+_REGION_PADDING = Angle.fromDegrees(1.0 / 60.0)
+
+# Vertices of the eight HTM root trixels S0-S3 and N0-N3, in the order
+# and orientation used by lsst.sphgeom.HtmPixelization.
+_HTM_ROOT_VERTICES = np.array([
+    [[1, 0, 0], [0, 0, -1], [0, 1, 0]],
+    [[0, 1, 0], [0, 0, -1], [-1, 0, 0]],
+    [[-1, 0, 0], [0, 0, -1], [0, -1, 0]],
+    [[0, -1, 0], [0, 0, -1], [1, 0, 0]],
+    [[1, 0, 0], [0, 0, 1], [0, -1, 0]],
+    [[0, -1, 0], [0, 0, 1], [-1, 0, 0]],
+    [[-1, 0, 0], [0, 0, 1], [0, 1, 0]],
+    [[0, 1, 0], [0, 0, 1], [1, 0, 0]],
+], dtype=float)
+
+# Positions closer than this, in radians, to a trixel edge met while
+# descending the HTM tree are indexed by lsst.sphgeom instead, whose exact
+# predicates decide which side of the edge they are on.
+_HTM_EDGE_MARGIN = 1e-9
+
+_thread_state = threading.local()
 
 
 def build_argparser():
@@ -82,12 +124,392 @@ def build_argparser():
         required=False,
         metavar="TEXT",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Number of threads reading input catalogs.",
+        default=8,
+        metavar="N",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        help="Maximum number of input catalogs read ahead of the one being sharded;\n"
+             "defaults to twice --jobs.",
+        default=None,
+        metavar="N",
+    )
+    parser.add_argument(
+        "--ingest-jobs",
+        type=int,
+        help="Number of shards written concurrently.",
+        default=2,
+        metavar="N",
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=float,
+        help="Memory, in MiB, that buffered rows may use before the largest\n"
+             "trixel buffers are spilled to --spill-dir. No limit by default.",
+        default=None,
+        metavar="MIB",
+    )
+    parser.add_argument(
+        "--spill-dir",
+        type=str,
+        help="Directory for spilled trixel buffers; defaults to the system\n"
+             "temporary directory.",
+        default=None,
+        metavar="PATH",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        help="File recording the shards written so far. If it exists, the\n"
+             "shards it lists are not written again, so an interrupted run\n"
+             "can be resumed with the same arguments.",
+        default=None,
+        metavar="PATH",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Skip the shards that already exist in the output collection, and\n"
+             "the inputs that only cover them. Rows of other inputs falling in\n"
+             "existing shards are not added to them; their number is reported.",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Print the planned shards, row counts and input sizes, using only\n"
+             "the registry and the catalog metadata, and exit.",
+    )
     return parser
 
 
+def _get_thread_butler(butler_config):
+    """Return a writeable butler owned by the calling thread.
+
+    Butler instances are not guaranteed to be thread safe, so each reader
+    and writer thread gets its own.
+    """
+    butler = getattr(_thread_state, "butler", None)
+    if butler is None:
+        butler = _thread_state.butler = Butler(butler_config, writeable=True)
+    return butler
+
+
+def _iter_prefetched(fetch, items, jobs, window):
+    """Apply ``fetch`` to ``items`` in a thread pool, yielding
+    ``(item, fetch(item))`` in input order.
+
+    At most ``window`` results are in flight or waiting to be consumed, so
+    a slow consumer bounds the memory held by the readers.
+    """
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for item in items:
+            if len(pending) >= window:
+                done_item, future = pending.popleft()
+                yield done_item, future.result()
+            pending.append((item, executor.submit(fetch, item)))
+        while pending:
+            done_item, future = pending.popleft()
+            yield done_item, future.result()
+
+
+def _htm_indices(ra, dec, level=_HTM_LEVEL):
+    """Compute the HTM indices of many positions at once.
+
+    The trixel numbering is that of `lsst.sphgeom.HtmPixelization`, but all
+    positions descend the trixel tree together, one level at a time,
+    instead of being indexed row by row. The few positions that come within
+    ``_HTM_EDGE_MARGIN`` of an edge on the way down, where floating-point
+    rounding could put them in the wrong trixel, are indexed with
+    `lsst.sphgeom.HtmPixelization` itself, so that the result always
+    matches the ``htm7`` data IDs of the pipelines.
+
+    Parameters
+    ----------
+    ra, dec : array-like
+        Coordinates in degrees.
+    level : `int`, optional
+        HTM subdivision level.
+
+    Returns
+    -------
+    indices : `numpy.ndarray` [`numpy.int64`]
+        HTM index of each position.
+    """
+    raDeg = np.asarray(ra, dtype=float)
+    decDeg = np.asarray(dec, dtype=float)
+    ra = np.deg2rad(raDeg)
+    dec = np.deg2rad(decDeg)
+    x = np.cos(dec)*np.cos(ra)
+    y = np.cos(dec)*np.sin(ra)
+    z = np.sin(dec)
+    points = np.stack([x, y, z], axis=-1)
+    # Distance to the nearest edge met so far; the root trixels are bounded
+    # by the x=0, y=0 and z=0 planes.
+    margin = np.minimum(np.minimum(np.abs(x), np.abs(y)), np.abs(z))
+
+    # Quadrant in the x-y plane, numbered like the southern roots; the
+    # northern roots go around the other way.
+    quadrant = np.select([(y > 0) & (x > 0), y > 0, (y < 0) & (x < 0), y < 0, x >= 0],
+                         [0, 1, 2, 3, 0], default=2)
+    root = np.where(z < 0, quadrant, 7 - quadrant)
+    indices = root.astype(np.int64) + 8
+    vertices = _HTM_ROOT_VERTICES[root]
+
+    def orientation(a, b):
+        # Sine of the signed angle between every point and the great
+        # circle through a and b.
+        normal = np.cross(a, b)
+        normal /= np.linalg.norm(normal, axis=1, keepdims=True)
+        return np.einsum("ij,ij->i", normal, points)
+
+    def midpoint(a, b):
+        m = a + b
+        return m/np.linalg.norm(m, axis=1, keepdims=True)
+
+    for _ in range(level):
+        v0, v1, v2 = vertices[:, 0], vertices[:, 1], vertices[:, 2]
+        m0 = midpoint(v1, v2)
+        m1 = midpoint(v0, v2)
+        m2 = midpoint(v0, v1)
+        sides = [orientation(m2, m1), orientation(m0, m2), orientation(m1, m0)]
+        child = np.select([side >= 0 for side in sides], [0, 1, 2], default=3)
+        for side in sides:
+            margin = np.minimum(margin, np.abs(side))
+        # Vertices of the selected children, in the same order as in
+        # HtmPixelization: (v0, m2, m1), (v1, m0, m2), (v2, m1, m0) and
+        # (m0, m1, m2).
+        pick = [child[:, np.newaxis] == c for c in range(3)]
+        vertices = np.stack([np.select(pick, [v0, v1, v2], default=m0),
+                             np.select(pick, [m2, m0, m1], default=m1),
+                             np.select(pick, [m1, m2, m0], default=m2)], axis=1)
+        indices = 4*indices + child
+
+    close = np.flatnonzero(margin < _HTM_EDGE_MARGIN)
+    if close.size:
+        pixelization = HtmPixelization(level)
+        indices[close] = [pixelization.index(UnitVector3d(LonLat.fromDegrees(raDeg[i], decDeg[i])))
+                          for i in close]
+    return indices
+
+
+def _region_trixels(region, pixelization):
+    """Return the trixels that a catalog covering ``region`` may contribute
+    rows to, or `None` if the region is unknown.
+    """
+    if region is None:
+        return None
+    circle = region.getBoundingCircle().dilatedBy(_REGION_PADDING)
+    return {trixel for begin, end in pixelization.envelope(circle) for trixel in range(begin, end)}
+
+
+def _query_existing_shards(butler, collection):
+    """Return the ``(band, htm7)`` shards already in ``collection``.
+    """
+    try:
+        refs = butler.registry.queryDatasets(_OUTPUT_DATASET_TYPE, collections=[collection])
+        return {(ref.dataId["band"], ref.dataId["htm7"]) for ref in refs}
+    except (MissingCollectionError, MissingDatasetTypeError):
+        return set()
+
+
+def _print_plan(butler_config, inputs, done, jobs):
+    """Print the shards that sharding ``inputs`` would write.
+
+    Only the row count component and the file size of each input are
+    read, not its payload.
+    """
+    def describe(item):
+        butler = _get_thread_butler(butler_config)
+        ref = item[0]
+        return butler.get(ref.makeComponentRef("rowcount")), butler.getURI(ref).size()
+
+    bands = defaultdict(lambda: dict(inputs=0, rows=0, nbytes=0, trixels=set(), unbounded=False))
+    for (_, band, trixels), (n_rows, nbytes) in _iter_prefetched(describe, inputs, jobs, 4*jobs):
+        plan = bands[band]
+        plan["inputs"] += 1
+        plan["rows"] += n_rows
+        plan["nbytes"] += nbytes
+        if trixels is None:
+            plan["unbounded"] = True
+        else:
+            plan["trixels"].update(trixel for trixel in trixels if (band, trixel) not in done)
+
+    print(f"{'band':>6} {'inputs':>8} {'rows':>12} {'input MiB':>10} {'shards':>8}")
+    for band, plan in sorted(bands.items()):
+        # Trixels come from padded input regions, so this is an upper bound.
+        shards = "?" if plan["unbounded"] else f"<={len(plan['trixels'])}"
+        print(f"{band:>6} {plan['inputs']:>8d} {plan['rows']:>12d} "
+              f"{plan['nbytes'] / 2**20:>10.1f} {shards:>8}")
+    print(f"{len(done)} shards already written.")
+
+
+def _table_nbytes(table):
+    return sum(table[name].nbytes for name in table.colnames)
+
+
+class _Manifest:
+    """Record of the shards already written, stored as one JSON line per
+    shard so that it stays valid if the run is interrupted.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if path is not None and os.path.exists(path):
+            with open(path) as stream:
+                for line in stream:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.done.add((entry["band"], entry["htm7"]))
+
+    def add(self, band, trixel, n_rows):
+        self.done.add((band, trixel))
+        if self.path is not None:
+            with open(self.path, "a") as stream:
+                stream.write(json.dumps({"band": band, "htm7": trixel, "rows": n_rows}) + "\n")
+
+
+class _TrixelSharder:
+    """Buffer catalog rows per (band, htm7) trixel, and write each trixel's
+    shard as soon as no input still to be read may overlap it.
+
+    Parameters
+    ----------
+    write : callable
+        Called with ``(table, band, trixel)`` to write a complete shard.
+    max_memory : `int`, optional
+        Number of bytes the in-memory buffers may use before the largest
+        ones are spilled to ``spill_dir``.
+    spill_dir : `str`, optional
+        Directory for spilled buffers.
+    resumed : `set` [`tuple`]
+        ``(band, trixel)`` shards written by an interrupted run with the
+        same inputs; rows falling in them are skipped.
+    existing : `set` [`tuple`]
+        ``(band, trixel)`` shards already in the output collection; rows
+        falling in them are skipped too, but counted in `dropped`, since
+        they may not be in those shards.
+
+    Attributes
+    ----------
+    dropped : `collections.Counter` [`tuple`, `int`]
+        Number of rows skipped for each shard of ``existing``.
+    """
+
+    def __init__(self, write, max_memory=None, spill_dir=None, resumed=(), existing=()):
+        self._write = write
+        self._max_memory = max_memory
+        self._spill_dir = spill_dir
+        self._resumed = set(resumed)
+        self._existing = set(existing) - self._resumed
+        self.dropped = Counter()
+        self._done = set()
+        self._buffers = defaultdict(list)
+        self._spills = defaultdict(list)
+        self._nbytes = Counter()
+        self._total_nbytes = 0
+        self._pending = Counter()
+        self._unbounded = Counter()
+        self.n_spilled = 0
+
+    def expect(self, band, trixels):
+        """Declare an input still to be read, covering ``trixels`` (or any
+        trixel, if `None`).
+        """
+        if trixels is None:
+            self._unbounded[band] += 1
+        else:
+            self._pending.update((band, trixel) for trixel in trixels)
+
+    def add(self, table, band, trixels):
+        """Add the rows of an input previously declared with `expect`,
+        and write the shards it completes.
+        """
+        keys = set()
+        if len(table) > 0:
+            indices = _htm_indices(table["ra"], table["dec"])
+            order = np.argsort(indices, kind="stable")
+            unique, starts = np.unique(indices[order], return_index=True)
+            for trixel, rows in zip(unique.tolist(), np.split(order, starts[1:])):
+                key = (band, trixel)
+                if key in self._resumed:
+                    continue
+                if key in self._existing:
+                    self.dropped[key] += len(rows)
+                    continue
+                if key in self._done:
+                    raise RuntimeError(f"Catalog rows fall in trixel {trixel} of band {band}, whose shard "
+                                       "was already written; the region of their input is too small.")
+                part = table[rows]
+                self._buffers[key].append(part)
+                nbytes = _table_nbytes(part)
+                self._nbytes[key] += nbytes
+                self._total_nbytes += nbytes
+                keys.add(key)
+
+        if trixels is None:
+            self._unbounded[band] -= 1
+            if self._unbounded[band] == 0:
+                keys.update(key for key in self._nbytes.keys() | self._spills.keys() if key[0] == band)
+        else:
+            for trixel in trixels:
+                self._pending[(band, trixel)] -= 1
+            keys.update((band, trixel) for trixel in trixels)
+
+        for key in sorted(keys):
+            if self._is_complete(key):
+                self._flush(key)
+        self._limit_memory()
+
+    def finish(self):
+        """Write all remaining shards.
+        """
+        for key in sorted(self._nbytes.keys() | self._spills.keys()):
+            self._flush(key)
+
+    def _is_complete(self, key):
+        return self._pending[key] <= 0 and self._unbounded[key[0]] == 0
+
+    def _flush(self, key):
+        parts = []
+        for path in self._spills.pop(key, []):
+            with open(path, "rb") as stream:
+                parts.append(pickle.load(stream))
+            os.remove(path)
+        parts.extend(self._buffers.pop(key, []))
+        self._total_nbytes -= self._nbytes.pop(key, 0)
+        self._pending.pop(key, None)
+        if not parts:
+            return
+        self._done.add(key)
+        table = vstack(parts, metadata_conflicts="silent") if len(parts) > 1 else parts[0]
+        self._write(table, *key)
+
+    def _limit_memory(self):
+        if self._max_memory is None:
+            return
+        while self._total_nbytes > self._max_memory and self._nbytes:
+            key, nbytes = self._nbytes.most_common(1)[0]
+            table = vstack(self._buffers.pop(key), metadata_conflicts="silent")
+            with tempfile.NamedTemporaryFile(dir=self._spill_dir, suffix=".pickle", delete=False) as stream:
+                pickle.dump(table, stream, protocol=pickle.HIGHEST_PROTOCOL)
+            self._spills[key].append(stream.name)
+            del self._nbytes[key]
+            self._total_nbytes -= nbytes
+            self.n_spilled += 1
+
+
 def main():
     """Use this as the main entry point when calling from the command line."""
     # Set up logging.
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     logger = logging.getLogger(__name__)
     logger.setLevel(logging.DEBUG)
 
@@ -100,28 +522,109 @@ def main():
     query_kwargs = dict(datasetType=args.dataset_type_name, collections=input_collections)
     if args.dataquery:
         query_kwargs["where"] = args.dataquery
-    datarefs = list(butler.registry.queryDatasets(**query_kwargs))
+    datarefs = list(butler.registry.queryDatasets(**query_kwargs).expanded())
     if not datarefs:
         logger.warning("No datasets found for dataset type '%s' with query: %s",
                        args.dataset_type_name, args.dataquery)
         return
 
-    catalogs_per_band = {}
+    manifest = _Manifest(args.manifest)
+    existing = set()
+    if args.incremental:
+        existing = _query_existing_shards(butler, args.output_collection) - manifest.done
+    done = manifest.done | existing
+    pixelization = HtmPixelization(_HTM_LEVEL)
+    inputs = []
     for dataref in datarefs:
         band = dataref.dataId["band"]
-        catalogs_per_band.setdefault(band, []).append(butler.get(dataref))
-
-    # stack the tables and split in bands
-    for band, catalogs in catalogs_per_band.items():
-        # use source injection utils to ingest the sharded injection catalog.
-        catalog = vstack(catalogs, metadata_conflicts='silent') if len(catalogs) > 1 else catalogs[0]
-        utils.ingest_injection_catalog(
-            writeable_butler=butler,
-            table=catalog,
-            band=band,
-            output_collection=args.output_collection,
-            log_level=logging.DEBUG,
-        )
+        trixels = _region_trixels(dataref.dataId.region, pixelization)
+        # Inputs whose trixels are all written already are not read again.
+        if trixels is not None and all((band, trixel) in done for trixel in trixels):
+            continue
+        inputs.append((dataref, band, trixels))
+    # Read neighbouring inputs together, so that trixels complete early.
+    inputs.sort(key=lambda item: (item[1], min(item[2]) if item[2] else -1))
+
+    if args.dry_run:
+        print(f"{len(inputs)} of {len(datarefs)} input catalogs to read.")
+        _print_plan(args.butler_config, inputs, done, args.jobs)
+        return
+
+    dataset_type = DatasetType(_OUTPUT_DATASET_TYPE, ("htm7", "band"), "ArrowAstropy",
+                               universe=butler.dimensions)
+    butler.registry.registerDatasetType(dataset_type)
+    butler.registry.registerRun(args.output_collection)
+
+    logger.info("Sharding %d catalogs with %d reader threads (%d already done).",
+                len(inputs), args.jobs, len(datarefs) - len(inputs))
+
+    writes = []
+
+    def write(table, band, trixel):
+        # Do not queue more shards than can be written at once.
+        running = [future for future, _ in writes if not future.done()]
+        if len(running) >= args.ingest_jobs:
+            wait(running, return_when=FIRST_COMPLETED)
+        future = write_executor.submit(put, table, band, trixel)
+        writes.append((future, (band, trixel, len(table))))
+
+    def put(table, band, trixel):
+        thread_butler = _get_thread_butler(args.butler_config)
+        data_id = {"htm7": trixel, "band": band}
+        # A resumed run may have been interrupted after writing a shard but
+        # before recording it in the manifest.
+        if args.manifest is not None and thread_butler.registry.findDataset(
+            _OUTPUT_DATASET_TYPE, data_id, collections=[args.output_collection]
+        ) is not None:
+            logger.info("Shard %s of band %s was written by an interrupted run; not writing it again.",
+                        trixel, band)
+            return
+        thread_butler.put(table, _OUTPUT_DATASET_TYPE, data_id, run=args.output_collection)
+
+    def record_writes(block=False):
+        # Re-raise any write failure, and record completed shards.
+        for future, entry in list(writes):
+            if block or future.done():
+                future.result()
+                manifest.add(*entry)
+                writes.remove((future, entry))
+
+    max_memory = None if args.max_memory is None else int(args.max_memory * 2**20)
+    sharder = _TrixelSharder(write, max_memory=max_memory, spill_dir=args.spill_dir,
+                             resumed=manifest.done, existing=existing)
+    for _, band, trixels in inputs:
+        sharder.expect(band, trixels)
+
+    start = last_report = time.monotonic()
+    n_read = n_rows = 0
+    catalogs = _iter_prefetched(lambda item: _get_thread_butler(args.butler_config).get(item[0]),
+                                inputs, args.jobs, max(args.prefetch or 2 * args.jobs, 1))
+    with ThreadPoolExecutor(max_workers=args.ingest_jobs) as write_executor:
+        for (_, band, trixels), catalog in catalogs:
+            sharder.add(catalog, band, trixels)
+            record_writes()
+            n_read += 1
+            n_rows += len(catalog)
+            now = time.monotonic()
+            if now - last_report >= _PROGRESS_INTERVAL:
+                logger.info("Read %d/%d catalogs (%d rows, %.1f catalogs/s), %d shards done.",
+                            n_read, len(inputs), n_rows, n_read / (now - start), len(manifest.done | done))
+                last_report = now
+        sharder.finish()
+        record_writes(block=True)
+
+    elapsed = time.monotonic() - start
+    logger.info("Sharded %d catalogs (%d rows) into %d shards in %.1f s (%.0f rows/s, %d buffers spilled).",
+                n_read, n_rows, len(manifest.done | done), elapsed, n_rows / elapsed if elapsed > 0 else 0.0,
+                sharder.n_spilled)
+    if sharder.dropped:
+        for band, trixel in sorted(sharder.dropped):
+            logger.debug("%d rows not added to the existing shard %s of band %s.",
+                         sharder.dropped[(band, trixel)], trixel, band)
+        logger.warning("%d rows fall in %d shards that already exist in %s and were not added to them. "
+                       "Rows of inputs sharded before are already there, but any others are missing; "
+                       "shard into a new output collection to include them.",
+                       sum(sharder.dropped.values()), len(sharder.dropped), args.output_collection)
 
 
 if __name__ == "__main__":
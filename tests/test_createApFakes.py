@@ -28,17 +28,25 @@ import unittest
 from unittest.mock import MagicMock
 
 import lsst.daf.butler.tests as butlerTests
+import lsst.afw.geom as afwGeom
+import lsst.afw.image as afwImage
 import lsst.geom as geom
 from astropy.table import Table
-from lsst.pipe.base import testUtils
+from lsst.pipe.base import InMemoryDatasetHandle, testUtils
 import lsst.skymap as skyMap
 import lsst.utils.tests
 
 from lsst.ap.pipe.createApFakes import (
+    _make_detector_region,
+    _remap_ids,
     CreateRandomApFakesTask,
     CreateRandomApFakesConfig,
     CreateVisitDetectorFakesTask,
     CreateVisitDetectorFakesConfig,
+    CreateVisitDetectorFakesConnections,
+    CreateVisitDetectorFakeHostsTask,
+    CreateVisitFakesTask,
+    CreateVisitFakesConfig,
 )
 
 
@@ -142,6 +150,97 @@ class TestCreateApFakes(lsst.utils.tests.TestCase):
                 np.all(fakesConfig.magMax > filterMags))
             self.assertTrue(np.allclose(filterMags, fakeCat["mag"]))
 
+    def testRunArrow(self):
+        """Test that the Arrow output matches the DataFrame output, with
+        repeated columns sharing memory.
+        """
+        with self.assertWarns(FutureWarning):
+            fakesConfig = CreateRandomApFakesConfig()
+        fakesConfig.fakeDensity = self.sourceDensity
+        with self.assertWarns(FutureWarning):
+            fakesTask = CreateRandomApFakesTask(config=fakesConfig)
+        expected = fakesTask.run(self.tractId, self.simpleMap).fakeCat
+
+        fakesConfig.doWriteArrow = True
+        with self.assertWarns(FutureWarning):
+            fakesTask = CreateRandomApFakesTask(config=fakesConfig)
+        fakeCat = fakesTask.run(self.tractId, self.simpleMap).fakeCat
+
+        self.assertEqual(fakeCat.column_names, list(expected.columns))
+        for name in expected.columns:
+            np.testing.assert_array_equal(fakeCat[name].to_numpy(), expected[name].to_numpy())
+        self.assertEqual(fakeCat[fakesConfig.disk_n_col].chunk(0).buffers()[1].address,
+                         fakeCat[fakesConfig.bulge_n_col].chunk(0).buffers()[1].address)
+
+        connections = fakesConfig.ConnectionsClass(config=fakesConfig)
+        self.assertEqual(connections.fakeCat.storageClass, "ArrowTable")
+
+    def testGeneratePatchCatalogs(self):
+        """Test the per-patch generator against the whole-tract catalog.
+        """
+        with self.assertWarns(FutureWarning):
+            fakesConfig = CreateRandomApFakesConfig()
+        fakesConfig.fakeDensity = self.sourceDensity
+        fakesConfig.doGeneratePerPatch = True
+        with self.assertWarns(FutureWarning):
+            fakesTask = CreateRandomApFakesTask(config=fakesConfig)
+        tractCat = fakesTask.run(self.tractId, self.simpleMap).fakeCat
+
+        patchCats = dict(fakesTask.generatePatchCatalogs(self.tractId, self.simpleMap))
+        self.assertEqual(patchCats.keys(), {patch.getSequentialIndex() for patch in self.tract})
+        for patchId, patchCat in patchCats.items():
+            self.assertEqual(patchCat.column_names, list(tractCat.columns))
+            self.assertEqual(len(np.unique(patchCat["fakeId"])), patchCat.num_rows)
+            # All band magnitudes share one buffer
+            buffers = {patchCat[fakesConfig.mag_col % f].chunk(0).buffers()[1].address
+                       for f in fakesConfig.filterSet}
+            self.assertEqual(len(buffers), 1)
+
+        subset = dict(fakesTask.generatePatchCatalogs(self.tractId, self.simpleMap, patchIds=[0]))
+        self.assertEqual(subset.keys(), {0})
+        self.assertTrue(subset[0].equals(patchCats[0]))
+
+        connections = fakesConfig.ConnectionsClass(config=fakesConfig)
+        self.assertEqual(connections.outputs, {"patchFakeCats"})
+
+    def testPatchCatalogSeams(self):
+        """Test that per-patch catalogs do not overlap at patch seams, and
+        that their injection IDs are unique across patches.
+        """
+        simpleMapConfig = skyMap.discreteSkyMap.DiscreteSkyMapConfig()
+        simpleMapConfig.raList = [10]
+        simpleMapConfig.decList = [-1]
+        simpleMapConfig.radiusList = [0.1]
+        simpleMapConfig.patchInnerDimensions = [1000, 1000]
+        simpleMap = skyMap.DiscreteSkyMap(simpleMapConfig)
+        tract = simpleMap.generateTract(self.tractId)
+        self.assertGreater(len(list(tract)), 1)
+
+        with self.assertWarns(FutureWarning):
+            fakesConfig = CreateRandomApFakesConfig()
+        fakesConfig.fakeDensity = 20000
+        fakesConfig.doGeneratePerPatch = True
+        with self.assertWarns(FutureWarning):
+            fakesTask = CreateRandomApFakesTask(config=fakesConfig)
+        patchCats = dict(fakesTask.generatePatchCatalogs(self.tractId, simpleMap))
+
+        wcs = tract.getWcs()
+        innerBoxes = {patchInfo.getSequentialIndex(): geom.Box2D(patchInfo.getInnerBBox())
+                      for patchInfo in tract}
+        for patchId, patchCat in patchCats.items():
+            innerBox = innerBoxes[patchId]
+            x, y = wcs.skyToPixelArray(patchCat[fakesConfig.ra_col].to_numpy(),
+                                       patchCat[fakesConfig.dec_col].to_numpy(), degrees=True)
+            self.assertTrue(np.all((x >= innerBox.getMinX()) & (x < innerBox.getMaxX())
+                                   & (y >= innerBox.getMinY()) & (y < innerBox.getMaxY())))
+
+        ras = np.concatenate([patchCat[fakesConfig.ra_col].to_numpy() for patchCat in patchCats.values()])
+        decs = np.concatenate([patchCat[fakesConfig.dec_col].to_numpy() for patchCat in patchCats.values()])
+        self.assertGreater(len(ras), 0)
+        self.assertEqual(len(np.unique(np.stack([ras, decs], axis=1), axis=0)), len(ras))
+        ids = np.concatenate([patchCat["injection_id"].to_numpy() for patchCat in patchCats.values()])
+        self.assertEqual(len(np.unique(ids)), len(ids))
+
     def testVisitCoaddSubdivision(self):
         """Test that the number of assigned visit to template objects is
         correct.
@@ -160,34 +259,22 @@ class TestCreateApFakes(lsst.utils.tests.TestCase):
             self.nInTemplate)
 
 
-def _make_mock_visit_image(visitId=2024111100094, detId=3,
-                           xmin=0, xmax=4096, ymin=0, ymax=4096,
-                           magLim=25.0, ra_center=10.0, dec_center=-1.0):
-    """Build a minimal MagicMock that satisfies CreateVisitDetectorFakesTask.run."""
-    img = MagicMock()
-
-    # visit / detector IDs
-    img.getInfo().getVisitInfo().id = visitId
-    img.detector.getId.return_value = detId
-
+def _make_mock_visit_inputs(visitId=2024111100094, detId=3,
+                            xmin=0, xmax=4096, ymin=0, ymax=4096,
+                            magLim=25.0, ra_center=10.0, dec_center=-1.0):
+    """Build minimal MagicMock visit image components that satisfy
+    CreateVisitDetectorFakesTask.run.
+    """
     # bounding box
     bbox = MagicMock()
     bbox.getMinX.return_value = xmin
     bbox.getMaxX.return_value = xmax
     bbox.getMinY.return_value = ymin
     bbox.getMaxY.return_value = ymax
-    img.getBBox.return_value = bbox
 
     # summary stats — magLim drives max_mag
     stats = MagicMock()
     stats.magLim = magLim
-    img.getInfo().getSummaryStats.return_value = stats
-
-    # convex polygon for density calculation (returns a bbox in steradians)
-    poly_bbox = MagicMock()
-    # ~1e-5 sr ≈ small patch, dense enough to yield O(10) fakes at density=1000
-    poly_bbox.getArea.return_value = 1e-5
-    img.getConvexPolygon().getBoundingBox.return_value = poly_bbox
 
     # WCS: pixelToSkyArray returns ra/dec arrays of the right length
     wcs = MagicMock()
@@ -197,18 +284,69 @@ def _make_mock_visit_image(visitId=2024111100094, detId=3,
         dec = dec_center + ys * 1e-4
         return np.asarray(ra), np.asarray(dec)
     wcs.pixelToSkyArray.side_effect = _pix_to_sky
-    img.getWcs.return_value = wcs
 
-    # photoCalib — not used in non-hosted paths, but must exist
-    img.getPhotoCalib.return_value = MagicMock()
-
-    return img
+    return {
+        "wcs": wcs,
+        "bbox": bbox,
+        # photoCalib — not used in non-hosted paths, but must exist
+        "photoCalib": MagicMock(),
+        "summaryStats": stats,
+        "visitId": visitId,
+        "detectorId": detId,
+    }
+
+
+def _make_host_table(n_hosts):
+    """Build an uncalibrated source table in which every row is a valid
+    host.
+    """
+    return Table({
+        "slot_Centroid_x": np.full(n_hosts, 2048.0),
+        "slot_Centroid_y": np.full(n_hosts, 2048.0),
+        "slot_ModelFlux_instFlux": np.full(n_hosts, 1e4),
+        "slot_ModelFlux_instFluxErr": np.full(n_hosts, 100.0),
+        "slot_Shape_xx": np.full(n_hosts, 4.0),
+        "slot_Shape_xy": np.zeros(n_hosts),
+        "slot_Shape_yy": np.full(n_hosts, 4.0),
+        "id": np.arange(n_hosts, dtype=np.int64),
+        "coord_ra": np.deg2rad(np.full(n_hosts, 10.0)),
+        "coord_dec": np.deg2rad(np.full(n_hosts, -1.0)),
+        "sky_source": np.zeros(n_hosts, dtype=bool),
+        "base_ClassificationSizeExtendedness_flag": np.zeros(n_hosts, dtype=bool),
+        "base_ClassificationExtendedness_flag": np.zeros(n_hosts, dtype=bool),
+        "slot_Shape_flag": np.zeros(n_hosts, dtype=bool),
+        "slot_Centroid_flag": np.zeros(n_hosts, dtype=bool),
+        "base_PixelFlags_flag": np.zeros(n_hosts, dtype=bool),
+        "base_ClassificationSizeExtendedness_value": np.ones(n_hosts),
+        "base_ClassificationExtendedness_value": np.ones(n_hosts, dtype=int),
+    })
+
+
+def _make_mock_source_cat(host_table):
+    """Wrap a table in a MagicMock with the SourceCatalog API used by
+    CreateVisitDetectorFakesTask.
+    """
+    sourceCat = MagicMock()
+    sourceCat.__getitem__.side_effect = host_table.__getitem__
+    sourceCat.subset.side_effect = lambda mask: host_table[mask]
+    return sourceCat
+
+
+def _make_mock_photo_calib():
+    """Build a MagicMock PhotoCalib with a calibration of 1 nJy per count."""
+    photoCalib = MagicMock()
+    photoCalib.instFluxToNanojansky.side_effect = lambda cat, name: np.column_stack(
+        [cat[name + "_instFlux"], cat[name + "_instFluxErr"]])
+    photoCalib.instFluxToMagnitude.side_effect = lambda cat, name: np.column_stack(
+        [-2.5 * np.log10(cat[name + "_instFlux"]) + 31.4,
+         2.5 / np.log(10) * cat[name + "_instFluxErr"] / cat[name + "_instFlux"]])
+    return photoCalib
 
 
 class TestCreateVisitDetectorFakesTask(lsst.utils.tests.TestCase):
 
     def setUp(self):
-        self.visit_image = _make_mock_visit_image()
+        self.visit_inputs = _make_mock_visit_inputs()
         self.source_cat = MagicMock()  # not used unless doAddHostedFakes
 
     def _make_task(self, **config_overrides):
@@ -228,7 +366,7 @@ class TestCreateVisitDetectorFakesTask(lsst.utils.tests.TestCase):
     # ------------------------------------------------------------------
     def testRunRandomOnly(self):
         task = self._make_task()
-        result = task.run(self.source_cat, self.visit_image)
+        result = task.run(self.source_cat, **self.visit_inputs)
         cat = result.outputCat
 
         self.assertIsInstance(cat, Table)
@@ -245,6 +383,48 @@ class TestCreateVisitDetectorFakesTask(lsst.utils.tests.TestCase):
         self.assertTrue(np.all(cat["visit"] == 2024111100094))
         self.assertTrue(np.all(cat["detector"] == 3))
 
+    # ------------------------------------------------------------------
+    # Visit image inputs: components only, never pixels
+    # ------------------------------------------------------------------
+    def testNoPixelInputs(self):
+        connections = CreateVisitDetectorFakesConnections(config=CreateVisitDetectorFakesConfig())
+        pixel_storage_classes = {"Exposure", "ExposureF", "ExposureD", "ExposureI",
+                                 "MaskedImageF", "ImageF", "Mask"}
+        visit_image_components = set()
+        for name in connections.inputs:
+            connection = getattr(connections, name)
+            self.assertNotIn(connection.storageClass, pixel_storage_classes)
+            parent, _, component = connection.name.partition(".")
+            if parent == "preliminary_visit_image":
+                visit_image_components.add(component)
+        self.assertEqual(visit_image_components, {"wcs", "bbox", "photoCalib", "summaryStats"})
+
+    # ------------------------------------------------------------------
+    # Injection IDs: reproducible and collision-free
+    # ------------------------------------------------------------------
+    def testInjectionIdsReproducible(self):
+        task = self._make_task()
+        first = task.run(self.source_cat, **self.visit_inputs).outputCat
+        second = task.run(self.source_cat, **self.visit_inputs).outputCat
+        np.testing.assert_array_equal(first["injection_id"], second["injection_id"])
+
+        other = task.run(self.source_cat, **_make_mock_visit_inputs(detId=4)).outputCat
+        self.assertFalse(np.array_equal(first["injection_id"], other["injection_id"]))
+
+    def testMakeUniqueInjectionIds(self):
+        task = self._make_task()
+        used_ids = np.arange(0, 1 << 20, dtype=np.int64)
+        ids = task._make_unique_injection_ids(100_000, np.random.default_rng(42), used_ids=used_ids)
+
+        self.assertEqual(len(ids), 100_000)
+        self.assertEqual(ids.dtype, np.int64)
+        self.assertEqual(len(np.unique(ids)), len(ids))
+        self.assertFalse(np.any(np.isin(ids, used_ids)))
+        self.assertTrue(np.all((ids >= 0) & (ids < 1 << 24)))
+
+        with self.assertRaises(ValueError):
+            task._make_unique_injection_ids(1 << 24, np.random.default_rng(42), used_ids=[0])
+
     # ------------------------------------------------------------------
     # Template-fraction split
     # ------------------------------------------------------------------
@@ -254,7 +434,7 @@ class TestCreateVisitDetectorFakesTask(lsst.utils.tests.TestCase):
             templateFakeFraction=0.25,
             nRandomFakes=200,
         )
-        result = task.run(self.source_cat, self.visit_image)
+        result = task.run(self.source_cat, **self.visit_inputs)
         cat = result.outputCat
 
         n_template = int(np.sum(cat["isTemplateSource"]))
@@ -273,7 +453,7 @@ class TestCreateVisitDetectorFakesTask(lsst.utils.tests.TestCase):
             variableFakeFraction=0.2,
             nRandomFakes=100,
         )
-        result = task.run(self.source_cat, self.visit_image)
+        result = task.run(self.source_cat, **self.visit_inputs)
         cat = result.outputCat
 
         # Catalog is larger than the base 100 fakes
@@ -285,6 +465,37 @@ class TestCreateVisitDetectorFakesTask(lsst.utils.tests.TestCase):
         # mag_offset column is present on variable rows
         self.assertIn("mag_offset", cat.colnames)
 
+    def testVariableFakesFlagTwins(self):
+        task = self._make_task(
+            doAddVariableFakes=True,
+            variableFakeFraction=0.2,
+            nRandomFakes=100,
+        )
+        cat = task.run(self.source_cat, **self.visit_inputs).outputCat
+
+        twins = cat[~np.ma.getmaskarray(cat["twin_id"])]
+        originals = cat[np.isin(cat["injection_id"], twins["twin_id"])]
+        self.assertEqual(len(twins), 20)
+        self.assertEqual(len(originals), 20)
+        self.assertTrue(np.all(cat["isVariable"][:100] == np.isin(cat["injection_id"][:100],
+                                                                  twins["twin_id"])))
+        self.assertTrue(np.all(twins["isVariable"]))
+
+    def testRemapIds(self):
+        """Test that the array remap matches a dict lookup, including
+        duplicated and unmapped IDs.
+        """
+        rng = np.random.default_rng(12345)
+        old_ids = rng.integers(0, 500, size=1000)
+        new_ids = rng.integers(1000, 2000, size=1000)
+        ids = rng.integers(0, 1000, size=5000)
+
+        id_map = {old_id: new_id for old_id, new_id in zip(old_ids, new_ids)}
+        expected = np.asarray([id_map.get(int(i), int(i)) for i in ids], dtype=np.int64)
+
+        np.testing.assert_array_equal(_remap_ids(ids, old_ids, new_ids), expected)
+        np.testing.assert_array_equal(_remap_ids(ids, [], []), ids)
+
     # ------------------------------------------------------------------
     # Empty-mode guard raises RuntimeError
     # ------------------------------------------------------------------
@@ -295,7 +506,7 @@ class TestCreateVisitDetectorFakesTask(lsst.utils.tests.TestCase):
             doAddModelFakes=False,
         )
         with self.assertRaises(RuntimeError):
-            task.run(self.source_cat, self.visit_image)
+            task.run(self.source_cat, **self.visit_inputs)
 
     # ------------------------------------------------------------------
     # Hosted fakes: sparse-host cap (fewer hosts than minHostedFakes)
@@ -313,33 +524,11 @@ class TestCreateVisitDetectorFakesTask(lsst.utils.tests.TestCase):
         task = CreateVisitDetectorFakesTask(config=cfg)
 
         n_hosts = 5
-        host_table = Table({
-            "slot_Centroid_x": np.full(n_hosts, 2048.0),
-            "slot_Centroid_y": np.full(n_hosts, 2048.0),
-            "slot_ModelFlux_mag": np.full(n_hosts, 20.0),
-            "slot_ModelFlux_flux": np.full(n_hosts, 1e4),
-            "slot_ModelFlux_fluxErr": np.full(n_hosts, 100.0),
-            "slot_Shape_xx": np.full(n_hosts, 4.0),
-            "slot_Shape_xy": np.zeros(n_hosts),
-            "slot_Shape_yy": np.full(n_hosts, 4.0),
-            "id": np.arange(n_hosts, dtype=np.int64),
-            "coord_ra": np.deg2rad(np.full(n_hosts, 10.0)),
-            "coord_dec": np.deg2rad(np.full(n_hosts, -1.0)),
-            "sky_source": np.zeros(n_hosts, dtype=bool),
-            "base_ClassificationSizeExtendedness_flag": np.zeros(n_hosts, dtype=bool),
-            "base_ClassificationExtendedness_flag": np.zeros(n_hosts, dtype=bool),
-            "slot_Shape_flag": np.zeros(n_hosts, dtype=bool),
-            "slot_Centroid_flag": np.zeros(n_hosts, dtype=bool),
-            "base_PixelFlags_flag": np.zeros(n_hosts, dtype=bool),
-            "base_ClassificationSizeExtendedness_value": np.ones(n_hosts),
-            "base_ClassificationExtendedness_value": np.ones(n_hosts, dtype=int),
-        })
-
-        # Patch photoCalib so calibrateCatalog().asAstropy() returns our table
-        img = _make_mock_visit_image()
-        img.getPhotoCalib().calibrateCatalog.return_value.asAstropy.return_value = host_table
-
-        result = task.run(self.source_cat, img)
+        source_cat = _make_mock_source_cat(_make_host_table(n_hosts))
+        inputs = _make_mock_visit_inputs()
+        inputs["photoCalib"] = _make_mock_photo_calib()
+
+        result = task.run(source_cat, **inputs)
         cat = result.outputCat
 
         # Number of hosted fakes should be clamped to n_hosts, not minHostedFakes
@@ -348,6 +537,89 @@ class TestCreateVisitDetectorFakesTask(lsst.utils.tests.TestCase):
         self.assertTrue(np.all(cat["hosted_fake"]))
         self.assertEqual(len(np.unique(cat["injection_id"])), n_hosts)
 
+    # ------------------------------------------------------------------
+    # Mixed random + hosted + variable fakes: single-pass assembly
+    # ------------------------------------------------------------------
+    def testMixedFakesAssembly(self):
+        task = self._make_task(
+            nRandomFakes=30,
+            doAddHostedFakes=True,
+            fracHostedFakes=0.5,
+            minHostedFakes=1,
+            doAddVariableFakes=True,
+            variableFakeFraction=0.5,
+        )
+        inputs = _make_mock_visit_inputs()
+        inputs["photoCalib"] = _make_mock_photo_calib()
+
+        cat = task.run(_make_mock_source_cat(_make_host_table(20)), **inputs).outputCat
+
+        # 30 random + 10 hosted, plus 20 variable twins
+        self.assertEqual(len(cat), 60)
+        self.assertEqual(len(np.unique(cat["injection_id"])), len(cat))
+        # Host columns only exist for hosted fakes and their twins
+        is_hosted = ~np.ma.getmaskarray(cat["hosted_fake"])
+        self.assertEqual(np.sum(is_hosted[:40]), 10)
+        self.assertFalse(np.any(is_hosted[:30]))
+        np.testing.assert_array_equal(np.ma.getmaskarray(cat["host_id"]), ~is_hosted)
+        # Twins are copies of their originals, apart from the magnitude
+        twins = cat[40:]
+        originals = cat[:40][np.argsort(cat["injection_id"][:40])][
+            np.searchsorted(np.sort(cat["injection_id"][:40]), twins["twin_id"])]
+        np.testing.assert_array_equal(twins["x"], originals["x"])
+        np.testing.assert_array_equal(twins["isVisitSource"], ~originals["isVisitSource"])
+        np.testing.assert_allclose(twins["mag"] - twins["mag_offset"], originals["mag"])
+
+    # ------------------------------------------------------------------
+    # Hosted fakes: only pre-selected hosts are calibrated
+    # ------------------------------------------------------------------
+    def testHostCandidatesCalibratedAfterCuts(self):
+        task = self._make_task(doAddHostedFakes=True)
+        host_table = _make_host_table(10)
+        host_table["sky_source"][:4] = True
+        host_table["slot_ModelFlux_instFluxErr"][-1] = 1e4  # fails S/N cut
+        photoCalib = _make_mock_photo_calib()
+
+        candidates = task._load_host_candidates(_make_mock_source_cat(host_table), photoCalib)
+        hosts = task.select_hosts(candidates)
+
+        calibrated, _ = photoCalib.instFluxToNanojansky.call_args.args
+        self.assertEqual(len(calibrated), 6)
+        self.assertEqual(len(candidates), 6)
+        self.assertEqual(list(hosts["id"]), [4, 5, 6, 7, 8])
+        np.testing.assert_allclose(hosts["slot_ModelFlux_mag"], 21.4)
+
+    def testHostIndexMatchesSourceCat(self):
+        """Test that drawing hosted fakes from a host index reproduces
+        drawing them from the source catalog.
+        """
+        task = self._make_task(doAddHostedFakes=True, minHostedFakes=5, doAddVariableFakes=True)
+        source_cat = _make_mock_source_cat(_make_host_table(10))
+        inputs = _make_mock_visit_inputs()
+        inputs["photoCalib"] = _make_mock_photo_calib()
+
+        hostIndex = CreateVisitDetectorFakeHostsTask().run(source_cat, inputs["photoCalib"]).hostIndex
+        self.assertEqual(len(hostIndex), 10)
+        for name in ("pa", "a", "b"):
+            self.assertIn(name, hostIndex.colnames)
+
+        expected = task.run(source_cat, **inputs).outputCat
+        cat = task.run(None, **inputs, hostIndex=hostIndex).outputCat
+        self.assertEqual(cat.colnames, expected.colnames)
+        for name in cat.colnames:
+            np.testing.assert_array_equal(cat[name], expected[name])
+
+    def testSourceCatConnection(self):
+        config = CreateVisitDetectorFakesConfig()
+        config.doAddHostedFakes = False
+        self.assertNotIn("sourceCat", config.ConnectionsClass(config=config).inputs)
+        config.doAddHostedFakes = True
+        self.assertIn("sourceCat", config.ConnectionsClass(config=config).inputs)
+        self.assertNotIn("hostIndex", config.ConnectionsClass(config=config).inputs)
+        config.doUseHostIndex = True
+        self.assertNotIn("sourceCat", config.ConnectionsClass(config=config).inputs)
+        self.assertIn("hostIndex", config.ConnectionsClass(config=config).inputs)
+
     # ------------------------------------------------------------------
     # Hosted fakes: zero valid hosts — warning issued, no crash when
     # random fakes are also enabled as fallback
@@ -358,39 +630,106 @@ class TestCreateVisitDetectorFakesTask(lsst.utils.tests.TestCase):
             nRandomFakes=10,
             doAddHostedFakes=True,
         )
-        empty_table = Table({
-            "slot_Centroid_x": np.array([]),
-            "slot_Centroid_y": np.array([]),
-            "slot_ModelFlux_mag": np.array([]),
-            "slot_ModelFlux_flux": np.array([]),
-            "slot_ModelFlux_fluxErr": np.array([]),
-            "slot_Shape_xx": np.array([]),
-            "slot_Shape_xy": np.array([]),
-            "slot_Shape_yy": np.array([]),
-            "id": np.array([], dtype=np.int64),
-            "coord_ra": np.array([]),
-            "coord_dec": np.array([]),
-            "sky_source": np.array([], dtype=bool),
-            "base_ClassificationSizeExtendedness_flag": np.array([], dtype=bool),
-            "base_ClassificationExtendedness_flag": np.array([], dtype=bool),
-            "slot_Shape_flag": np.array([], dtype=bool),
-            "slot_Centroid_flag": np.array([], dtype=bool),
-            "base_PixelFlags_flag": np.array([], dtype=bool),
-            "base_ClassificationSizeExtendedness_value": np.array([]),
-            "base_ClassificationExtendedness_value": np.array([], dtype=int),
-        })
-        self.visit_image.getPhotoCalib().calibrateCatalog.return_value.asAstropy.return_value = (
-            empty_table
-        )
+        self.visit_inputs["photoCalib"] = _make_mock_photo_calib()
 
         with self.assertLogs("lsst.ap.pipe.createApFakes", level="WARNING") as cm:
-            result = task.run(self.source_cat, self.visit_image)
+            result = task.run(_make_mock_source_cat(_make_host_table(0)), **self.visit_inputs)
 
         self.assertTrue(any("no valid hosts" in msg.lower() for msg in cm.output))
         # Random fakes still produced
         self.assertEqual(len(result.outputCat), 10)
 
 
+class TestCreateVisitFakesTask(lsst.utils.tests.TestCase):
+
+    def setUp(self):
+        self.visitId = 2024111100094
+        self.bbox = geom.Box2I(geom.Point2I(0, 0), geom.Extent2I(4000, 4000))
+        self.visitSummary = []
+        self.visit_inputs = {}
+        for detId, ra in ((3, 10.0), (4, 10.25)):
+            wcs = afwGeom.makeSkyWcs(crpix=geom.Point2D(2000, 2000),
+                                     crval=geom.SpherePoint(ra, -1.0, geom.degrees),
+                                     cdMatrix=afwGeom.makeCdMatrix(scale=0.2 * geom.arcseconds))
+            record = MagicMock()
+            record.getId.return_value = detId
+            record.getWcs.return_value = wcs
+            record.getBBox.return_value = self.bbox
+            record.__getitem__.side_effect = {"visit": self.visitId, "magLim": 25.0}.__getitem__
+            self.visitSummary.append(record)
+
+            self.visit_inputs[detId] = _make_mock_visit_inputs(visitId=self.visitId, detId=detId)
+            self.visit_inputs[detId].update(wcs=wcs, bbox=self.bbox, photoCalib=record.getPhotoCalib())
+
+    def _configure(self, config):
+        config.doAddRandomVisitFakes = True
+        config.doAddRandomTemplateFakes = True
+        config.doAddVariableFakes = True
+        config.nRandomFakes = -1
+        config.randomFakeDensity = 1000
+        return config
+
+    def testMatchesPerDetectorTask(self):
+        """Test that the visit-level task reproduces the per-detector
+        catalogs.
+        """
+        task = CreateVisitFakesTask(config=self._configure(CreateVisitFakesConfig()))
+        detectorTask = CreateVisitDetectorFakesTask(config=self._configure(CreateVisitDetectorFakesConfig()))
+
+        outputCats = task.run(self.visitSummary).outputCats
+
+        self.assertEqual(outputCats.keys(), {3, 4})
+        for detId, cat in outputCats.items():
+            expected = detectorTask.run(None, **self.visit_inputs[detId]).outputCat
+            self.assertGreater(len(cat), 0)
+            self.assertEqual(cat.colnames, expected.colnames)
+            for name in cat.colnames:
+                np.testing.assert_array_equal(cat[name], expected[name])
+
+    def testHostedFakesReadsSourceCats(self):
+        config = self._configure(CreateVisitFakesConfig())
+        config.doAddRandomVisitFakes = False
+        config.doAddHostedFakes = True
+        config.minHostedFakes = 1
+        task = CreateVisitFakesTask(config=config)
+        for record in self.visitSummary:
+            record.getPhotoCalib.return_value = _make_mock_photo_calib()
+        sourceCat = _make_mock_source_cat(_make_host_table(5))
+
+        outputCats = task.run(self.visitSummary, {3: InMemoryDatasetHandle(sourceCat)}).outputCats
+
+        # Detector 4 has no source catalog
+        self.assertEqual(outputCats.keys(), {3})
+        self.assertTrue(np.all(outputCats[3]["hosted_fake"]))
+
+    def testSourceCatsConnection(self):
+        config = CreateVisitFakesConfig()
+        config.doAddHostedFakes = False
+        self.assertNotIn("sourceCats", config.ConnectionsClass(config=config).inputs)
+        config.doAddHostedFakes = True
+        self.assertIn("sourceCats", config.ConnectionsClass(config=config).inputs)
+
+
+class TestMakeDetectorRegion(lsst.utils.tests.TestCase):
+
+    def testMatchesExposurePolygon(self):
+        """Test that the region is the padded polygon of the exposure.
+        """
+        bbox = geom.Box2I(geom.Point2I(0, 0), geom.Extent2I(4000, 4072))
+        wcs = afwGeom.makeSkyWcs(crpix=geom.Point2D(2000, 2036),
+                                 crval=geom.SpherePoint(10.0, -1.0, geom.degrees),
+                                 cdMatrix=afwGeom.makeCdMatrix(scale=0.2 * geom.arcseconds))
+        exposure = afwImage.ExposureF(bbox)
+        exposure.setWcs(wcs)
+
+        region = _make_detector_region(bbox, wcs)
+
+        self.assertEqual(region, exposure.getConvexPolygon())
+        # Positions within the padding are inside the region.
+        self.assertTrue(region.contains(wcs.pixelToSky(geom.Point2D(-5.0, 2000.0)).getVector()))
+        self.assertFalse(region.contains(wcs.pixelToSky(geom.Point2D(-15.0, 2000.0)).getVector()))
+
+
 class MemoryTester(lsst.utils.tests.MemoryTestCase):
     pass
 
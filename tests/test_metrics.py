@@ -21,6 +21,7 @@
 #
 
 import astropy.units as u
+import numpy as np
 import time
 import unittest
 
@@ -32,7 +33,9 @@ from lsst.verify import Name
 import lsst.verify.tasks
 from lsst.verify.tasks.testUtils import MetricTaskTestCase
 
-from lsst.ap.pipe.metrics import PipelineTimingMetricTask
+from lsst.ap.pipe.metrics import PipelineTimingMetricTask, PipelineStageTimingTask, \
+    PipelineVisitTimingMetricTask, PipelineCpuTimeMetricTask, PipelineCpuEfficiencyMetricTask, \
+    PipelinePeakMemoryMetricTask
 
 
 class DummyTask(lsst.pipe.base.Task):
@@ -131,6 +134,34 @@ class TestPipelineTimingMetricTask(MetricTaskTestCase):
             meas = result.measurement
             self.assertIsNone(meas)
 
+    def testRunMany(self):
+        other = DummyTask(name="last")
+        other.run()
+        pairs = [(self.startTask.getFullMetadata(), self.endTask.getFullMetadata()),
+                 (self.startTask.getFullMetadata(), other.getFullMetadata()),
+                 (self.endTask.getFullMetadata(), self.endTask.getFullMetadata())]
+
+        measurements = self.task.runMany(pairs)
+
+        self.assertEqual(len(measurements), 3)
+        for (metadataStart, metadataEnd), meas in zip(pairs[:2], measurements):
+            self.assertEqual(meas.quantity, self.task.run(metadataStart, metadataEnd).measurement.quantity)
+        self.assertGreater(measurements[1].quantity, measurements[0].quantity)
+        # The start task's metadata is missing from the last pair.
+        self.assertIsNone(measurements[2])
+
+    def testRunChangingKeys(self):
+        # Metadata with the same top-level names as earlier quanta, but
+        # without or with the target methods.
+        notRun = DummyTask(name="first")
+
+        with self.assertRaises(lsst.pipe.base.NoWorkFound):
+            self.task.run(notRun.getFullMetadata(), self.endTask.getFullMetadata())
+        result = self.task.run(self.startTask.getFullMetadata(), self.endTask.getFullMetadata())
+        self.assertGreater(result.measurement.quantity, 0.0 * u.s)
+        with self.assertRaises(lsst.pipe.base.NoWorkFound):
+            self.task.run(notRun.getFullMetadata(), self.endTask.getFullMetadata())
+
     def testBadlyTypedKeys(self):
         metadata = self.endTask.getFullMetadata()
         endKeys = [key
@@ -143,6 +174,196 @@ class TestPipelineTimingMetricTask(MetricTaskTestCase):
             self.task.run(self.startTask.getFullMetadata(), metadata)
 
 
+class TestPipelineVisitTimingMetricTask(lsst.utils.tests.TestCase):
+    def setUp(self):
+        config = PipelineVisitTimingMetricTask.ConfigClass()
+        config.connections.labelStart = "first"
+        config.connections.labelEnd = "last"
+        config.targetStart = "first.run"
+        config.targetEnd = "last.run"
+        config.connections.package = "ap_pipe"
+        config.connections.metric = "DummyTime"
+        self.task = PipelineVisitTimingMetricTask(config=config)
+
+        # Run the detectors one after the other, so that the last one
+        # finishes last.
+        self.metadataStart = {}
+        self.metadataEnd = {}
+        for detector in (3, 1, 2):
+            startTask = DummyTask(name="first")
+            startTask.run()
+            endTask = DummyTask(name="last")
+            endTask.run()
+            self.metadataStart[detector] = startTask.getFullMetadata()
+            self.metadataEnd[detector] = endTask.getFullMetadata()
+
+    def testRun(self):
+        meas = self.task.run(self.metadataStart, self.metadataEnd).measurement
+
+        self.assertEqual(meas.metric_name, Name("ap_pipe.DummyTime"))
+        self.assertEqual(meas.extras["nDetectors"].quantity, 3)
+        self.assertEqual(meas.extras["criticalDetector"].quantity, 2)
+        self.assertGreaterEqual(meas.extras["medianDetectorTime"].quantity, 2*DummyTask.taskLength*u.s)
+        self.assertGreaterEqual(meas.extras["maxDetectorTime"].quantity,
+                                meas.extras["p95DetectorTime"].quantity)
+        self.assertGreaterEqual(meas.extras["finishSpread"].quantity, 4*DummyTask.taskLength*u.s)
+        self.assertGreaterEqual(meas.quantity,
+                                meas.extras["finishSpread"].quantity + 2*DummyTask.taskLength*u.s)
+
+    def testMissingDetector(self):
+        del self.metadataEnd[2]
+        meas = self.task.run(self.metadataStart, self.metadataEnd).measurement
+
+        self.assertEqual(meas.extras["nDetectors"].quantity, 2)
+        self.assertEqual(meas.extras["criticalDetector"].quantity, 1)
+
+    def testNoDetectors(self):
+        with self.assertRaises(lsst.pipe.base.NoWorkFound):
+            self.task.run(self.metadataStart, {})
+
+
+class TestPipelineResourceMetricTasks(lsst.utils.tests.TestCase):
+    @staticmethod
+    def _makeTask(taskClass, targetStart="first.run", targetEnd="last.run", sameProcess=None,
+                  labelEnd="last"):
+        config = taskClass.ConfigClass()
+        config.connections.labelStart = "first"
+        config.connections.labelEnd = labelEnd
+        if sameProcess is not None:
+            config.sameProcess = sameProcess
+        config.targetStart = targetStart
+        config.targetEnd = targetEnd
+        config.connections.package = "ap_pipe"
+        config.connections.metric = "DummyResource"
+        return taskClass(config=config)
+
+    def setUp(self):
+        self.startTask = DummyTask(name="first")
+        self.startTask.run()
+        self.endTask = DummyTask(name="last")
+        self.endTask.run()
+
+    def _run(self, task):
+        return task.run(self.startTask.getFullMetadata(), self.endTask.getFullMetadata()).measurement
+
+    def testCpuTime(self):
+        meas = self._run(self._makeTask(PipelineCpuTimeMetricTask, sameProcess=True))
+
+        self.assertEqual(meas.metric_name, Name("ap_pipe.DummyResource"))
+        self.assertGreaterEqual(meas.quantity, 0.0 * u.s)
+        self.assertIn(meas.extras["peakTask"].quantity, {"first.run", "last.run"})
+
+    def testCpuTimeWrongOrder(self):
+        # The "start" task ran after the "end" one in the same process.
+        task = self._makeTask(PipelineCpuTimeMetricTask, targetStart="last.run", targetEnd="first.run",
+                              sameProcess=True)
+        with self.assertRaises(lsst.pipe.base.NoWorkFound):
+            task.run(self.endTask.getFullMetadata(), self.startTask.getFullMetadata())
+
+    def testCpuTimeDifferentProcesses(self):
+        for taskClass in [PipelineCpuTimeMetricTask, PipelineCpuEfficiencyMetricTask]:
+            with self.subTest(taskClass=taskClass), self.assertRaises(lsst.pipe.base.NoWorkFound):
+                self._run(self._makeTask(taskClass))
+
+    def testCpuTimeSameQuantum(self):
+        # Both targets come from one metadata object, so no config is needed.
+        task = self._makeTask(PipelineCpuTimeMetricTask, targetStart="first.run", targetEnd="first.run",
+                              labelEnd="first")
+        metadata = self.startTask.getFullMetadata()
+        meas = task.run(metadata, metadata).measurement
+
+        self.assertAlmostEqual(meas.quantity.to_value(u.s),
+                               metadata.getScalar("first.runEndCpuTime")
+                               - metadata.getScalar("first.runStartCpuTime"))
+
+    def testCpuEfficiency(self):
+        meas = self._run(self._makeTask(PipelineCpuEfficiencyMetricTask, sameProcess=True))
+        wallTime = self._run(PipelineTimingMetricTask(config=TestPipelineTimingMetricTask._makeConfig(
+            nameStart="first", nameEnd="last"))).quantity
+
+        self.assertEqual(meas.extras["wallTime"].quantity, wallTime)
+        # The dummy tasks mostly sleep.
+        self.assertGreaterEqual(meas.quantity, 0.0 * u.dimensionless_unscaled)
+        self.assertLess(meas.quantity, 1.0 * u.dimensionless_unscaled)
+        self.assertAlmostEqual(meas.quantity.value,
+                               (meas.extras["cpuTime"].quantity / meas.extras["wallTime"].quantity).value)
+
+    def testPeakMemory(self):
+        meas = self._run(self._makeTask(PipelinePeakMemoryMetricTask))
+
+        self.assertGreater(meas.quantity, 0.0 * u.byte)
+        self.assertEqual(meas.quantity.to_value(u.byte),
+                         self.endTask.getFullMetadata().getScalar("last.runEndMaxResidentSetSize"))
+        self.assertIn(meas.extras["peakTask"].quantity, {"first.run", "last.run"})
+
+    def testMissingMethod(self):
+        for taskClass, sameProcess in [(PipelineCpuTimeMetricTask, True),
+                                       (PipelineCpuEfficiencyMetricTask, True),
+                                       (PipelinePeakMemoryMetricTask, None)]:
+            task = self._makeTask(taskClass, targetStart="first.doProcess", targetEnd="last.doProcess",
+                                  sameProcess=sameProcess)
+            with self.subTest(taskClass=taskClass), self.assertRaises(lsst.pipe.base.NoWorkFound):
+                self._run(task)
+
+
+class TestPipelineStageTimingTask(lsst.utils.tests.TestCase):
+    @staticmethod
+    def _makeConfig(stages=("first", "last")):
+        config = PipelineStageTimingTask.ConfigClass()
+        config.stages = list(stages)
+        config.exposureStages = ["first"]
+        return config
+
+    def setUp(self):
+        self.startTask = DummyTask(name="first")
+        self.startTask.run()
+        self.endTask = DummyTask(name="last")
+        self.endTask.run()
+        self.metadata = {"first": self.startTask.getFullMetadata(), "last": self.endTask.getFullMetadata()}
+
+    def testConnections(self):
+        config = self._makeConfig()
+        connections = config.connections.ConnectionsClass(config=config)
+        self.assertEqual(connections.metadata_first.name, "first_metadata")
+        self.assertIn("exposure", connections.metadata_first.dimensions)
+        self.assertEqual(connections.metadata_last.name, "last_metadata")
+        self.assertIn("visit", connections.metadata_last.dimensions)
+
+    def testRun(self):
+        task = PipelineStageTimingTask(config=self._makeConfig())
+        stageTiming = task.run(self.metadata).stageTiming
+
+        self.assertEqual(list(stageTiming["stage"]), ["first", "last"])
+        for row in stageTiming:
+            self.assertGreaterEqual(row["wallTime"], DummyTask.taskLength)
+            self.assertGreaterEqual(row["cpuTime"], 0.0)
+            self.assertGreater(row["maxResidentSetSize"], 0.0)
+        self.assertTrue(np.isnan(stageTiming["idleBefore"][0]))
+        self.assertGreaterEqual(stageTiming["idleBefore"][1], 0.0)
+
+        oracle = PipelineTimingMetricTask(config=TestPipelineTimingMetricTask._makeConfig("first", "last"))
+        total = oracle.run(self.startTask.getFullMetadata(), self.endTask.getFullMetadata())
+        self.assertAlmostEqual(np.sum(stageTiming["wallTime"]) + stageTiming["idleBefore"][1],
+                               total.measurement.quantity.to_value(u.s))
+
+    def testRunMissingStage(self):
+        config = self._makeConfig()
+        config.method = "doProcess"
+        task = PipelineStageTimingTask(config=config)
+        with self.assertRaises(lsst.pipe.base.NoWorkFound):
+            task.run(self.metadata)
+
+    def testBadlyTypedKeys(self):
+        metadata = self.endTask.getFullMetadata()
+        for key in metadata.paramNames(topLevelOnly=False):
+            if "EndUtc" in key:
+                metadata[key] = 42
+
+        task = PipelineStageTimingTask(config=self._makeConfig())
+        with self.assertRaises(lsst.verify.tasks.MetricComputationError):
+            task.run({"first": self.startTask.getFullMetadata(), "last": metadata})
+
+
 # Hack around unittest's hacky test setup system
 del MetricTaskTestCase
 
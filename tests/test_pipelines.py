@@ -19,10 +19,20 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import contextlib
+import copy
+import functools
+import importlib.util
 import itertools
+import multiprocessing
+import os
+import shutil
 import tempfile
+import traceback
 import unittest
+from concurrent.futures import ProcessPoolExecutor
 
+import lsst.daf.butler
 import lsst.daf.butler.tests as butlerTests
 import lsst.pipe.base
 from lsst.pipe.base.tests.pipelineStepTester import PipelineStepTester  # Can't use fully-qualified name
@@ -31,10 +41,197 @@ import lsst.utils.tests
 
 from lsst.resources import ResourcePath
 
+# Number of processes checking pipelines in parallel. Under pytest-xdist,
+# the tests already run in parallel workers, so each checks its files
+# serially unless told otherwise.
+if "AP_PIPE_TEST_JOBS" in os.environ:
+    N_JOBS = int(os.environ["AP_PIPE_TEST_JOBS"])
+elif "PYTEST_XDIST_WORKER" in os.environ:
+    N_JOBS = 1
+else:
+    N_JOBS = min(4, os.cpu_count() or 1)
+
+# Overall inputs that the pipelines cannot define themselves; also used by
+# scripts/benchmarks/benchmark_pipelines.py.
+INITIAL_DATASET_TYPES = [("ps1_pv3_3pi_20170110", {"htm7"}, "SimpleCatalog"),
+                         ("gaia_dr2_20200414", {"htm7"}, "SimpleCatalog"),
+                         ("gaia_dr3_20230707", {"htm7"}, "SimpleCatalog"),
+                         ]
+
+
+@functools.cache
+def _parse_pipeline(uri):
+    return lsst.pipe.base.Pipeline.from_uri(uri)
+
+
+def load_pipeline(uri):
+    """Read a pipeline, parsing each file at most once per process.
+
+    Parameters
+    ----------
+    uri : `lsst.resources.ResourcePath` or `str`
+        The pipeline file.
+
+    Returns
+    -------
+    pipeline : `lsst.pipe.base.Pipeline`
+        A copy of the parsed pipeline, which the caller may modify.
+    """
+    return copy.deepcopy(_parse_pipeline(str(uri)))
+
+
+def _collect(function, *args):
+    """Call a check in a worker process.
+
+    Returns
+    -------
+    error : `str` or `None`
+        Traceback of any error, as text rather than an exception that may
+        not survive pickling.
+    data
+        The plain data returned by the check, for the parent process to
+        make its assertions on.
+    """
+    try:
+        return None, function(*args)
+    except Exception:
+        return traceback.format_exc(), None
+
+
+def _build_graph(file):
+    pipeline = load_pipeline(file)
+    pipeline.addConfigOverride("parameters", "apdb_config", "some/file/path.yaml")
+    # If this fails, it will produce a useful error message.
+    pipeline.to_graph()
+
+
+def _expected_inputs(file):
+    expected_inputs = {
+        # ISR
+        "raw", "camera", "crosstalk", "crosstalkSources", "bias", "dark", "flat", "ptc",
+        "fringe", "straylightData", "bfKernel", "newBFKernel", "defects", "linearizer",
+        "opticsTransmission", "filterTransmission", "atmosphereTransmission",
+        "illumMaskedImage", "deferredChargeCalib",
+        # ISR-LSST
+        "bfk", "cti", "dnlLUT", "gain_correction",
+        # Everything else
+        "skyMap", "gaia_dr3_20230707", "gaia_dr2_20200414", "ps1_pv3_3pi_20170110",
+        "template_coadd", "pretrainedModelPackage", "dia_source_apdb"
+    }
+    # Detect source-injection pipelines by task label rather than
+    # relying on filename conventions.
+    if "injectVisit" in _parse_pipeline(file).task_labels:
+        expected_inputs.add("injection_catalog")
+        expected_inputs.add("VisitDetectorFakeSourceCat")
+    return expected_inputs
+
+
+def _make_tester(file):
+    return PipelineStepTester(
+        filename=file,
+        step_suffixes=[""],  # Test full pipeline
+        initial_dataset_types=[(*datasetType, False) for datasetType in INITIAL_DATASET_TYPES],
+        expected_inputs=_expected_inputs(file),
+        # Pipeline outputs highly in flux, don't test
+        expected_outputs=set(),
+        pipeline_patches={"parameters:apdb_config": "some/file/path.yaml",
+                          },
+    )
+
+
+@contextlib.contextmanager
+def _copy_repo(template_repo):
+    """Make a writeable copy of an empty repository.
+
+    Tester modifies Butler registry, so need a fresh repo every time; a copy
+    of an empty one is much faster to make than a new one.
+    """
+    with tempfile.TemporaryDirectory() as tempDir:
+        tempRepo = os.path.join(tempDir, "repo")
+        shutil.copytree(template_repo, tempRepo)
+        butler = lsst.daf.butler.Butler(tempRepo, writeable=True)
+        try:
+            yield butler
+        finally:
+            butler.close()
+
+
+def _check_datasets(file, template_repo, test_case):
+    with _copy_repo(template_repo) as butler:
+        _make_tester(file).run(butler, test_case)
+
+
+def _find_pure_inputs(file, template_repo):
+    """Return the inputs of a pipeline that it does not produce itself, as
+    `PipelineStepTester` finds them for a single step.
+    """
+    tester = _make_tester(file)
+    with _copy_repo(template_repo) as butler:
+        for name, dimensions, storageClass, isCalibration in tester.initial_dataset_types:
+            butler.registry.registerDatasetType(lsst.daf.butler.DatasetType(
+                name, dimensions, storageClass, isCalibration=isCalibration, universe=butler.dimensions))
+        pipeline = load_pipeline(file)
+        for field, value in tester.pipeline_patches.items():
+            label, key = field.split(":")
+            pipeline.addConfigOverride(label, key, value)
+        graph = pipeline.to_graph(registry=butler.registry)
+        initial = {datasetType[0] for datasetType in tester.initial_dataset_types}
+        return sorted(name for name, _ in graph.iter_overall_inputs() if name not in initial)
+
 
 class PipelineDefintionsTestSuite(lsst.utils.tests.TestCase):
     """Tests of the self-consistency of our pipeline definitions.
     """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.templateDir = tempfile.TemporaryDirectory()
+        cls.templateRepo = os.path.join(cls.templateDir.name, "repo")
+        butlerTests.makeTestRepo(cls.templateRepo).close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.templateDir.cleanup()
+        super().tearDownClass()
+
+    def _check_files(self, files, collect, *args, verify=None, check=None):
+        """Run a check on several pipeline files, reporting each file as a
+        subtest.
+
+        With several processes, ``collect(file, *args)`` runs in a worker and
+        returns plain data, on which ``verify(file, data)`` makes the
+        assertions in this process. Run serially, ``check(file, *args,
+        self)`` makes its assertions on this test case instead; without a
+        ``check``, ``collect`` and ``verify`` are called here.
+        """
+        files = [str(file) for file in files]
+        if N_JOBS == 1 or len(files) == 1:
+            for file in files:
+                with self.subTest(file=file):
+                    if check is not None:
+                        check(file, *args, self)
+                    else:
+                        data = collect(file, *args)
+                        if verify is not None:
+                            verify(file, data)
+            return
+
+        # Forking a process that may have started threads is unsafe.
+        with ProcessPoolExecutor(max_workers=N_JOBS,
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            results = list(executor.map(_collect, itertools.repeat(collect), files,
+                                        *(itertools.repeat(arg) for arg in args)))
+        for file, (error, data) in zip(files, results):
+            with self.subTest(file=file):
+                if error is not None:
+                    self.fail(error)
+                if verify is not None:
+                    verify(file, data)
+
+    def _verify_pure_inputs(self, file, pureInputs):
+        self.assertLessEqual(set(pureInputs), _expected_inputs(file),
+                             msg="The pipeline has unexpected inputs.")
+
     def setUp(self):
         self.path = ResourcePath("eups://ap_pipe/pipelines/", forceDirectory=True)
         # Each pipeline file should have a subset that represents it in
@@ -55,6 +252,7 @@ class PipelineDefintionsTestSuite(lsst.utils.tests.TestCase):
         used to build a graph.
         """
         files = ResourcePath.findFileResources([self.path], file_filter=r".*\.yaml$")
+        tested = []
         for file in files:
             if "QuickTemplate" in file.path:
                 # Our QuickTemplate definition cannot be tested here because it
@@ -64,16 +262,14 @@ class PipelineDefintionsTestSuite(lsst.utils.tests.TestCase):
                 # Our PromptTemplate definition cannot be tested here because it
                 # depends on drp_tasks, which we cannot make a dependency here.
                 continue
-            with self.subTest(file=str(file)):
-                pipeline = lsst.pipe.base.Pipeline.from_uri(file)
-                pipeline.addConfigOverride("parameters", "apdb_config", "some/file/path.yaml")
-                # If this fails, it will produce a useful error message.
-                pipeline.to_graph()
+            tested.append(file)
+        self._check_files(tested, _build_graph)
 
     def test_datasets(self):
         files = ResourcePath.findFileResources(
             [self.path.join("_ingredients", forceDirectory=True)], file_filter=r".*\.yaml$"
         )
+        tested = []
         for file in files:
             if "QuickTemplate" in file.path:
                 # Our QuickTemplate definition cannot be tested here because it
@@ -84,43 +280,9 @@ class PipelineDefintionsTestSuite(lsst.utils.tests.TestCase):
                 # pipeline merged into full AP pipelines at build time;
                 # it is validated separately by test_injection_ingredient.
                 continue
-            with self.subTest(file=str(file)):
-                expected_inputs = {
-                    # ISR
-                    "raw", "camera", "crosstalk", "crosstalkSources", "bias", "dark", "flat", "ptc",
-                    "fringe", "straylightData", "bfKernel", "newBFKernel", "defects", "linearizer",
-                    "opticsTransmission", "filterTransmission", "atmosphereTransmission",
-                    "illumMaskedImage", "deferredChargeCalib",
-                    # ISR-LSST
-                    "bfk", "cti", "dnlLUT", "gain_correction",
-                    # Everything else
-                    "skyMap", "gaia_dr3_20230707", "gaia_dr2_20200414", "ps1_pv3_3pi_20170110",
-                    "template_coadd", "pretrainedModelPackage", "dia_source_apdb"
-                }
-                # Detect source-injection pipelines by task label rather than
-                # relying on filename conventions.
-                temp_pipeline = lsst.pipe.base.Pipeline.from_uri(file)
-                temp_pipeline.addConfigOverride("parameters", "apdb_config", "some/file/path.yaml")
-                if "injectVisit" in temp_pipeline.task_labels:
-                    expected_inputs.add("injection_catalog")
-                    expected_inputs.add("VisitDetectorFakeSourceCat")
-                tester = PipelineStepTester(
-                    filename=file,
-                    step_suffixes=[""],  # Test full pipeline
-                    initial_dataset_types=[("ps1_pv3_3pi_20170110", {"htm7"}, "SimpleCatalog", False),
-                                           ("gaia_dr2_20200414", {"htm7"}, "SimpleCatalog", False),
-                                           ("gaia_dr3_20230707", {"htm7"}, "SimpleCatalog", False),
-                                           ],
-                    expected_inputs=expected_inputs,
-                    # Pipeline outputs highly in flux, don't test
-                    expected_outputs=set(),
-                    pipeline_patches={"parameters:apdb_config": "some/file/path.yaml",
-                                      },
-                )
-                # Tester modifies Butler registry, so need a fresh repo every time
-                with tempfile.TemporaryDirectory() as tempRepo:
-                    butler = butlerTests.makeTestRepo(tempRepo)
-                    tester.run(butler, self)
+            tested.append(file)
+        self._check_files(tested, _find_pure_inputs, self.templateRepo,
+                          verify=self._verify_pure_inputs, check=_check_datasets)
 
     def test_whole_subset(self):
         """Test that each pipeline's synonymous subset includes all tasks,
@@ -145,7 +307,7 @@ class PipelineDefintionsTestSuite(lsst.utils.tests.TestCase):
                 # depends on drp_tasks, which we cannot make a dependency here.
                 continue
             with self.subTest(file=str(file)):
-                pipeline = lsst.pipe.base.Pipeline.from_uri(file)
+                pipeline = load_pipeline(file)
                 subset = self.synonyms.get(file.basename(), "<unknown_synonym>")
                 self.assertEqual(pipeline.subsets.get(subset, "<missing>"), set(pipeline.task_labels),
                                  msg=f"These tasks are missing from subset '{subset}'")
@@ -164,7 +326,7 @@ class PipelineDefintionsTestSuite(lsst.utils.tests.TestCase):
                 # PostInjectedTasksApPipe is not actually an AP pipeline
                 continue
             with self.subTest(file=str(file)):
-                pipeline = lsst.pipe.base.Pipeline.from_uri(file)
+                pipeline = load_pipeline(file)
                 # Do all steps exist?
                 self.assertGreaterEqual(pipeline.subsets.keys(), required_subsets,
                                         msg="An AP pipeline is missing subsets "
@@ -191,7 +353,7 @@ class PipelineDefintionsTestSuite(lsst.utils.tests.TestCase):
         """
         ingredient = self.path.join("_ingredients").join("injection").join("PostInjectedTasksApPipe.yaml")
         with self.subTest(file=str(ingredient)):
-            pipeline = lsst.pipe.base.Pipeline.from_uri(ingredient)
+            pipeline = load_pipeline(ingredient)
             expected_tasks = {
                 "injectedMatchDiaSrc",
                 "injectedMatchAssocDiaSrc",
@@ -222,7 +384,7 @@ class PipelineDefintionsTestSuite(lsst.utils.tests.TestCase):
                 "Run 'scons' in the ap_pipe root directory to generate it."
             )
         with self.subTest(file=str(generated)):
-            pipeline = lsst.pipe.base.Pipeline.from_uri(generated)
+            pipeline = load_pipeline(generated)
             pipeline.addConfigOverride("parameters", "apdb_config", "some/file/path.yaml")
             self.assertIn(
                 "injectVisit",
@@ -254,8 +416,8 @@ class PipelineDefintionsTestSuite(lsst.utils.tests.TestCase):
                                 msg=f"Expected sibling ApPipe.yaml next to {precon_file}: "
                                     f"{base_file} does not exist.")
 
-                precon = lsst.pipe.base.Pipeline.from_uri(precon_file)
-                base = lsst.pipe.base.Pipeline.from_uri(base_file)
+                precon = load_pipeline(precon_file)
+                base = load_pipeline(base_file)
                 # apdb_config has no default and must be set before to_graph().
                 precon.addConfigOverride("parameters", "apdb_config", "some/file/path.yaml")
                 base.addConfigOverride("parameters", "apdb_config", "some/file/path.yaml")
@@ -293,12 +455,23 @@ class PipelineDefintionsTestSuite(lsst.utils.tests.TestCase):
                 generic = self.path.join("_ingredients/", forceDirectory=True).join(file.basename())
                 if not generic.exists():
                     continue
-                special_subsets = lsst.pipe.base.Pipeline.from_uri(file).subsets.keys()
-                generic_subsets = lsst.pipe.base.Pipeline.from_uri(generic).subsets.keys()
+                special_subsets = load_pipeline(file).subsets.keys()
+                generic_subsets = load_pipeline(generic).subsets.keys()
                 self.assertGreaterEqual(special_subsets, generic_subsets,
                                         msg="The instrument-specific pipeline is missing subsets "
                                             f"{generic_subsets - special_subsets}.")
 
+    def test_benchmark_initial_dataset_types(self):
+        """Test that the pipeline benchmark resolves graphs against the same
+        overall inputs as these tests.
+        """
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                            "scripts", "benchmarks", "benchmark_pipelines.py")
+        spec = importlib.util.spec_from_file_location("benchmark_pipelines", path)
+        benchmark = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(benchmark)
+        self.assertEqual(benchmark._INITIAL_DATASET_TYPES, INITIAL_DATASET_TYPES)
+
 
 class MemoryTester(lsst.utils.tests.MemoryTestCase):
     pass
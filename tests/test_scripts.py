@@ -0,0 +1,528 @@
+# This file is part of ap_pipe.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (http://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the helper functions of the scripts in ``scripts/``, which are
+not part of the Python package.
+"""
+
+import importlib.util
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import numpy as np
+from astropy.table import Table
+
+from lsst.daf.butler import CollectionType, MissingCollectionError
+from lsst.pipe.base import TaskMetadata
+from lsst.sphgeom import HtmPixelization, LonLat, UnitVector3d
+import lsst.utils.tests
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "scripts")
+
+
+def load_script(path):
+    """Import a script as a module.
+
+    Parameters
+    ----------
+    path : `str`
+        Path of the script relative to the ``scripts`` directory.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPTS_DIR, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class BenchmarkPipelinesTestSuite(lsst.utils.tests.TestCase):
+    def setUp(self):
+        self.script = load_script("benchmarks/benchmark_pipelines.py")
+        self.args = SimpleNamespace(baseline_runs=5, threshold=0.25, min_delta=0.05)
+
+    def test_find_regressions(self):
+        """Test that only runs from the same host make the baseline.
+        """
+        history = [{"host": "fast", "results": {"ApPipe.yaml": {"load": 1.0}}},
+                   {"host": "slow", "results": {"ApPipe.yaml": {"load": 3.0}}},
+                   ]
+        results = {"ApPipe.yaml": {"load": 2.0, "toGraph": 5.0}}
+        self.assertEqual(self.script.find_regressions(history, results, self.args, host="fast"),
+                         [("ApPipe.yaml", "load", 1.0, 2.0)])
+        self.assertEqual(self.script.find_regressions(history, results, self.args, host="slow"), [])
+        self.assertEqual(self.script.find_regressions(history, results, self.args, host="other"), [])
+
+
+class UpdateApChainsTestSuite(lsst.utils.tests.TestCase):
+    def setUp(self):
+        self.script = load_script("LSSTCam/update_ap_chains.py")
+
+    @staticmethod
+    def _info(name, type, children=()):
+        return SimpleNamespace(name=name, type=type, children=tuple(children))
+
+    def test_get_nights(self):
+        self.assertEqual(self.script.get_nights("20250130", "20250202"),
+                         ["20250130", "20250131", "20250201", "20250202"])
+        self.assertEqual(self.script.get_nights("20250130", "20250130"), ["20250130"])
+        with self.assertRaises(ValueError):
+            self.script.get_nights("20250202", "20250130")
+
+    def test_chain_order(self):
+        """Test that runs keep the order of their output chain, newest
+        first, whatever order the registry returns them in.
+        """
+        prefix = self.script.DAYTIME_PREFIX
+        old = f"{prefix}20250130/20250131T100000Z/BLOCK-365"
+        new = f"{prefix}20250130/20250131T180000Z/BLOCK-365"
+        other = f"{prefix}20250131/20250201T100000Z"
+        butler = MagicMock()
+        butler.collections.query_info.return_value = [
+            self._info(old, CollectionType.RUN),
+            self._info(other, CollectionType.RUN),
+            self._info(new, CollectionType.RUN),
+            self._info(f"{prefix}20250130", CollectionType.CHAINED, [new, old]),
+            self._info(f"{prefix}20250131", CollectionType.CHAINED, [other]),
+        ]
+        runs = self.script.find_daytime_runs(butler, {"20250130", "20250131", "20250201"})
+        self.assertEqual(runs, {"20250130": [new, old], "20250131": [other]})
+        butler.collections.query_info.assert_called_once()
+
+        prompt = "LSSTCam/runs/prompt-20250130"
+        butler.collections.query_info.return_value = [
+            self._info(prompt, CollectionType.CHAINED, [old, "LSSTCam/prompt/output-20250130"]),
+        ]
+        updates = self.script.plan_updates(butler, {"20250130": runs["20250130"]})
+        self.assertEqual(updates, [
+            (prompt, (old, "LSSTCam/prompt/output-20250130"), [new, old, "LSSTCam/prompt/output-20250130"],
+             [new, old]),
+            ("LSSTCam/runs/daytimeAP-20250130", None, [new, old], None),
+        ])
+
+        # Prompt chains are prepended to, not redefined, so that runs added
+        # to them since they were read are kept.
+        self.script.apply_updates(butler, updates, batch_size=50)
+        butler.collections.prepend_chain.assert_called_once_with(prompt, [new, old])
+        butler.collections.register.assert_called_once_with("LSSTCam/runs/daytimeAP-20250130",
+                                                            type=CollectionType.CHAINED)
+        butler.collections.redefine_chain.assert_called_once_with("LSSTCam/runs/daytimeAP-20250130",
+                                                                  [new, old])
+
+
+class SubmitApDaytimeTestSuite(lsst.utils.tests.TestCase):
+    def setUp(self):
+        self.script = load_script("LSSTCam/submit_ap_daytime.py")
+        self.script.Pipeline = MagicMock()
+        self.script.Pipeline.from_uri.return_value = "pipeline"
+        self.config = self.script.load_config(self.script.DEFAULT_CONFIG)
+        retainedTypes = tempfile.NamedTemporaryFile(suffix=".yaml")
+        self.addCleanup(retainedTypes.close)
+        self.config["retainedTypes"] = retainedTypes.name
+        self.args = SimpleNamespace(day_obs="20250130")
+        self.runs = {"LSSTCam/defaults": ["LSSTCam/calib/run1", "LSSTCam/raw/all"],
+                     "LSSTCam/templates": ["LSSTCam/templates/run1"],
+                     "LSSTCam/runs/prompt-20250130": ["LSSTCam/prompt/output-20250130"],
+                     }
+
+    def _key(self):
+        def query(collection, **kwargs):
+            if collection not in self.runs:
+                raise MissingCollectionError(collection)
+            return self.runs[collection]
+
+        self.butler = MagicMock()
+        self.butler.collections.query.side_effect = query
+        context = self.script.make_cache_context(self.butler, self.config, self.args)
+        query = self.script.make_data_query(self.config, self.args.day_obs)
+        return self.script.cache_key(context, self.config, self.args, query, [1, 2, 3])
+
+    def test_make_partitions(self):
+        """Test that partitions are in exposure order, whatever their size.
+        """
+        butler = MagicMock()
+        butler.query_dimension_records.return_value = [
+            SimpleNamespace(id=id, science_program=block)
+            for id, block in [(5, "BLOCK-365"), (1, "BLOCK-407"), (2, "BLOCK-365"), (3, "BLOCK-365"),
+                              (4, "BLOCK-407"), (6, "BLOCK-T698"), (7, "BLOCK-T698"), (8, "cwfs")]
+        ]
+        partitions = {partition_by: self.script.make_partitions(butler, self.config, self.args.day_obs,
+                                                                partition_by, 3)
+                      for partition_by in ("night", "block", "exposure")}
+        self.assertEqual([(name, exposures) for name, _, exposures in partitions["night"]],
+                         [("night", [1, 2, 3, 4, 5, 6, 7])])
+        self.assertEqual([(name, exposures) for name, _, exposures in partitions["block"]],
+                         [("BLOCK-407", [1, 4]), ("BLOCK-365", [2, 3, 5]), ("BLOCK-T698", [6, 7])])
+        self.assertEqual([(name, exposures) for name, _, exposures in partitions["exposure"]],
+                         [("exposures-1-3", [1, 2, 3]), ("exposures-4-6", [4, 5, 6]), ("exposures-7-7", [7])])
+        self.assertIn("exposure.science_program='BLOCK-407'", partitions["block"][0][1])
+
+    def test_qgraph_options(self):
+        options = self.script.qgraph_options(self.config, self.args, "query")
+        self.assertEqual(options[options.index("--skip-existing-in") + 1], "LSSTCam/runs/prompt-20250130")
+
+    def test_cache_key(self):
+        """Test that graphs are reused when the submission is repeated, but
+        not once the runs of the input collections change.
+        """
+        key = self._key()
+        self.assertEqual(self._key(), key)
+        self.butler.collections.query.assert_any_call(
+            "LSSTCam/runs/prompt-20250130", flatten_chains=True, collection_types=CollectionType.RUN
+        )
+
+        # Earlier submissions add runs to the output chain.
+        output = "LSSTCam/runs/daytimeAP/20250130"
+        self.runs[output] = [f"{output}/20250131T100000Z/BLOCK-365"]
+        self.assertEqual(self._key(), key)
+
+        self.runs["LSSTCam/runs/prompt-20250130"].insert(0, f"{output}/20250131T100000Z/BLOCK-365")
+        self.assertNotEqual(self._key(), key)
+
+    def test_cache_entry(self):
+        """Test that a cached graph keeps its output run, and is only read
+        back once it is complete.
+        """
+        with tempfile.TemporaryDirectory() as cacheDir:
+            qgraph = os.path.join(cacheDir, "night.qg")
+            with open(qgraph, "wb") as stream:
+                stream.write(b"graph")
+            run = "LSSTCam/runs/daytimeAP/20250130/20250131T100000Z"
+            self.assertIsNone(self.script.read_cache_entry(cacheDir, "abc"))
+
+            self.script.write_cache_entry(cacheDir, "abc", run, submitted=False, qgraph=qgraph)
+            self.assertEqual(self.script.read_cache_entry(cacheDir, "abc"),
+                             {"outputRun": run, "submitted": False})
+            with open(os.path.join(cacheDir, "abc.qg"), "rb") as stream:
+                self.assertEqual(stream.read(), b"graph")
+
+            self.script.write_cache_entry(cacheDir, "abc", run, submitted=True)
+            self.assertEqual(self.script.read_cache_entry(cacheDir, "abc"),
+                             {"outputRun": run, "submitted": True})
+
+            os.remove(os.path.join(cacheDir, "abc.qg"))
+            self.assertIsNone(self.script.read_cache_entry(cacheDir, "abc"))
+
+
+class UpdateVisitRegionsTestSuite(lsst.utils.tests.TestCase):
+    def setUp(self):
+        self.script = load_script("LSSTCam/update_visit_regions.py")
+
+    @staticmethod
+    def _row(id, ra, dec, size=0.1):
+        return {"id": id,
+                "raCorners": [ra - size, ra + size, ra + size, ra - size],
+                "decCorners": [dec - size, dec - size, dec + size, dec + size]}
+
+    @staticmethod
+    def _point(ra, dec):
+        return UnitVector3d(LonLat.fromDegrees(ra, dec))
+
+    def test_compute_regions(self):
+        nan = float("nan")
+        summary = [self._row(0, 10.0, -5.0),
+                   self._row(1, 10.3, -5.0),
+                   {"id": 2, "raCorners": [nan]*4, "decCorners": [10.0, 10.1, 10.1, 10.0]},
+                   ]
+        region, records = self.script.compute_regions("LSSTCam", 42, summary)
+        self.assertEqual([(record["instrument"], record["visit"], record["detector"]) for record in records],
+                         [("LSSTCam", 42, 0), ("LSSTCam", 42, 1)])
+        self.assertTrue(records[0]["region"].contains(self._point(10.0, -5.0)))
+        self.assertFalse(records[0]["region"].contains(self._point(10.3, -5.0)))
+        self.assertTrue(records[1]["region"].contains(self._point(10.3, -5.0)))
+        # The visit region covers both detectors and the gap between them.
+        for ra in (10.0, 10.15, 10.3):
+            self.assertTrue(region.contains(self._point(ra, -5.0)))
+        self.assertFalse(region.contains(self._point(10.15, 10.05)))
+
+        self.assertEqual(self.script.compute_regions("LSSTCam", 42, summary[2:]), (None, []))
+
+    def test_make_shards(self):
+        refs = [SimpleNamespace(dataId={"visit": visit}) for visit in [5, 3, 7, 1, 2, 6, 4]]
+        shards = self.script.make_shards(refs, 3)
+        self.assertEqual([[ref.dataId["visit"] for ref in shard] for shard in shards],
+                         [[1, 2, 3], [4, 5, 6], [7]])
+        self.assertEqual(self.script.make_shards([], 3), [])
+
+    def test_adaptive_batch_size(self):
+        batch = self.script.AdaptiveBatchSize(1000, target=5.0, minimum=100, maximum=4000)
+        # Slow transactions shrink the batch, by at most half at a time.
+        batch.update(1000, 20.0)
+        self.assertEqual(batch.size, 500)
+        batch.update(500, 5.0)
+        self.assertEqual(batch.size, 500)
+        # Fast transactions grow it, by at most double at a time.
+        batch.update(500, 1.0)
+        self.assertEqual(batch.size, 1000)
+        # Empty or unmeasured transactions change nothing.
+        batch.update(0, 1.0)
+        batch.update(1000, 0.0)
+        self.assertEqual(batch.size, 1000)
+        # The size stays within its bounds.
+        batch.update(3000, 0.1)
+        self.assertEqual(batch.size, 4000)
+        batch.update(150, 100.0)
+        self.assertEqual(batch.size, 100)
+
+    def test_parse_log_levels(self):
+        self.assertEqual(self.script._parse_log_levels(["verbose", "lsst.daf.butler=WARNING"]),
+                         [(None, "VERBOSE"), ("lsst.daf.butler", "WARNING")])
+        self.assertEqual(self.script._parse_log_levels([]), [])
+
+
+class _FakePipelineGraph:
+    """The parts of `lsst.pipe.base.pipeline_graph.PipelineGraph` used to
+    make clusters.
+
+    Parameters
+    ----------
+    tasks : `list` [`tuple` [`str`, `list` [`str`], `list` [`str`]]]
+        Label, dimensions and input dataset types of each task, in order;
+        each task produces a dataset type named after its label.
+    """
+
+    def __init__(self, tasks):
+        self.tasks = {label: SimpleNamespace(label=label, dimensions=SimpleNamespace(required=dimensions))
+                      for label, dimensions, _ in tasks}
+        self._inputs = {label: inputs for label, _, inputs in tasks}
+
+    def sort(self):
+        pass
+
+    def inputs_of(self, label):
+        return dict.fromkeys(self._inputs[label])
+
+    def producer_of(self, datasetType):
+        return self.tasks.get(datasetType)
+
+
+class MakeClusteringConfigTestSuite(lsst.utils.tests.TestCase):
+    def setUp(self):
+        self.script = load_script("bps/make_clustering_config.py")
+        self.args = SimpleNamespace(default_runtime=10.0, cheap_runtime=30.0, target_runtime=600.0,
+                                    equal_dimensions="visit:exposure", exclude="")
+
+    def _clusters(self, tasks, runtimes=None):
+        clusters = self.script.make_clusters(_FakePipelineGraph(tasks), runtimes or {}, self.args)
+        return [(cluster.labels, cluster.dimensions, cluster.excluded) for cluster in clusters]
+
+    def test_dimensions(self):
+        """Test that tasks only join producers with the same dimensions,
+        after applying equalDimensions.
+        """
+        tasks = [("isr", ["instrument", "exposure", "detector"], ["raw"]),
+                 ("calibrate", ["instrument", "visit", "detector"], ["isr"]),
+                 ("consolidate", ["instrument", "visit"], ["calibrate"]),
+                 ]
+        self.assertEqual(self._clusters(tasks), [
+            (["isr", "calibrate"], ("visit", "detector"), False),
+            (["consolidate"], ("visit",), False),
+        ])
+
+    def test_runtime(self):
+        """Test that expensive tasks do not grow clusters past the target.
+        """
+        tasks = [("a", ["instrument", "visit", "detector"], []),
+                 ("b", ["instrument", "visit", "detector"], ["a"]),
+                 ("c", ["instrument", "visit", "detector"], ["b"]),
+                 ]
+        self.assertEqual(self._clusters(tasks, {"a": 400.0, "b": 5.0, "c": 300.0}), [
+            (["a", "b"], ("visit", "detector"), False),
+            (["c"], ("visit", "detector"), False),
+        ])
+
+    def test_exclude(self):
+        """Test that excluded tasks stay alone, and nothing joins them.
+        """
+        self.args.exclude = "b"
+        tasks = [("a", ["instrument", "visit", "detector"], []),
+                 ("b", ["instrument", "visit", "detector"], ["a"]),
+                 ("c", ["instrument", "visit", "detector"], ["b"]),
+                 ]
+        self.assertEqual(self._clusters(tasks), [
+            (["a"], ("visit", "detector"), False),
+            (["b"], ("visit", "detector"), True),
+            (["c"], ("visit", "detector"), False),
+        ])
+
+    def test_no_cycles(self):
+        """Test that a task does not join a cluster that another of its
+        producers depends on.
+        """
+        tasks = [("a", ["instrument", "visit", "detector"], []),
+                 ("b", ["instrument", "visit"], ["a"]),
+                 ("c", ["instrument", "visit", "detector"], ["a", "b"]),
+                 ]
+        self.assertEqual(self._clusters(tasks), [
+            (["a"], ("visit", "detector"), False),
+            (["b"], ("visit",), False),
+            (["c"], ("visit", "detector"), False),
+        ])
+
+
+class RecommendBpsResourcesTestSuite(lsst.utils.tests.TestCase):
+    def setUp(self):
+        self.script = load_script("bps/recommend_bps_resources.py")
+        self.args = SimpleNamespace(memory_headroom=0.2, walltime_headroom=1.0, min_memory=2048,
+                                    memory_step=512, min_walltime=600)
+
+    @staticmethod
+    def _makeMetadata(maxRss=2**30, prepUtc="2025-01-01T00:00:00+00:00",
+                      endUtc="2025-01-01T00:01:30+00:00"):
+        metadata = TaskMetadata()
+        for key, value in [("endMaxResidentSetSize", maxRss), ("prepUtc", prepUtc), ("endUtc", endUtc)]:
+            if value is not None:
+                metadata[f"quantum.{key}"] = value
+        return metadata
+
+    def test_read_quantum_resources(self):
+        """Test that memory is converted from bytes to MB, and run time is
+        measured from the start of preparation.
+        """
+        memory, runtime = self.script.read_quantum_resources(self._makeMetadata())
+        self.assertEqual(memory, 1024.0)
+        self.assertEqual(runtime, 90.0)
+
+    def test_read_quantum_resources_bad(self):
+        """Test that missing or badly typed metadata is skipped.
+        """
+        self.assertIsNone(self.script.read_quantum_resources(TaskMetadata()))
+        for kwargs in [{"maxRss": None}, {"prepUtc": None}, {"endUtc": None},
+                       {"prepUtc": 42}, {"endUtc": "yesterday"}]:
+            with self.subTest(**kwargs):
+                self.assertIsNone(self.script.read_quantum_resources(self._makeMetadata(**kwargs)))
+
+    def test_summarize(self):
+        resources = [(float(memory), 10.0 * memory) for memory in range(1, 101)]
+        profile = self.script.summarize(resources, 0.5)
+        self.assertEqual(profile["quanta"], 100)
+        self.assertEqual(profile["memoryQuantile"], 50.5)
+        self.assertEqual(profile["memoryMax"], 100.0)
+        self.assertEqual(profile["runtimeMedian"], 505.0)
+        self.assertEqual(profile["runtimeQuantile"], 505.0)
+        self.assertEqual(profile["runtimeMax"], 1000.0)
+
+    def test_recommend(self):
+        """Test that memory is rounded up to the step, walltime to whole
+        minutes, and both are at least their floors.
+        """
+        # 2900 MB * 1.2 = 3480 MB, rounded up to 7 * 512; 400 s * 2 = 800 s,
+        # rounded up to 14 minutes.
+        self.assertEqual(self.script.recommend({"memoryQuantile": 2900.0, "runtimeQuantile": 400.0},
+                                               self.args),
+                         {"requestMemory": 3584, "requestWalltime": 840})
+        # An exact multiple is not rounded further.
+        self.assertEqual(self.script.recommend({"memoryQuantile": 2560.0, "runtimeQuantile": 330.0},
+                                               self.args),
+                         {"requestMemory": 3072, "requestWalltime": 660})
+        self.assertEqual(self.script.recommend({"memoryQuantile": 100.0, "runtimeQuantile": 1.0},
+                                               self.args),
+                         {"requestMemory": 2048, "requestWalltime": 600})
+
+    def test_recommend_clusters(self):
+        """Test that clusters take the largest memory and the summed
+        walltime of their known tasks.
+        """
+        requests = {"isr": {"requestMemory": 4096, "requestWalltime": 600},
+                    "calibrate": {"requestMemory": 2048, "requestWalltime": 1200},
+                    }
+        clustering = {"cluster": {"visit": {"pipetasks": "isr, calibrate, unknown"},
+                                  "other": {"pipetasks": "unknown"},
+                                  }}
+        self.assertEqual(self.script.recommend_clusters(clustering, requests),
+                         {"visit": {"requestMemory": 4096, "requestWalltime": 1800}})
+        self.assertEqual(self.script.recommend_clusters({}, requests), {})
+
+
+class ShardFakeCatalogsTestSuite(lsst.utils.tests.TestCase):
+    def setUp(self):
+        self.script = load_script("fakes/shard_fake_catalogs.py")
+
+    def test_htm_indices(self):
+        """Test that the vectorized HTM indexing agrees with sphgeom,
+        including on the edges of the root trixels and near other edges.
+        """
+        rng = np.random.default_rng(42)
+        ra = rng.uniform(0.0, 360.0, 5000)
+        dec = np.rad2deg(np.arcsin(rng.uniform(-1.0, 1.0, 5000)))
+        # Edges of the root trixels, and their neighbourhoods.
+        edges = [0.0, 90.0, 180.0, 270.0, 360.0]
+        ra = np.concatenate([ra, np.repeat(edges, 5), rng.choice(edges, 500) + rng.normal(0.0, 1e-12, 500)])
+        dec = np.concatenate([dec, np.tile([-90.0, -45.0, 0.0, 30.0, 90.0], 5),
+                              rng.choice([0.0, 0.0, 89.9999, -10.0], 500) + rng.normal(0.0, 1e-12, 500)])
+        # Points on the edges of the trixels of the level being indexed.
+        pixelization = HtmPixelization(7)
+        for trixel in rng.integers(8*4**7, 16*4**7, 50):
+            vertices = list(pixelization.triangle(int(trixel)).getVertices())
+            for a, b in zip(vertices, vertices[1:] + vertices[:1]):
+                for t in (0.0, 0.5, 1.0):
+                    lonLat = LonLat(UnitVector3d(a.x()*(1 - t) + b.x()*t, a.y()*(1 - t) + b.y()*t,
+                                                 a.z()*(1 - t) + b.z()*t))
+                    ra = np.append(ra, lonLat.getLon().asDegrees())
+                    dec = np.append(dec, lonLat.getLat().asDegrees())
+
+        indices = self.script._htm_indices(ra, dec)
+        expected = [pixelization.index(UnitVector3d(LonLat.fromDegrees(r, d))) for r, d in zip(ra, dec)]
+        np.testing.assert_array_equal(indices, expected)
+
+    def test_sharder_skipped_shards(self):
+        """Test that rows of resumed shards are skipped silently, and rows of
+        shards already in the output collection are counted.
+        """
+        table = Table({"ra": [10.0, 10.0001, 50.0, 50.0001, 100.0], "dec": [5.0, 5.0001, -20.0, -20.0, 40.0]})
+        trixels = self.script._htm_indices(table["ra"], table["dec"]).tolist()
+        existing, resumed, new = trixels[0], trixels[2], trixels[4]
+        self.assertEqual(len({existing, resumed, new}), 3)
+
+        written = {}
+
+        def write(shard, band, trixel):
+            written[(band, trixel)] = shard
+
+        sharder = self.script._TrixelSharder(write, resumed={("g", resumed)}, existing={("g", existing)})
+        sharder.expect("g", None)
+        sharder.add(table, "g", None)
+        sharder.finish()
+        self.assertEqual(list(written), [("g", new)])
+        self.assertEqual(len(written[("g", new)]), 1)
+        self.assertEqual(sharder.dropped, {("g", existing): 2})
+
+        # A shard that is both is one that this run wrote before.
+        sharder = self.script._TrixelSharder(lambda *_: None, resumed={("g", existing)},
+                                             existing={("g", existing)})
+        sharder.expect("g", None)
+        sharder.add(table, "g", None)
+        self.assertEqual(sharder.dropped, {})
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()